@@ -0,0 +1,29 @@
+"""
+Run the benchmark suites and write one JSON result file per suite.
+
+    python -m benchmarks                      # micro + modbus_codec + pipeline
+    python -m benchmarks --suite fanout       # needs uvicorn
+    python -m benchmarks --suite summary_queries  # needs a scratch MySQL database
+"""
+import argparse
+from benchmarks import micro, modbus_codec, pipeline, fanout, summary_queries
+
+SUITES = {
+    'micro': micro.main,
+    'modbus_codec': modbus_codec.main,
+    'pipeline': pipeline.main,
+    'fanout': fanout.main,
+    'summary_queries': summary_queries.main,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--suite', choices=sorted(SUITES), action='append', help="Repeat to run several suites")
+    args = parser.parse_args()
+    for suite in args.suite or ['micro', 'modbus_codec', 'pipeline']:
+        SUITES[suite]([])
+
+
+if __name__ == '__main__':
+    main()
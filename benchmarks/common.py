@@ -0,0 +1,113 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+# Shared helpers for the benchmark suites: timing loops, percentiles and the
+# JSON result format read by benchmarks/compare.py.
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+def percentiles(values, points=(50, 90, 99)):
+    """Nearest-rank percentiles plus min/max/mean of a list of numbers."""
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+    result = {
+        'count': len(ordered),
+        'min': ordered[0],
+        'max': ordered[-1],
+        'mean': statistics.fmean(ordered),
+    }
+    for point in points:
+        index = max(0, min(len(ordered) - 1, round(point / 100 * len(ordered)) - 1))
+        result[f"p{point}"] = ordered[index]
+    return result
+
+
+def bench(function, *args, min_time=0.2, repeat=5):
+    """
+    Time function(*args) in a calibrated loop and return per-call nanoseconds.
+    The loop count doubles until one run takes min_time; the best and median
+    of `repeat` runs are reported.
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            function(*args)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2
+    runs = [elapsed]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            function(*args)
+        runs.append(time.perf_counter() - start)
+    per_call = [run / loops * 1e9 for run in runs]
+    return {
+        'loops': loops,
+        'best_ns': min(per_call),
+        'median_ns': statistics.median(per_call),
+        'ops_per_second': loops / statistics.median(runs),
+    }
+
+
+def process_cpu_seconds(pid):
+    """User + system CPU seconds consumed by a process (Linux /proc)."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    ticks = os.sysconf('SC_CLK_TCK')
+    return (int(fields[11]) + int(fields[12])) / ticks
+
+
+def write_results(suite, results, parameters=None, output=None):
+    """
+    Write {"suite", "environment", "parameters", "results"} as JSON. Without an
+    explicit output path the file goes to benchmarks/results/<suite>-<commit>.json.
+    """
+    document = {
+        'suite': suite,
+        'environment': environment(),
+        'parameters': parameters or {},
+        'results': results,
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{suite}-{document['environment']['commit'] or 'local'}.json")
+    if output == '-':
+        json.dump(document, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(output, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f"Wrote {output}")
+    return document
@@ -0,0 +1,73 @@
+"""
+Compare two benchmark result files and flag regressions.
+
+    python -m benchmarks.compare benchmarks/results/micro-abc123.json benchmarks/results/micro-def456.json
+
+Every numeric leaf present in both files is compared. Keys where lower is
+better (times, latencies, lag, CPU) and higher is better (throughput) are
+recognised by name; the exit status is 1 if any changed by more than
+--threshold percent in the wrong direction.
+"""
+import argparse
+import json
+import sys
+
+LOWER_IS_BETTER = ('_ns', 'seconds', 'latency', 'lag', 'cpu', 'rows_examined')
+HIGHER_IS_BETTER = ('per_second', 'frames_per_client', 'ops')
+IGNORED = ('count', 'loops', 'min', 'max', 'clients', 'rows_written', 'batches', 'frames_received', 'queue_depth_end')
+
+
+def _leaves(value, path=()):
+    if isinstance(value, dict):
+        for key, child in value.items():
+            yield from _leaves(child, path + (key,))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield path, value
+
+
+def _direction(path):
+    if path[-1] in IGNORED:
+        return 0
+    name = '.'.join(path)
+    if any(token in name for token in HIGHER_IS_BETTER):
+        return 1
+    if any(token in name for token in LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def compare(baseline, candidate, threshold=10.0):
+    """Return (rows, regressions) where rows are (path, old, new, change %)."""
+    old = dict(_leaves(baseline['results']))
+    new = dict(_leaves(candidate['results']))
+    rows, regressions = [], []
+    for path in old:
+        if path not in new or not _direction(path):
+            continue
+        change = (new[path] - old[path]) / old[path] * 100 if old[path] else 0.0
+        rows.append(('.'.join(path), old[path], new[path], change))
+        if change * _direction(path) < -threshold:
+            regressions.append(rows[-1])
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0, help="Allowed change in percent")
+    args = parser.parse_args(argv)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    rows, regressions = compare(baseline, candidate, args.threshold)
+    print(f"{baseline['environment'].get('commit')} -> {candidate['environment'].get('commit')} ({baseline['suite']})")
+    for name, old, new, change in rows:
+        marker = '  REGRESSION' if (name, old, new, change) in regressions else ''
+        print(f"{name:50s} {old:14.3f} {new:14.3f} {change:+8.1f}%{marker}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
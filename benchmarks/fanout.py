@@ -0,0 +1,154 @@
+"""
+Live-stream fan-out benchmark.
+
+Starts the API under uvicorn in a subprocess, wired to a simulated AC meter,
+connects N concurrent clients to /ac/latest/live and measures:
+
+- delivery lag: time from the simulator producing a reading to each client
+  receiving the matching SSE frame (readings are matched on power/energy)
+- server CPU seconds per second of wall time (from /proc)
+
+    python -m benchmarks.fanout --clients 1 --clients 50 --clients 200 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from benchmarks.common import REPO_DIR, percentiles, process_cpu_seconds, write_results
+from tools.pzem_simulator import create_ac_bus
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ReadingLog:
+    """Simulator reply times keyed by the values the SSE frame exposes."""
+
+    def __init__(self):
+        self.sent_at = {}
+
+    def __call__(self, address, registers, sent_at):
+        power = round((registers[4] << 16 | registers[3]) * 0.1, 4)
+        energy = registers[6] << 16 | registers[5]
+        self.sent_at.setdefault((power, energy), sent_at)
+
+    def lag(self, frame, received_at):
+        sent_at = self.sent_at.get((frame['power'], frame['energy']))
+        return None if sent_at is None else received_at - sent_at
+
+
+async def _client(url, readings, lags, counts, stop_at):
+    received = 0
+    try:
+        async with httpx.AsyncClient(timeout=None) as client:
+            async with client.stream('GET', url) as response:
+                async for line in response.aiter_lines():
+                    if not line.startswith('data: '):
+                        if time.time() >= stop_at:
+                            break
+                        continue
+                    now = time.time()
+                    lag = readings.lag(json.loads(line[6:]), now)
+                    if lag is not None:
+                        lags.append(lag)
+                    received += 1
+                    if now >= stop_at:
+                        break
+    except (httpx.HTTPError, asyncio.CancelledError):
+        pass
+    counts.append(received)
+
+
+async def _run_clients(url, clients, duration, readings):
+    lags, counts = [], []
+    stop_at = time.time() + duration
+    tasks = [asyncio.create_task(_client(url, readings, lags, counts, stop_at)) for _ in range(clients)]
+    # Frames arrive about once a second; do not wait on clients stuck in a read past the deadline
+    done, pending = await asyncio.wait(tasks, timeout=duration + 5)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    return lags, counts
+
+
+def _wait_for_server(base_url, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{base_url}/metrics", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not come up")
+
+
+def run(client_counts=(1, 10, 50), duration=20.0, settle=3.0):
+    link = os.path.join(tempfile.mkdtemp(prefix='powermon-bench-'), 'pzem-ac')
+    readings = ReadingLog()
+    bus = create_ac_bus(link, [1], noise=20.0, on_reply=readings).start()
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        AC_SERIAL_PORT=link,
+        AC_SLAVE_ADDRESS='1',
+        SOLAR_SERIAL_PORT=os.path.join(os.path.dirname(link), 'missing-solar'),
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    results = {}
+    try:
+        _wait_for_server(base_url)
+        time.sleep(settle)
+        for clients in client_counts:
+            cpu_before = process_cpu_seconds(server.pid)
+            start = time.perf_counter()
+            lags, counts = asyncio.run(_run_clients(f"{base_url}/ac/latest/live", clients, duration, readings))
+            elapsed = time.perf_counter() - start
+            cpu = process_cpu_seconds(server.pid) - cpu_before
+            results[str(clients)] = {
+                'clients': clients,
+                'frames_received': sum(counts),
+                'frames_per_client': sum(counts) / clients,
+                'server_cpu_seconds': cpu,
+                'server_cpu_utilisation': cpu / elapsed,
+                'lag_ms': {key: (value * 1000 if key != 'count' else value) for key, value in percentiles(lags).items()},
+            }
+            print(f"{clients:5d} clients: {sum(counts) / clients:.1f} frames/client, "
+                  f"lag p50 {results[str(clients)]['lag_ms'].get('p50', 0):.1f} ms, "
+                  f"p99 {results[str(clients)]['lag_ms'].get('p99', 0):.1f} ms, cpu {cpu / elapsed:.1%}")
+            time.sleep(settle)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        bus.stop()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, action='append', help="Concurrent clients; repeat for a sweep (default 1, 10, 50)")
+    parser.add_argument('--duration', type=float, default=20.0, help="Seconds per client count")
+    parser.add_argument('--output', help="Result file ('-' for stdout)")
+    args = parser.parse_args(argv)
+    client_counts = args.clients or [1, 10, 50]
+    results = run(client_counts, args.duration)
+    return write_results('fanout', results, {'clients': client_counts, 'duration': args.duration}, args.output)
+
+
+if __name__ == '__main__':
+    main()
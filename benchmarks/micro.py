@@ -0,0 +1,154 @@
+"""
+Microbenchmarks for the per-sample hot path:
+
+- Modbus CRC16 over request and response frames
+- register unpacking and parse_pzem_data for both meters
+- SSE frame encoding as done by the live endpoints
+- a 720-row summary page: per-row models re-validated by the response model
+  (the previous path) against encoding the DB rows directly
+- settling a month of hourly energy against a tariff: a Python loop over the
+  hours against the numpy operations of features/billing
+- evaluating the default alert rules on one AC sample, alone and with 500
+  more device-specific rules spread over 100 other meters
+
+    python -m benchmarks.micro [--output FILE]
+"""
+import argparse
+import json
+import struct
+import warnings
+import numpy as np
+from datetime import datetime, timedelta
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from benchmarks.common import bench, write_results
+from common import responses
+from features.ac_monitor import modbus as ac_modbus
+from features.solar_monitor import modbus as solar_modbus
+from features.ac_monitor.models import ACMeasurement
+from features.solar_monitor.models import SolarMeasurement
+from features.summary.models import HourSummary
+from features.billing.service import _settle
+from features.billing.tariffs import get_tariff, month_profile
+from common.alerts import DEFAULT_RULES, Engine, _compile
+from tools.pzem_simulator import build_response
+
+AC_REGISTERS = (2301, 4350, 0, 9512, 0, 48211, 2, 500, 95, 0)
+SOLAR_REGISTERS = (4812, 2105, 10132, 0, 51234, 0, 0, 0)
+AC_CONFIG = {'slave_address': 1, 'serial_port': 'bench'}
+SOLAR_CONFIG = {'slave_address': 2, 'serial_port': 'bench'}
+
+# The frame encoders mirror the live endpoints, which still call the pydantic v1 .dict()
+warnings.filterwarnings('ignore', category=DeprecationWarning, module=__name__)
+
+
+def _unpack_and_parse(module, response, count, config):
+    registers = struct.unpack(f'>{count}H', response[3:-2])
+    return module.parse_pzem_data(registers, config)
+
+
+def _ac_sse_frame(item):
+    timestamp, voltage, current, power, energy, frequency, power_factor = item
+    measurement = ACMeasurement(
+        voltage=voltage, current=current, power=power, energy=energy,
+        frequency=frequency, power_factor=power_factor
+    )
+    return f"data: {json.dumps(measurement.dict())}\n\n"
+
+
+def _solar_sse_frame(item):
+    timestamp, voltage, current, power, energy = item
+    measurement = SolarMeasurement(voltage=voltage, current=current, power=power, energy=energy)
+    return f"data: {json.dumps(measurement.dict())}\n\n"
+
+
+def _summary_rows(count=720):
+    start = datetime(2024, 1, 1)
+    return [{
+        'timestamp': start + timedelta(hours=i), 'energyConsumption': 512.0 + i % 7, 'avgVoltage': 229.81,
+        'avgCurrent': 2.31, 'avgPower': 511.42, 'avgFrequency': 50.0, 'avgPF': 0.93,
+    } for i in range(count)]
+
+
+HOUR_SUMMARY_LIST = TypeAdapter(list[HourSummary])
+
+
+def _summary_via_models(rows):
+    models = [HourSummary(**row) for row in rows]
+    return json.dumps(jsonable_encoder(HOUR_SUMMARY_LIST.validate_python(models))).encode()
+
+
+def _month_energy(hours=744):
+    hour = np.arange(hours)
+    consumption = 300.0 + (hour * 37) % 400 + np.where((hour % 24 >= 17) & (hour % 24 <= 21), 800, 0)
+    production = np.maximum(0.0, 1500 - np.abs(hour % 24 - 12) * 250)
+    return consumption, production
+
+
+def _settle_loop(tariff, year, month, consumption, production):
+    rates, _, _ = month_profile(tariff['tariff_id'], year, month)
+    imported = exported = cost = credit = 0.0
+    for hour, (used, produced) in enumerate(zip(consumption.tolist(), production.tolist())):
+        net = used - produced
+        if net > 0:
+            imported += net
+            cost += net * rates[hour]
+        else:
+            exported -= net
+            credit -= net * tariff['export_rate']
+    return imported / 1000, exported / 1000, cost / 1000, credit / 1000
+
+
+def _alert_engine(extra_devices=0, rules_per_device=5):
+    entries = list(DEFAULT_RULES) + [
+        {'name': f'device-{device}-rule-{i}', 'kind': 'consumption', 'devices': [device], 'metric': 'power',
+         'stat': 'max', 'window': 60, 'op': '>', 'threshold': 1000 + i}
+        for device in range(100, 100 + extra_devices) for i in range(rules_per_device)
+    ]
+    engine = Engine([_compile(entry, 'bench') for entry in entries], lambda event: None)
+    for device in range(100, 100 + extra_devices):
+        engine.evaluate('consumption', device, ('2024-01-01 12:00:00', 230.1, 4.35, 951.2, 179347, 50.0, 0.95))
+    return engine
+
+
+def run(min_time=0.2, repeat=5):
+    request = struct.pack('>BBHH', 1, 0x04, 0, 10)
+    ac_response = build_response(1, AC_REGISTERS)
+    solar_response = build_response(2, SOLAR_REGISTERS)
+    ac_item = ('2024-01-01 12:00:00', 230.1, 4.35, 951.2, 179347, 50.0, 0.95)
+    solar_item = ('2024-01-01 12:00:00', 48.12, 21.05, 1013.2, 51234)
+
+    cases = {
+        'crc_request': (ac_modbus.calculate_crc, request),
+        'crc_ac_response': (ac_modbus.calculate_crc, ac_response[:-2]),
+        'crc_solar_response': (solar_modbus.calculate_crc, solar_response[:-2]),
+        'parse_ac': (_unpack_and_parse, ac_modbus, ac_response, 10, AC_CONFIG),
+        'parse_solar': (_unpack_and_parse, solar_modbus, solar_response, 8, SOLAR_CONFIG),
+        'sse_frame_ac': (_ac_sse_frame, ac_item),
+        'sse_frame_solar': (_solar_sse_frame, solar_item),
+        'summary_page_models': (_summary_via_models, _summary_rows()),
+        f'summary_page_rows_{responses.JSON_BACKEND}': (responses.dumps, _summary_rows()),
+        'billing_month_loop': (_settle_loop, get_tariff('flat'), 2025, 7, *_month_energy()),
+        'billing_month_numpy': (_settle, get_tariff('flat'), 2025, 7, *_month_energy()),
+        'alerts_evaluate_ac': (_alert_engine().evaluate, 'consumption', 1, ac_item),
+        'alerts_evaluate_ac_fleet': (_alert_engine(100).evaluate, 'consumption', 1, ac_item),
+    }
+    results = {}
+    for name, (function, *args) in cases.items():
+        results[name] = bench(function, *args, min_time=min_time, repeat=repeat)
+        print(f"{name:26s} {results[name]['median_ns']:12.0f} ns/op")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--min-time', type=float, default=0.2, help="Seconds per timing run")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help="Result file ('-' for stdout)")
+    args = parser.parse_args(argv)
+    results = run(args.min_time, args.repeat)
+    return write_results('micro', results, {'min_time': args.min_time, 'repeat': args.repeat}, args.output)
+
+
+if __name__ == '__main__':
+    main()
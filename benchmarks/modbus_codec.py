@@ -0,0 +1,93 @@
+"""
+Modbus RTU codec throughput (common/modbus.py).
+
+Compares the shared codec with the per-request approach it replaced
+(byte-wise CRC, re-packed headers, sliced CRC comparison, format-string
+unpack) for CRC, request encoding and response decoding, and measures the
+full poll path against an in-memory serial port to give the highest poll
+rate one core can sustain, metrics included.
+
+    python -m benchmarks.modbus_codec [--output FILE]
+"""
+import argparse
+import struct
+from benchmarks.common import bench, write_results
+from common import modbus
+from tools.pzem_simulator import build_response
+
+AC_REGISTERS = (2301, 4350, 0, 9512, 0, 48211, 2, 500, 95, 0)
+
+
+def legacy_crc(data):
+    crc = 0xFFFF
+    table = modbus.CRC16_TABLE
+    for byte in data:
+        crc ^= byte
+        crc = (crc >> 8) ^ table[crc & 0xFF]
+    return struct.pack('<H', crc)
+
+
+def legacy_encode(slave, function_code, address, count):
+    command = struct.pack('>BBHH', slave, function_code, address, count)
+    return command + legacy_crc(command)
+
+
+def legacy_decode(response, count):
+    if len(response) < 5 + 2 * count or legacy_crc(response[:-2]) != response[-2:]:
+        return None
+    return struct.unpack(f'>{count}H', response[3:-2])
+
+
+def codec_decode(response, count):
+    frame = memoryview(response)
+    if len(frame) < modbus.response_length(count) or not modbus.frame_ok(frame):
+        return None
+    return modbus.decode_registers(frame, count)
+
+
+class MemorySerial:
+    """Serial stand-in answering every request with a fixed response."""
+
+    def __init__(self, response):
+        self.response = response
+
+    def write(self, data):
+        return len(data)
+
+    def read(self, size):
+        return self.response
+
+
+def run(min_time=0.2, repeat=5):
+    response = build_response(1, AC_REGISTERS)
+    payload = response[:-2]
+    port = MemorySerial(response)
+    cases = {
+        'crc_legacy': (legacy_crc, payload),
+        'crc_python': (modbus.crc16_python, payload),
+        'crc_active': (modbus.crc16, payload),
+        'encode_legacy': (legacy_encode, 1, modbus.READ_HOLDING_REGISTERS, 0, 10),
+        'encode_cached': (modbus.request_frame, 1, modbus.READ_HOLDING_REGISTERS, 0, 10),
+        'decode_legacy': (legacy_decode, response, 10),
+        'decode_codec': (codec_decode, response, 10),
+        'poll_read_registers': (modbus.read_registers, port, 1, modbus.READ_HOLDING_REGISTERS, 0, 10, 'bench'),
+    }
+    results = {'crc_backend': modbus.CRC_BACKEND}
+    for name, (function, *args) in cases.items():
+        results[name] = bench(function, *args, min_time=min_time, repeat=repeat)
+        print(f"{name:22s} {results[name]['median_ns']:8.0f} ns/op {results[name]['ops_per_second']:12,.0f} ops/s")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--min-time', type=float, default=0.2, help="Seconds per timing run")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help="Result file ('-' for stdout)")
+    args = parser.parse_args(argv)
+    results = run(args.min_time, args.repeat)
+    return write_results('modbus_codec', results, {'min_time': args.min_time, 'repeat': args.repeat}, args.output)
+
+
+if __name__ == '__main__':
+    main()
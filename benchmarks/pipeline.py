@@ -0,0 +1,220 @@
+"""
+Capture -> storage pipeline benchmark.
+
+Runs the real capture_*_data and transfer_*_to_database threads against a
+simulated meter (tools/pzem_simulator.py) and measures sustained samples/s
+and capture-to-commit latency. The storage side is either the configured
+MySQL database (--db mysql, using DB_* settings) or a null stand-in that
+accepts writes without I/O (--db null), which isolates the Python overhead.
+
+The pipeline's fixed poll/flush sleeps are multiplied by --time-scale so the
+loops run as fast as the pty round trip allows; 1.0 reproduces production
+pacing (1 sample/s per meter, flushes every 5-30 s).
+
+    python -m benchmarks.pipeline --stream ac --duration 20 --db null
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from queue import Queue
+from benchmarks.common import percentiles, write_results
+from common import devices
+from tools.pzem_simulator import create_ac_bus, create_solar_bus, Faults
+
+
+class TimedQueue(Queue):
+    """Queue that remembers when each item was enqueued, keyed by identity."""
+
+    def __init__(self, maxsize=0):
+        super().__init__(maxsize)
+        self.enqueued_at = {}
+
+    def put(self, item, block=True, timeout=None):
+        self.enqueued_at[id(item)] = time.perf_counter()
+        super().put(item, block, timeout)
+
+
+class _ScaledTime:
+    """Stand-in for the time module inside a service module: sleeps are scaled."""
+
+    def __init__(self, scale):
+        self.scale = scale
+
+    def sleep(self, seconds):
+        time.sleep(seconds * self.scale)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class _ScaledEvent(threading.Event):
+    """Stop event whose waits (the writers' pauses between flushes) are scaled like _ScaledTime."""
+
+    def __init__(self, scale):
+        super().__init__()
+        self.scale = scale
+
+    def wait(self, timeout=None):
+        return super().wait(None if timeout is None else timeout * self.scale)
+
+
+class _NullCursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        return 0
+
+    def executemany(self, sql, rows):
+        return len(rows)
+
+    def fetchall(self):
+        return []
+
+
+class _NullConnection:
+    def cursor(self):
+        return _NullCursor()
+
+    def commit(self):
+        pass
+
+
+@contextmanager
+def null_db_connection():
+    yield _NullConnection()
+
+
+STREAMS = {
+    'ac': {
+        'module': 'features.ac_monitor.service',
+        'modbus': 'features.ac_monitor.modbus',
+        'capture': 'capture_ac_data',
+        'transfer': 'transfer_ac_to_database',
+        'log_batch': '_log_ac_batch',
+        'bus': create_ac_bus,
+        'env': ('AC_SERIAL_PORT', 'AC_SLAVE_ADDRESS'),
+        'address': 1,
+    },
+    'solar': {
+        'module': 'features.solar_monitor.service',
+        'modbus': 'features.solar_monitor.modbus',
+        'capture': 'capture_solar_data',
+        'transfer': 'transfer_solar_to_database',
+        'log_batch': '_log_solar_batch',
+        'bus': create_solar_bus,
+        'env': ('SOLAR_SERIAL_PORT', 'SOLAR_SLAVE_ADDRESS'),
+        'address': 2,
+    },
+}
+
+
+def run(stream='ac', duration=20.0, db='null', time_scale=0.001, latency_ms=0.0, warmup=2.0):
+    import importlib
+    spec = STREAMS[stream]
+    link = os.path.join(tempfile.mkdtemp(prefix='powermon-bench-'), f"pzem-{stream}")
+    port_var, address_var = spec['env']
+    os.environ[port_var] = link
+    os.environ[address_var] = format(spec['address'], 'x')
+    os.environ.setdefault('COMPRESSION_MODE', 'off')
+    os.environ.setdefault('STORAGE_SCHEMA', 'float')
+
+    # The device registry and the Modbus defaults are cached from the
+    # environment; drop them so this stream's port and address take effect
+    devices.reset()
+    importlib.import_module(spec['modbus'])._default_config.cache_clear()
+    service = importlib.import_module(spec['module'])
+    bus = spec['bus'](link, [spec['address']], faults=Faults(latency_ms=latency_ms)).start()
+
+    service.time = _ScaledTime(time_scale)
+    if db == 'null':
+        service.db_connection = null_db_connection
+
+    data_queue = TimedQueue(maxsize=100000)
+    latencies = []
+    written = {'rows': 0, 'batches': 0}
+    measuring = threading.Event()
+    log_batch = getattr(service, spec['log_batch'])
+
+    def timed_log_batch(connection, batch, config, compact):
+        stored = log_batch(connection, batch, config, compact)
+        if not stored:
+            return stored
+        now = time.perf_counter()
+        for row in batch:
+            enqueued = data_queue.enqueued_at.pop(id(row), None)
+            if measuring.is_set():
+                written['rows'] += 1
+                if enqueued is not None:
+                    latencies.append(now - enqueued)
+        if measuring.is_set():
+            written['batches'] += 1
+        return stored
+
+    setattr(service, spec['log_batch'], timed_log_batch)
+
+    stop_event = _ScaledEvent(time_scale)
+    threads = [
+        threading.Thread(target=getattr(service, spec['capture']), args=(data_queue, stop_event), daemon=True),
+        threading.Thread(target=getattr(service, spec['transfer']), args=(data_queue, stop_event), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        time.sleep(warmup)
+        requests_before = bus.requests
+        measuring.set()
+        start = time.perf_counter()
+        time.sleep(duration)
+        measuring.clear()
+        elapsed = time.perf_counter() - start
+        requests = bus.requests - requests_before
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join(timeout=5)
+        bus.stop()
+        setattr(service, spec['log_batch'], log_batch)
+        service.time = time
+
+    result = {
+        'samples_per_second': written['rows'] / elapsed,
+        'modbus_requests_per_second': requests / elapsed,
+        'rows_written': written['rows'],
+        'batches': written['batches'],
+        'queue_depth_end': data_queue.qsize(),
+        'latency_ms': {key: (value * 1000 if key != 'count' else value) for key, value in percentiles(latencies).items()},
+    }
+    print(f"{stream}: {result['samples_per_second']:.1f} samples/s, "
+          f"p50 {result['latency_ms'].get('p50', 0):.2f} ms, p99 {result['latency_ms'].get('p99', 0):.2f} ms")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stream', choices=sorted(STREAMS), action='append', help="Repeat for several streams (default: ac)")
+    parser.add_argument('--duration', type=float, default=20.0, help="Measured seconds per stream")
+    parser.add_argument('--db', choices=['null', 'mysql'], default='null')
+    parser.add_argument('--time-scale', type=float, default=0.001, help="Multiplier for pipeline sleeps")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Simulated meter response latency")
+    parser.add_argument('--output', help="Result file ('-' for stdout)")
+    args = parser.parse_args(argv)
+    streams = args.stream or ['ac']
+    results = {
+        stream: run(stream, args.duration, args.db, args.time_scale, args.latency_ms)
+        for stream in streams
+    }
+    parameters = {
+        'duration': args.duration, 'db': args.db, 'time_scale': args.time_scale, 'latency_ms': args.latency_ms,
+    }
+    return write_results('pipeline', results, parameters, args.output)
+
+
+if __name__ == '__main__':
+    main()
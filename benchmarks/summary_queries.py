@@ -0,0 +1,219 @@
+"""
+Summary-layer query benchmark at growing raw-table sizes.
+
+For each size (consumption rows; production grows over the same days) the
+raw tables are topped up with tools/generate_history.py, the derived tables
+are cleared, and every summary-layer operation is run: the hourly/daily
+aggregation jobs (a cold run over the whole history, then an incremental
+run), the midnight-snapshot backfill and lookups, and the /summary listings.
+Each SQL statement is recorded with its latency, cursor rowcount and rows
+examined (the session Handler_read_* delta, less the reads of the SHOW
+STATUS queries measuring it, which counts rows the storage engine read
+regardless of MySQL version).
+
+History is generated for every registered meter (common/devices.py), so set
+DEVICES_FILE to benchmark a fleet; the jobs then run per device in parallel.
+
+This TRUNCATEs the summary tables, so it refuses to run against the default
+PowerMon database unless --force is given:
+
+    DB_NAME=PowerMonBench python -m benchmarks.summary_queries --sizes 1M,10M,100M
+"""
+import argparse
+import logging
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from benchmarks.common import write_results
+from common import database
+from common.compact import RAW_TABLES, compact_storage_enabled
+from common.devices import get_devices
+from config import get_database_config
+from features.summary import service
+from tools.generate_history import connect, days_for_rows, generate, parse_count
+
+DERIVED_TABLES = ('hourSummary', 'hourSummarySolar', 'dailySummary', 'energyMidnightSnapshot')
+HANDLER_READS = (
+    'Handler_read_first', 'Handler_read_key', 'Handler_read_last', 'Handler_read_next',
+    'Handler_read_prev', 'Handler_read_rnd', 'Handler_read_rnd_next'
+)
+
+
+def _handler_reads(raw_cursor):
+    raw_cursor.execute("SHOW SESSION STATUS LIKE 'Handler_read%'")
+    return sum(int(row['Value']) for row in raw_cursor.fetchall() if row['Variable_name'] in HANDLER_READS)
+
+
+class _RecordingCursor:
+    """Cursor proxy timing each statement and measuring the rows it examined."""
+
+    def __init__(self, cursor, raw_cursor, overhead, statements):
+        self._cursor = cursor
+        self._raw = raw_cursor
+        self._overhead = overhead
+        self._statements = statements
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+        return False
+
+    def _record(self, method, sql, params):
+        before = _handler_reads(self._raw)
+        start = time.perf_counter()
+        result = method(sql, params)
+        elapsed = time.perf_counter() - start
+        examined = max(_handler_reads(self._raw) - before - self._overhead, 0)
+        self._statements.append({
+            'sql': ' '.join(sql.split())[:160],
+            'seconds': elapsed,
+            'rowcount': self._cursor.rowcount,
+            'rows_examined': examined,
+        })
+        return result
+
+    def execute(self, sql, params=None):
+        return self._record(self._cursor.execute, sql, params)
+
+    def executemany(self, sql, params):
+        return self._record(self._cursor.executemany, sql, params)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _RecordingConnection:
+    def __init__(self, connection, statements):
+        self._connection = connection
+        self._raw = connection.cursor()
+        self._statements = statements
+        # SHOW STATUS reads rows itself: measure what one costs with no query in between
+        before = _handler_reads(self._raw)
+        self._overhead = _handler_reads(self._raw) - before
+
+    def cursor(self):
+        return _RecordingCursor(self._connection.cursor(), self._raw, self._overhead, self._statements)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+def _recording_db_connection(statements):
+    @contextmanager
+    def db_connection():
+        connection = connect()
+        try:
+            yield _RecordingConnection(connection, statements)
+        finally:
+            connection.close()
+    return db_connection
+
+
+def _operations(first_day, last_day, device_ids):
+    middle = first_day + (last_day - first_day) // 2
+    return [
+        ('update_hourly_consumption_summary.cold', service.update_hourly_consumption_summary),
+        ('update_hourly_consumption_summary.incremental', service.update_hourly_consumption_summary),
+        ('update_hourly_solar_summary.cold', service.update_hourly_solar_summary),
+        ('update_hourly_solar_summary.incremental', service.update_hourly_solar_summary),
+        ('update_daily_summary', service.update_daily_summary),
+        ('backfill_midnight_snapshots', lambda: service.backfill_midnight_snapshots(first_day, last_day)),
+        ('energy_at_midnight.single', lambda: service.get_midnight_snapshots(middle, middle, device_ids)),
+        ('energy_at_midnight.range', lambda: service.get_midnight_snapshots(first_day, last_day, device_ids)),
+        ('hourly_consumption_listing', service.get_hourly_consumption_summary),
+        ('hourly_solar_listing', service.get_hourly_solar_summary),
+        ('daily_listing', service.get_daily_summary),
+    ]
+
+
+def _table_rows(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) AS n FROM {table}")
+        return cursor.fetchone()['n']
+
+
+def run(sizes, first_day, load_data=False):
+    compact = compact_storage_enabled()
+    kinds = {kind: (tables[1] if compact else tables[0]) for kind, tables in RAW_TABLES.items()}
+    consumption_devices = [device['device_id'] for device in get_devices('consumption')]
+    production_devices = [device['device_id'] for device in get_devices('production')]
+    devices = max(len(consumption_devices), 1)
+    # Jobs open db_connection() from the service module; listings and lookups
+    # go through common.database.read_connection(), which opens its own (no
+    # replica is picked here: the lag monitor is not running)
+    originals = service.db_connection, database.db_connection
+    results = {}
+    try:
+        for size in sizes:
+            days = days_for_rows(size, devices)
+            connection = connect(local_infile=load_data)
+            try:
+                began = time.perf_counter()
+                written = generate(first_day, days, consumption_devices, production_devices, compact=compact,
+                                   load_data=load_data, connection=connection)
+                generation_seconds = time.perf_counter() - began
+                with connection.cursor() as cursor:
+                    for table in DERIVED_TABLES:
+                        cursor.execute(f"TRUNCATE TABLE {table}")
+                    for table in kinds.values():
+                        cursor.execute(f"ANALYZE TABLE {table}")
+                        cursor.fetchall()
+                connection.commit()
+                table_rows = {kind: _table_rows(connection, table) for kind, table in kinds.items()}
+            finally:
+                connection.close()
+            last_day = first_day + timedelta(days=days - 1)
+            operations = {}
+            for name, operation in _operations(first_day, last_day, consumption_devices + production_devices):
+                statements = []
+                service.db_connection = database.db_connection = _recording_db_connection(statements)
+                start = time.perf_counter()
+                operation()
+                elapsed = time.perf_counter() - start
+                operations[name] = {
+                    'seconds': elapsed,
+                    'rows_examined': sum(statement['rows_examined'] for statement in statements),
+                    'statements': statements,
+                }
+                print(f"{size:>11,d} {name:48s} {elapsed * 1000:10.1f} ms {operations[name]['rows_examined']:>12,d} rows examined")
+            results[str(size)] = {
+                'raw_rows': table_rows,
+                'rows_generated': written,
+                'generation_seconds': generation_seconds,
+                'days': days,
+                'operations': operations,
+            }
+    finally:
+        service.db_connection, database.db_connection = originals
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1M,10M,100M', help="Comma-separated consumption row counts")
+    parser.add_argument('--start', help="First day of generated history (YYYY-MM-DD). Defaults so the largest size ends yesterday.")
+    parser.add_argument('--load-data', action='store_true', help="Bulk-load with LOAD DATA LOCAL INFILE")
+    parser.add_argument('--force', action='store_true', help="Allow running against the default PowerMon database")
+    parser.add_argument('--output', help="Result file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    if get_database_config()['db_name'] == 'PowerMon' and not args.force:
+        parser.error("Refusing to truncate summary tables in PowerMon; set DB_NAME to a scratch database or pass --force")
+    sizes = sorted(parse_count(size) for size in args.sizes.split(','))
+    if args.start:
+        first_day = date.fromisoformat(args.start)
+    else:
+        first_day = date.today() - timedelta(days=days_for_rows(sizes[-1], max(len(get_devices('consumption')), 1)))
+    logging.basicConfig(level=logging.WARNING)
+    results = run(sizes, first_day, args.load_data)
+    parameters = {
+        'sizes': sizes, 'devices': len(get_devices()), 'start': first_day.isoformat(),
+        'schema': 'compact' if compact_storage_enabled() else 'float', 'load_data': args.load_data,
+    }
+    return write_results('summary_queries', results, parameters, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,507 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from queue import Queue, Empty, Full
+from config import get_alert_config
+from common.database import db_connection, log_alert_events
+from common.livebus import ingest_enabled, register_stream, publish as live_publish
+from common.metrics import counter
+from common.pipeline import join_threads
+
+# Threshold alerts evaluated on every live sample.
+#
+# Rules come from ALERT_RULES_FILE, a JSON list, or DEFAULT_RULES without it:
+#
+#     [{"name": "overvoltage", "kind": "consumption", "metric": "voltage",
+#       "stat": "ewma", "span": 5, "op": ">", "threshold": 253, "clear": 250,
+#       "for": 10, "clear_for": 30, "severity": "critical"},
+#      {"name": "solar-underperforming", "kind": "production", "devices": [2],
+#       "metric": "power", "stat": "ewma", "span": 300, "op": "<",
+#       "threshold": 150, "hours": [10, 15], "for": 900}]
+#
+# A rule compares one statistic of a metric with its threshold:
+#
+#     value    the sample itself
+#     ewma     exponentially weighted mean over about `span` samples
+#     min/max  minimum/maximum over the last `window` seconds (monotonic
+#              deques), so "min power > X" means X was exceeded throughout
+#     zscore   deviation of the sample from the meter's mean since startup,
+#              in standard deviations (Welford), after `min_samples` samples
+#
+# Hysteresis: once raised, an alert clears only when the statistic is back
+# past `clear` (default: the threshold). Debounce: the threshold must stay
+# breached for `for` seconds before the alert is raised, and the clear
+# condition must hold for `clear_for` seconds before it is resolved. Optional
+# gates limit a rule to the hours [start, end) of the sample's local time and
+# to samples with at least `min_power` W; outside them the rule counts as
+# clear. `devices` limits a rule to some meters of its kind. While a
+# statistic is warming up (window not yet full, too few samples for a
+# z-score) its rules keep their state, so an alert restored after a restart
+# is not resolved by the first samples.
+#
+# Only the process that owns capture evaluates rules (publish_ac_sample and
+# publish_solar_sample call evaluate()). Rules are compiled per device on its
+# first sample, and statistics shared by several rules are updated once, so a
+# sample costs one update per distinct statistic and one comparison per rule
+# of its own meter, however many rules and devices the fleet has. Raised and
+# resolved alerts are published on the live socket ('alert' stream, so API
+# workers keep the active set and their /alerts/live clients), and written to
+# alertEvents by a writer thread.
+
+OPS = ('>', '<')
+STATS = ('value', 'ewma', 'min', 'max', 'zscore')
+METRICS = {
+    'consumption': ('voltage', 'current', 'power', 'energy', 'frequency', 'power_factor'),
+    'production': ('voltage', 'current', 'power', 'energy'),
+}
+POWER = 3  # sample index of power, for min_power gates
+
+DEFAULT_RULES = [
+    {'name': 'overvoltage', 'kind': 'consumption', 'metric': 'voltage', 'stat': 'ewma', 'span': 5,
+     'op': '>', 'threshold': 253, 'clear': 250, 'for': 10, 'clear_for': 30, 'severity': 'critical'},
+    {'name': 'undervoltage', 'kind': 'consumption', 'metric': 'voltage', 'stat': 'ewma', 'span': 5,
+     'op': '<', 'threshold': 207, 'clear': 210, 'for': 10, 'clear_for': 30, 'severity': 'warning'},
+    {'name': 'sustained-overload', 'kind': 'consumption', 'metric': 'power', 'stat': 'min', 'window': 120,
+     'op': '>', 'threshold': 5000, 'clear': 4500, 'clear_for': 60, 'severity': 'critical'},
+    {'name': 'low-power-factor', 'kind': 'consumption', 'metric': 'power_factor', 'stat': 'ewma', 'span': 60,
+     'op': '<', 'threshold': 0.8, 'clear': 0.85, 'for': 300, 'min_power': 200, 'severity': 'warning'},
+    {'name': 'solar-underperforming', 'kind': 'production', 'metric': 'power', 'stat': 'ewma', 'span': 300,
+     'op': '<', 'threshold': 100, 'clear': 150, 'for': 900, 'hours': [10, 15], 'severity': 'warning'},
+]
+
+ALERT_EVENTS = counter('powermon_alert_events_total', 'Alerts raised and resolved', ('rule', 'state'))
+ALERT_EVENTS_DROPPED = counter('powermon_alert_events_dropped_total', 'Alert events not written: writer queue full, or database unavailable at shutdown')
+
+OK, PENDING, FIRING, RESOLVING = range(4)
+
+_active = {}  # (device, rule) -> raised event
+_listeners = []
+_engine = None
+_writer = None
+_write_queue = Queue(maxsize=10000)
+_stop_event = threading.Event()
+
+
+class Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = None
+
+    def update(self, x, now):
+        self.value = x
+
+
+class Ewma:
+    __slots__ = ('alpha', 'value')
+
+    def __init__(self, span):
+        self.alpha = 2.0 / (span + 1)
+        self.value = None
+
+    def update(self, x, now):
+        if self.value is None:
+            self.value = x
+        else:
+            self.value += self.alpha * (x - self.value)
+
+
+class Welford:
+    """Running mean and variance; value is the z-score of the latest sample against the ones before it."""
+
+    __slots__ = ('min_samples', 'n', 'mean', 'm2', 'value')
+
+    def __init__(self, min_samples):
+        self.min_samples = min_samples
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.value = None
+
+    def update(self, x, now):
+        if self.n >= self.min_samples and self.m2 > 0:
+            self.value = (x - self.mean) / (self.m2 / (self.n - 1)) ** 0.5
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+
+class WindowExtreme:
+    """
+    Minimum (sign 1) or maximum (sign -1) over the last `seconds`: a deque of
+    (time, sign * x) kept increasing, so each sample is pushed and popped once.
+    None until a full window has been seen.
+    """
+
+    __slots__ = ('seconds', 'sign', 'samples', 'started', 'value')
+
+    def __init__(self, seconds, sign):
+        self.seconds = seconds
+        self.sign = sign
+        self.samples = deque()
+        self.started = None
+        self.value = None
+
+    def update(self, x, now):
+        samples = self.samples
+        x *= self.sign
+        while samples and samples[-1][1] >= x:
+            samples.pop()
+        samples.append((now, x))
+        horizon = now - self.seconds
+        while samples[0][0] < horizon:
+            samples.popleft()
+        if self.started is None:
+            self.started = now
+        if now - self.started >= self.seconds:
+            self.value = self.sign * samples[0][1]
+
+
+def _new_stat(key):
+    stat, parameter = key[1:]
+    if stat == 'value':
+        return Value()
+    if stat == 'ewma':
+        return Ewma(parameter)
+    if stat == 'zscore':
+        return Welford(parameter)
+    return WindowExtreme(parameter, 1 if stat == 'min' else -1)
+
+
+class Rule:
+    __slots__ = (
+        'name', 'kind', 'devices', 'metric', 'index', 'stat', 'stat_key', 'op', 'threshold', 'clear',
+        'hold', 'clear_hold', 'severity', 'hours', 'min_power', 'description',
+    )
+
+    def breached(self, value):
+        return value > self.threshold if self.op == '>' else value < self.threshold
+
+    def cleared(self, value):
+        return value <= self.clear if self.op == '>' else value >= self.clear
+
+    def info(self):
+        return {
+            'name': self.name, 'kind': self.kind, 'devices': sorted(self.devices) if self.devices else None,
+            'metric': self.metric, 'stat': self.stat, 'op': self.op, 'threshold': self.threshold,
+            'clear': self.clear, 'forSeconds': self.hold, 'clearForSeconds': self.clear_hold, 'severity': self.severity,
+            'hours': sorted(self.hours) if self.hours else None, 'minPower': self.min_power,
+            'description': self.description,
+        }
+
+
+def _compile(entry, source):
+    """Validate one rule entry."""
+    name = entry.get('name')
+    if not name:
+        raise ValueError(f"{source}: every alert rule needs a name")
+    where = f"{source}: alert rule {name!r}"
+    rule = Rule()
+    rule.name = name
+    rule.kind = entry.get('kind', 'consumption')
+    if rule.kind not in METRICS:
+        raise ValueError(f"{where}: kind must be one of {', '.join(METRICS)}, not {rule.kind!r}")
+    rule.devices = frozenset(entry['devices']) if entry.get('devices') else None
+    rule.metric = entry.get('metric')
+    if rule.metric not in METRICS[rule.kind]:
+        raise ValueError(f"{where}: metric must be one of {', '.join(METRICS[rule.kind])}, not {rule.metric!r}")
+    rule.index = METRICS[rule.kind].index(rule.metric) + 1
+    rule.stat = entry.get('stat', 'value')
+    if rule.stat not in STATS:
+        raise ValueError(f"{where}: stat must be one of {', '.join(STATS)}, not {rule.stat!r}")
+    if rule.stat == 'ewma':
+        parameter = float(entry.get('span', 10))
+    elif rule.stat in ('min', 'max'):
+        parameter = float(entry.get('window', 60))
+    elif rule.stat == 'zscore':
+        parameter = int(entry.get('min_samples', 60))
+    else:
+        parameter = None
+    if parameter is not None and parameter <= 0:
+        raise ValueError(f"{where}: span, window and min_samples must be positive")
+    rule.stat_key = (rule.index, rule.stat, parameter)
+    rule.op = entry.get('op', '>')
+    if rule.op not in OPS:
+        raise ValueError(f"{where}: op must be one of {', '.join(OPS)}, not {rule.op!r}")
+    rule.threshold = float(entry['threshold'])
+    rule.clear = float(entry.get('clear', rule.threshold))
+    if rule.breached(rule.clear):
+        raise ValueError(f"{where}: clear must not be past the threshold")
+    rule.hold = float(entry.get('for', 0))
+    rule.clear_hold = float(entry.get('clear_for', 0))
+    rule.severity = entry.get('severity', 'warning')
+    rule.hours = None
+    if entry.get('hours'):
+        start, end = entry['hours']
+        if not (0 <= start <= 23 and 0 <= end <= 24):
+            raise ValueError(f"{where}: hours must be [start, end) with 0 <= start <= 23 and 0 <= end <= 24")
+        rule.hours = frozenset(range(start, end) if end > start else [*range(start, 24), *range(end)])
+    rule.min_power = float(entry['min_power']) if entry.get('min_power') is not None else None
+    rule.description = entry.get('description', '')
+    return rule
+
+
+@lru_cache(maxsize=1)
+def get_rules():
+    config = get_alert_config()
+    if config['rules_file']:
+        with open(config['rules_file']) as f:
+            entries = json.load(f)
+        source = config['rules_file']
+    else:
+        entries, source = DEFAULT_RULES, 'DEFAULT_RULES'
+    rules = [_compile(entry, source) for entry in entries]
+    names = [rule.name for rule in rules]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"{source}: duplicate alert rule names {duplicates}")
+    return rules
+
+
+class Engine:
+    """
+    Rule state of every meter. evaluate() is called with each sample on the
+    event loop and calls emit(event) for every alert raised or resolved.
+    """
+
+    def __init__(self, rules, emit, restored=None):
+        self.rules = rules
+        self.emit = emit
+        self.restored = restored or {}
+        self.devices = {}  # device_id -> (stats [(stat, index)], rules [[rule, stat, status, since, event]])
+
+    def _build(self, kind, device_id):
+        stats = {}
+        entries = []
+        for rule in self.rules:
+            if rule.kind != kind or (rule.devices and device_id not in rule.devices):
+                continue
+            stat = stats.get(rule.stat_key)
+            if stat is None:
+                stat = stats[rule.stat_key] = _new_stat(rule.stat_key)
+            raised = self.restored.get((device_id, rule.name))
+            entries.append([rule, stat, FIRING if raised else OK, 0.0, raised])
+        built = self.devices[device_id] = ([(stat, key[0]) for key, stat in stats.items()], entries)
+        return built
+
+    def evaluate(self, kind, device_id, sample, now=None):
+        built = self.devices.get(device_id)
+        if built is None:
+            built = self._build(kind, device_id)
+        stats, entries = built
+        if now is None:
+            now = time.monotonic()
+        for stat, index in stats:
+            stat.update(sample[index], now)
+        hour = None
+        for entry in entries:
+            rule, stat, status, since, raised = entry
+            value = stat.value
+            if value is None:
+                # Statistic still warming up: leave the alert as it is
+                continue
+            if rule.hours is not None:
+                if hour is None:
+                    hour = int(sample[0][11:13])
+                if hour not in rule.hours:
+                    value = None
+            if rule.min_power is not None and sample[POWER] < rule.min_power:
+                value = None
+            if status <= PENDING:
+                if value is None or not rule.breached(value):
+                    entry[2] = OK
+                    continue
+                if status == OK:
+                    entry[2] = status = PENDING
+                    entry[3] = since = now
+                if now - since >= rule.hold:
+                    entry[2] = FIRING
+                    entry[4] = self._event(rule, device_id, sample, value, 'firing')
+                    self.emit(entry[4])
+            else:
+                if value is not None and not rule.cleared(value):
+                    entry[2] = FIRING
+                    continue
+                if status == FIRING:
+                    entry[2] = status = RESOLVING
+                    entry[3] = since = now
+                if now - since >= rule.clear_hold:
+                    entry[2] = OK
+                    event = self._event(rule, device_id, sample, value, 'resolved')
+                    event['raisedAt'] = raised['timestamp'] if raised else None
+                    entry[4] = None
+                    self.emit(event)
+
+    def _event(self, rule, device_id, sample, value, state):
+        if state == 'firing':
+            message = f"{rule.metric} {rule.stat} {value:.4g} {rule.op} {rule.threshold:g}"
+        elif value is None:
+            message = f"{rule.name} no longer applies"
+        else:
+            message = f"{rule.metric} {rule.stat} back to {value:.4g}"
+        return {
+            'deviceId': device_id,
+            'rule': rule.name,
+            'severity': rule.severity,
+            'state': state,
+            'timestamp': sample[0],
+            'value': value,
+            'threshold': rule.threshold,
+            'message': message,
+        }
+
+
+def subscribe(listener):
+    """Call listener(event) on the event loop for every alert raised or resolved."""
+    _listeners.append(listener)
+
+
+def dispatch(event):
+    """Track an alert event in the active set and hand it to the listeners. Runs on the event loop."""
+    key = (event['deviceId'], event['rule'])
+    if event['state'] == 'firing':
+        _active[key] = event
+    else:
+        _active.pop(key, None)
+    for listener in _listeners:
+        listener(event)
+
+register_stream('alert', dispatch)
+
+
+def active_alerts(device_id=None):
+    """Raised alerts not yet resolved, oldest first."""
+    events = [event for event in _active.values() if device_id is None or event['deviceId'] == device_id]
+    return sorted(events, key=lambda event: event['timestamp'])
+
+
+def _emit(event):
+    ALERT_EVENTS.inc(rule=event['rule'], state=event['state'])
+    logging.warning(f"Alert {event['state']} on device {event['deviceId']}: {event['rule']} ({event['message']})")
+    dispatch(event)
+    live_publish('alert', event, key=f"{event['deviceId']}:{event['rule']}")
+    try:
+        _write_queue.put_nowait(event)
+    except Full:
+        ALERT_EVENTS_DROPPED.inc()
+
+
+def evaluate(kind, device_id, sample):
+    """Run a meter's rules over one sample tuple (as published). Must run on the event loop."""
+    engine = _engine
+    if engine is not None:
+        engine.evaluate(kind, device_id, sample)
+
+
+def _restore(rules):
+    """Alerts raised before a restart and never resolved, so they can still resolve."""
+    names = tuple(rule.name for rule in rules)
+    if not names:
+        return {}
+    with db_connection() as connection:
+        if not connection:
+            return {}
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT e.device, e.rule, e.severity, e.state, e.timestamp, e.value, e.threshold, e.message
+                FROM alertEvents e
+                JOIN (
+                    SELECT device, rule, MAX(id) AS id FROM alertEvents
+                    WHERE rule IN ({', '.join(['%s'] * len(names))})
+                    GROUP BY device, rule
+                ) latest ON latest.id = e.id
+                WHERE e.state = 'firing'
+            """, names)
+            rows = cursor.fetchall()
+    restored = {}
+    for row in rows:
+        event = alert_event(row)
+        restored[event['deviceId'], event['rule']] = event
+    return restored
+
+
+def alert_event(row):
+    """An alertEvents row as an alert event."""
+    timestamp = row['timestamp']
+    return {
+        'deviceId': row['device'],
+        'rule': row['rule'],
+        'severity': row['severity'],
+        'state': row['state'],
+        'timestamp': timestamp if isinstance(timestamp, str) else timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+        'value': row['value'],
+        'threshold': row['threshold'],
+        'message': row['message'],
+    }
+
+
+def _store_events(events):
+    with db_connection() as connection:
+        if not connection:
+            return False
+        return log_alert_events(connection, [
+            (event['deviceId'], event['rule'], event['severity'], event['state'],
+             event['timestamp'], event['value'], event['threshold'], event['message'])
+            for event in events
+        ])
+
+
+def _write_events():
+    # Events whose write failed are retried first, with backoff, and fewer new
+    # ones are taken meanwhile, so a long outage fills the queue (counted as
+    # drops) rather than memory. Keeps going after stop() until the queue is
+    # drained; at that point a failed write is not retried.
+    pending = []
+    delay = 1
+    while not (_stop_event.is_set() and _write_queue.empty() and not pending):
+        events = pending
+        if not events:
+            try:
+                events = [_write_queue.get(timeout=1)]
+            except Empty:
+                continue
+        try:
+            while len(events) < 500:
+                events.append(_write_queue.get_nowait())
+        except Empty:
+            pass
+        if _store_events(events):
+            pending, delay = [], 1
+            continue
+        if _stop_event.is_set():
+            ALERT_EVENTS_DROPPED.inc(len(events))
+            logging.error(f"{len(events)} alert events were lost at shutdown")
+            pending = []
+            continue
+        pending = events
+        delay = min(delay * 2, 60)
+        logging.warning("%d alert events not stored, retrying in %ds", len(pending), delay, extra={'sampled': True})
+        _stop_event.wait(delay)
+
+
+def start():
+    """Compile the rules and start evaluating them, where this process owns capture; blocking, run once at startup."""
+    global _engine, _writer
+    if _engine is not None or not ingest_enabled() or not get_alert_config()['enabled']:
+        return
+    rules = get_rules()
+    restored = _restore(rules)
+    for event in restored.values():
+        dispatch(event)
+        live_publish('alert', event, key=f"{event['deviceId']}:{event['rule']}")
+    _engine = Engine(rules, _emit, restored)
+    _writer = threading.Thread(target=_write_events, daemon=True)
+    _writer.start()
+    logging.info(f"Alert engine started with {len(rules)} rules, {len(restored)} alerts still raised")
+
+
+def stop(timeout):
+    """Stop evaluating and wait up to timeout for the queued events to be written."""
+    global _engine
+    _engine = None
+    _stop_event.set()
+    return _writer is None or join_threads([_writer], timeout)
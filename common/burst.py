@@ -0,0 +1,101 @@
+import math
+from datetime import datetime
+
+# Edge reduction for high-rate (burst) sampling.
+#
+# A meter polled as fast as the bus allows produces many samples per second.
+# WindowReducer folds them into one record per window with min/max/mean/last
+# per metric and the sample count, so transients (inrush, sags) survive in the
+# min/max columns without storing every sample. Counters such as 'energy' only
+# keep their last value.
+
+COUNTER_COLUMNS = ('energy',)
+
+
+class WindowReducer:
+    def __init__(self, columns, window=1.0, peak_column='power'):
+        self.columns = columns
+        self.window = window
+        self.peak_index = columns.index(peak_column) if peak_column in columns else None
+        self._reset(None)
+
+    def _reset(self, key):
+        self.key = key
+        self.count = 0
+        self.mins = [math.inf] * len(self.columns)
+        self.maxs = [-math.inf] * len(self.columns)
+        self.sums = [0.0] * len(self.columns)
+        self.last = None
+        self.peak_at = None
+
+    def add(self, t, values):
+        """
+        Add a sample taken at epoch seconds t. Returns the completed record of
+        the previous window when t starts a new one, otherwise None.
+        """
+        key = math.floor(t / self.window)
+        completed = None
+        if self.key is not None and key != self.key:
+            completed = self.record()
+        if key != self.key:
+            self._reset(key)
+        self.count += 1
+        for i, value in enumerate(values):
+            if value < self.mins[i]:
+                self.mins[i] = value
+            if value > self.maxs[i]:
+                self.maxs[i] = value
+                if i == self.peak_index:
+                    self.peak_at = t
+            self.sums[i] += value
+        self.last = values
+        return completed
+
+    def record(self):
+        """Current window as a record dict, or None when it holds no samples."""
+        if not self.count:
+            return None
+        start = self.key * self.window
+        record = {
+            'timestamp': datetime.fromtimestamp(start).strftime('%Y-%m-%d %H:%M:%S'),
+            'samples': self.count,
+        }
+        for i, column in enumerate(self.columns):
+            record[f'{column}_last'] = self.last[i]
+            if column in COUNTER_COLUMNS:
+                continue
+            record[f'{column}_min'] = self.mins[i]
+            record[f'{column}_max'] = self.maxs[i]
+            record[f'{column}_mean'] = round(self.sums[i] / self.count, 4)
+        if self.peak_at is not None:
+            record['peak_offset_ms'] = int((self.peak_at - start) * 1000)
+        return record
+
+    def flush(self):
+        record = self.record()
+        self._reset(None)
+        return record
+
+
+def window_columns(columns):
+    """Record keys (and table columns) produced by WindowReducer for the given metrics."""
+    names = ['samples']
+    for column in columns:
+        if column in COUNTER_COLUMNS:
+            names.append(f'{column}_last')
+        else:
+            names.extend(f'{column}_{stat}' for stat in ('min', 'max', 'mean', 'last'))
+    names.append('peak_offset_ms')
+    return names
+
+
+def is_peak_event(record, column='power', ratio=1.5, minimum=0.0):
+    """
+    True when the window's peak exceeds its mean by the given ratio, i.e. a
+    transient that a 1 Hz sample would most likely have missed.
+    """
+    peak = record.get(f'{column}_max')
+    mean = record.get(f'{column}_mean')
+    if peak is None or peak < minimum or record['samples'] < 2:
+        return False
+    return peak >= mean * ratio
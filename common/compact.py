@@ -0,0 +1,87 @@
+from config import get_storage_config, get_ac_config, get_solar_config
+
+# Register-native compact storage for raw samples.
+#
+# The PZEM meters report fixed-point register values; parse_pzem_data scales
+# them to floats. The compact tables store the unscaled integers instead
+# (smallest fitting integer type per column, keyed by (device, timestamp)) and
+# the scale is applied in SQL on the read path, so aggregates run on exact
+# integer/DECIMAL arithmetic instead of compounding FLOAT rounding.
+
+CONSUMPTION_COLUMNS = ('voltage', 'current', 'power', 'energy', 'frequency', 'power_factor')
+PRODUCTION_COLUMNS = ('voltage', 'current', 'power', 'energy')
+
+# Scale factors from features/*/modbus.py parse_pzem_data (value = register * scale)
+CONSUMPTION_SCALES = {
+    'voltage': 0.1,
+    'current': 0.001,
+    'power': 0.1,
+    'energy': 1,
+    'frequency': 0.1,
+    'power_factor': 0.01,
+}
+PRODUCTION_SCALES = {
+    'voltage': 0.01,
+    'current': 0.01,
+    'power': 0.1,
+    'energy': 1,
+}
+
+RAW_TABLES = {
+    'consumption': ('energyConsumption_raw', 'energyConsumption_compact', CONSUMPTION_COLUMNS, CONSUMPTION_SCALES),
+    'production': ('energyProduction_raw', 'energyProduction_compact', PRODUCTION_COLUMNS, PRODUCTION_SCALES),
+}
+
+
+def compact_storage_enabled():
+    return get_storage_config()['schema'] == 'compact'
+
+
+def encode_value(value, scale):
+    """Convert a scaled reading back to its integer register value."""
+    return int(round(value / scale))
+
+
+def encode_row(device_id, row, columns, scales):
+    """
+    Convert a queued sample tuple (timestamp, *values) into a compact row
+    (device, timestamp, *register_values).
+    """
+    timestamp, *values = row
+    return (device_id, timestamp) + tuple(
+        encode_value(value, scales[column]) for column, value in zip(columns, values)
+    )
+
+
+def encode_consumption_batch(device_id, data_batch):
+    return [encode_row(device_id, row, CONSUMPTION_COLUMNS, CONSUMPTION_SCALES) for row in data_batch]
+
+
+def encode_production_batch(device_id, data_batch):
+    return [encode_row(device_id, row, PRODUCTION_COLUMNS, PRODUCTION_SCALES) for row in data_batch]
+
+
+def decode_expression(column, scale):
+    """SQL expression decoding a compact column; the DECIMAL literal keeps the result exact."""
+    if scale == 1:
+        return column
+    return f"({column} * {scale})"
+
+
+def raw_source(kind, device_id=None):
+    """
+    Return (table, {column: sql_expression}, device_condition, device_params) for
+    reading one device's raw samples of the given kind ('consumption' or
+    'production') from whichever schema is configured. Expressions always yield
+    engineering units; device_condition is an SQL predicate to AND into WHERE
+    clauses so reads use the (device, timestamp) index of either schema.
+    device_id defaults to the AC_DEVICE_ID / SOLAR_DEVICE_ID meter.
+    """
+    float_table, compact_table, columns, scales = RAW_TABLES[kind]
+    if device_id is None:
+        config = get_ac_config() if kind == 'consumption' else get_solar_config()
+        device_id = config['device_id']
+    if not compact_storage_enabled():
+        return float_table, {column: column for column in columns}, "device = %s", (device_id,)
+    expressions = {column: decode_expression(column, scales[column]) for column in columns}
+    return compact_table, expressions, "device = %s", (device_id,)
@@ -0,0 +1,290 @@
+import logging
+import math
+import threading
+from datetime import datetime, timedelta
+from config import get_compression_config
+from common.metrics import COMPRESSION_RATIO
+
+# Ingestion-side compression for raw sample streams.
+#
+# Samples are the queued tuples (timestamp, *values). A SampleCompressor sits
+# between the capture queue and storage and only forwards the points needed to
+# reconstruct the series by linear interpolation within each metric's
+# deviation:
+#   - 'swinging_door': classic swinging-door trending, error <= deviation
+#   - 'deadband': a point is archived when a value leaves a band of half the
+#     deviation around the last archived point, so interpolation error also
+#     stays <= deviation
+# Regardless of mode, the points on both sides of an energy-register step
+# boundary and of every hour rollover are kept, so MAX(energy) - MIN(energy)
+# aggregates stay exact, and a point is kept at least every max_gap seconds so
+# gaps in storage still mean gaps in capture.
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_compressors = {}
+_compressors_lock = threading.Lock()
+
+
+def compression_enabled():
+    return get_compression_config()['mode'] in ('deadband', 'swinging_door')
+
+
+def parse_deviations(spec):
+    """
+    Parse 'voltage=0.5,power=2%' into {'voltage': ('abs', 0.5), 'power': ('rel', 0.02)}.
+    """
+    deviations = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        column, _, value = item.partition('=')
+        value = value.strip()
+        if value.endswith('%'):
+            deviations[column.strip()] = ('rel', float(value[:-1]) / 100)
+        else:
+            deviations[column.strip()] = ('abs', float(value))
+    return deviations
+
+
+def _to_seconds(timestamp):
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp()
+    return datetime.strptime(timestamp, TIMESTAMP_FORMAT).timestamp()
+
+
+def _hour_of(timestamp):
+    return timestamp[:13] if isinstance(timestamp, str) else timestamp.strftime('%Y-%m-%d %H')
+
+
+class SampleCompressor:
+    """
+    Compress a stream of sample tuples (timestamp, *values).
+    columns names the value positions; 'energy' is treated as a counter and
+    only archived on step boundaries.
+    """
+
+    def __init__(self, columns, deviations, mode='swinging_door', energy_step=10, max_gap=300):
+        self.columns = columns
+        self.mode = mode
+        self.energy_step = energy_step
+        self.max_gap = max_gap
+        self.energy_index = columns.index('energy') if 'energy' in columns else None
+        # (value index, kind, deviation) for every compressed metric; unlisted metrics are lossless
+        self.metrics = [
+            (i, *deviations.get(column, ('abs', 0.0)))
+            for i, column in enumerate(columns)
+            if column != 'energy'
+        ]
+        self.archived = None  # (seconds, sample) of the last emitted point
+        self.held = None  # (seconds, sample) of the last received, not yet emitted point
+        self.doors = None  # per metric [lower_slope, upper_slope] for swinging door
+        self.received = 0
+        self.emitted = 0
+
+    def _tolerance(self, kind, deviation, reference):
+        if kind == 'rel':
+            return abs(reference) * deviation
+        return deviation
+
+    def _open_doors(self):
+        self.doors = [[-math.inf, math.inf] for _ in self.metrics]
+
+    def _on_boundary(self, sample):
+        """True when sample starts a new hour or energy step relative to the archived point."""
+        archived = self.archived[1]
+        if _hour_of(sample[0]) != _hour_of(archived[0]):
+            return True
+        if self.energy_index is not None and self.energy_step > 0:
+            e = self.energy_index + 1
+            return math.floor(sample[e] / self.energy_step) != math.floor(archived[e] / self.energy_step)
+        return False
+
+    def _violates(self, t, sample):
+        t0, origin = self.archived
+        if self.mode == 'deadband':
+            for (i, kind, deviation) in self.metrics:
+                reference = origin[i + 1]
+                if abs(sample[i + 1] - reference) > self._tolerance(kind, deviation, reference) / 2:
+                    return True
+            return False
+        # A point is accepted only if the straight line to it from the archived
+        # point stays inside every earlier point's door, so interpolating
+        # between archived and held points never exceeds the deviation
+        dt = max(t - t0, 1e-6)
+        violated = False
+        for door, (i, kind, deviation) in zip(self.doors, self.metrics):
+            reference = origin[i + 1]
+            tolerance = self._tolerance(kind, deviation, reference)
+            slope = (sample[i + 1] - reference) / dt
+            if slope < door[0] or slope > door[1]:
+                violated = True
+            door[0] = max(door[0], slope - tolerance / dt)
+            door[1] = min(door[1], slope + tolerance / dt)
+        return violated
+
+    def _archive(self, point, out):
+        out.append(point[1])
+        self.emitted += 1
+        self.archived = point
+        self._open_doors()
+
+    def add(self, sample):
+        """Feed one sample; returns the list of samples to store (possibly empty)."""
+        self.received += 1
+        t = _to_seconds(sample[0])
+        out = []
+        if self.archived is None:
+            self._archive((t, sample), out)
+            return out
+        if t - self.archived[0] >= self.max_gap or self._on_boundary(sample):
+            if self.held is not None:
+                out.append(self.held[1])
+                self.emitted += 1
+            self.held = None
+            self._archive((t, sample), out)
+            return out
+        if self._violates(t, sample):
+            if self.mode == 'deadband':
+                if self.held is not None:
+                    out.append(self.held[1])
+                    self.emitted += 1
+                self.held = None
+                self._archive((t, sample), out)
+                return out
+            # Swinging door: the previous point becomes the new archive and
+            # the doors reopen from it towards the current sample
+            self._archive(self.held, out)
+            self._violates(t, sample)
+        self.held = (t, sample)
+        return out
+
+    def process(self, batch):
+        out = []
+        for sample in batch:
+            out.extend(self.add(sample))
+        return out
+
+    def flush(self):
+        """Return the held point, if any, so nothing is lost on shutdown."""
+        if self.held is None:
+            return []
+        out = []
+        self._archive(self.held, out)
+        self.held = None
+        return out
+
+    @property
+    def ratio(self):
+        return self.received / self.emitted if self.emitted else 1.0
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'received': self.received,
+            'stored': self.emitted,
+            'ratio': round(self.ratio, 2),
+        }
+
+
+def create_compressor(name, columns, label=None):
+    """
+    Build a compressor for a stream ('ac' or 'solar') from config, or return
+    None when compression is off. Compressors are registered for reporting
+    under label (the device name, defaulting to the stream).
+    """
+    label = label or name
+    config = get_compression_config()
+    if config['mode'] not in ('deadband', 'swinging_door'):
+        return None
+    compressor = SampleCompressor(
+        columns,
+        parse_deviations(config[f'{name}_deviations']),
+        mode=config['mode'],
+        energy_step=config['energy_step'],
+        max_gap=config['max_gap'],
+    )
+    with _compressors_lock:
+        _compressors[label] = compressor
+    COMPRESSION_RATIO.set_function(lambda: compressor.ratio, stream=label)
+    logging.info(f"Compression enabled for {label} samples ({config['mode']})")
+    return compressor
+
+
+def compression_stats():
+    with _compressors_lock:
+        return {name: compressor.stats() for name, compressor in _compressors.items()}
+
+
+def time_weighted_hourly(rows, columns, max_gap, minutes=60, since=None):
+    """
+    Aggregate a compressed series per hour (or per `minutes`-minute interval)
+    by linear interpolation between stored points. rows are dicts with
+    'timestamp' plus the given columns, ordered by timestamp; any iterable,
+    read once. Returns {interval_start: {column: {'avg', 'min', 'max'}}},
+    leaving out intervals that start before since (rows before it only lead
+    into it).
+
+    A segment crossing an interval boundary is split there at its
+    interpolated value, which counts as a point of both intervals, so each
+    interval's min/max (and energy as max - min) covers the whole interval.
+    Segments longer than 1.5 * max_gap are treated as capture outages and
+    not interpolated across.
+    """
+    width = timedelta(minutes=minutes)
+    stats = {}  # interval start -> {column: [area, span, min, max, sum, count]}
+
+    def interval(timestamp):
+        return timestamp.replace(minute=timestamp.minute - timestamp.minute % minutes, second=0, microsecond=0)
+
+    def add_point(start, values, sampled=True):
+        columns_stats = stats.get(start)
+        if columns_stats is None:
+            columns_stats = stats[start] = {column: [0.0, 0.0, value, value, 0.0, 0] for column, value in values.items()}
+        for column, value in values.items():
+            entry = columns_stats[column]
+            if value < entry[2]:
+                entry[2] = value
+            if value > entry[3]:
+                entry[3] = value
+            if sampled:
+                entry[4] += value
+                entry[5] += 1
+
+    def add_area(start, a, b, dt):
+        for column, entry in stats[start].items():
+            entry[0] += (a[column] + b[column]) / 2 * dt
+            entry[1] += dt
+
+    previous = None
+    for row in rows:
+        timestamp = row['timestamp']
+        values = {column: float(row[column]) for column in columns}
+        start = interval(timestamp)
+        add_point(start, values)
+        if previous is not None:
+            at, before, segment_start = previous
+            dt = (timestamp - at).total_seconds()
+            if 0 < dt <= 1.5 * max_gap:
+                while segment_start != start:
+                    boundary = segment_start + width
+                    fraction = (boundary - previous[0]).total_seconds() / dt
+                    edge = {column: previous[1][column] + (values[column] - previous[1][column]) * fraction for column in columns}
+                    add_point(segment_start, edge, sampled=False)
+                    add_area(segment_start, before, edge, (boundary - at).total_seconds())
+                    add_point(boundary, edge, sampled=False)
+                    at, before, segment_start = boundary, edge, boundary
+                add_area(start, before, values, (timestamp - at).total_seconds())
+        previous = (timestamp, values, start)
+
+    result = {}
+    for start, columns_stats in stats.items():
+        if since is not None and start < since:
+            continue
+        summary = {}
+        for column, (area, span, low, high, total, count) in columns_stats.items():
+            if span:
+                avg = area / span
+            else:
+                avg = total / count if count else (low + high) / 2
+            summary[column] = {'avg': avg, 'min': low, 'max': high}
+        result[start] = summary
+    return result
@@ -1,125 +1,580 @@
 import pymysql
+import sqlite3
 import logging
+import os
+import threading
+import time
 from contextlib import contextmanager
+from datetime import datetime, timezone
 from config import get_database_config
+from common.compact import encode_consumption_batch, encode_production_batch, CONSUMPTION_COLUMNS, PRODUCTION_COLUMNS
+from common.burst import window_columns
+from common.metrics import DB_WRITE_SECONDS, DB_ROWS_WRITTEN, DB_ERRORS, DB_READS, DB_REPLICA_UP, DB_REPLICA_LAG
+from common import sqlite_store
+
+# Storage interface. Every write goes through the functions below and every
+# read through db_connection(); both work against MySQL (the default) and the
+# embedded SQLite engine (DB_BACKEND=sqlite, common/sqlite_store.py). SQL that
+# differs between the two is built by upsert_sql(), insert_ignore_sql() and
+# hour_bucket(); everything else is written in the subset both understand.
+#
+# Writes, and reads that must see them (summary jobs, startup seeding), use
+# db_connection() on the primary (DB_HOST). Read-only API queries (summary
+# listings, midnight snapshots, bills, burst/peak/alert history) use
+# read_connection(), which goes to a MySQL read replica (DB_READ_HOSTS) when
+# one is close enough behind the primary, and to the primary otherwise.
 
 CONFIG = get_database_config()
+BACKENDS = ('mysql', 'sqlite')
+if CONFIG['backend'] not in BACKENDS:
+    raise ValueError(f"DB_BACKEND must be one of {', '.join(BACKENDS)}, not {CONFIG['backend']!r}")
+SQLITE = CONFIG['backend'] == 'sqlite'
+DB_EXCEPTIONS = (pymysql.MySQLError, sqlite3.Error)
 
 @contextmanager
 def db_connection():
     connection = None
     try:
-        connection = pymysql.connect(
-            host=CONFIG['db_host'],
-            user=CONFIG['db_user'],
-            password=CONFIG['db_password'],
-            database=CONFIG['db_name'],
-            cursorclass=pymysql.cursors.DictCursor
-        )
+        if SQLITE:
+            connection = sqlite_store.connect(CONFIG)
+        else:
+            connection = pymysql.connect(
+                host=CONFIG['db_host'],
+                user=CONFIG['db_user'],
+                password=CONFIG['db_password'],
+                database=CONFIG['db_name'],
+                cursorclass=pymysql.cursors.DictCursor
+            )
         yield connection
-    except pymysql.MySQLError as e:
+    except DB_EXCEPTIONS as e:
+        DB_ERRORS.inc(operation='connect')
         logging.error(f"Database connection error: {e}")
         yield None
     finally:
         if connection:
             connection.close()
 
-def log_to_db_production(connection, data_batch):
+def ping():
+    """True if the database accepts a connection and a query."""
+    with db_connection() as connection:
+        if not connection:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except DB_EXCEPTIONS as e:
+            logging.error(f"Database ping failed: {e}")
+            return False
+
+# Read replicas. The 'replicas' pipeline component measures each replica's
+# lag every DB_REPLICA_CHECK_INTERVAL seconds; state is (lag seconds or None
+# when down or not replicating, monotonic time of the check), replaced whole
+# so request threads read it without a lock. A replica measured at lag L t
+# seconds ago may be missing up to L + t seconds of writes, which is what is
+# compared with the caller's max_lag, so a replica that stops answering (or a
+# monitor that is not running) ages out of use by itself.
+_replicas = []
+_preferred = None
+_monitor = None
+_monitor_stop = threading.Event()
+
+def _parse_hosts(hosts):
+    replicas = []
+    for entry in hosts.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, _, port = entry.partition(':')
+        replicas.append({'name': entry, 'host': host, 'port': int(port or 3306), 'state': (None, 0.0)})
+    return replicas
+
+if not SQLITE:
+    _replicas = _parse_hosts(CONFIG['read_hosts'])
+
+def _connect_replica(replica, timeout=None):
+    return pymysql.connect(
+        host=replica['host'],
+        port=replica['port'],
+        user=CONFIG['read_user'],
+        password=CONFIG['read_password'],
+        database=CONFIG['db_name'],
+        cursorclass=pymysql.cursors.DictCursor,
+        connect_timeout=timeout or 10
+    )
+
+def _replication_lag(connection):
+    """Seconds_Behind_Source of a replica, None when its SQL thread is not running."""
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+            key = 'Seconds_Behind_Source'
+        except pymysql.err.ProgrammingError:
+            # MySQL before 8.0.22 and MariaDB
+            cursor.execute("SHOW SLAVE STATUS")
+            key = 'Seconds_Behind_Master'
+        row = cursor.fetchone()
+    if not row or row.get(key) is None:
+        return None
+    return float(row[key])
+
+def _check_replica(replica):
+    lag = None
     try:
+        connection = _connect_replica(replica, timeout=max(CONFIG['replica_check_interval'], 1))
+        try:
+            lag = _replication_lag(connection)
+        finally:
+            connection.close()
+        if lag is None:
+            logging.warning(f"Read replica {replica['name']} is not replicating; reads go elsewhere", extra={'sampled': True})
+    except DB_EXCEPTIONS as e:
+        DB_ERRORS.inc(operation='replica_check')
+        logging.warning(f"Read replica {replica['name']} check failed: {e}", extra={'sampled': True})
+    replica['state'] = (lag, time.monotonic())
+    DB_REPLICA_UP.set(0 if lag is None else 1, replica=replica['name'])
+    if lag is not None:
+        DB_REPLICA_LAG.set(lag, replica=replica['name'])
+
+def _monitor_replicas():
+    interval = CONFIG['replica_check_interval']
+    while not _monitor_stop.is_set():
+        for replica in _replicas:
+            _check_replica(replica)
+        _monitor_stop.wait(interval)
+
+def start_replica_monitor():
+    global _monitor
+    if not _replicas:
+        return
+    _monitor_stop.clear()
+    # First measurement before serving, so reads use the replicas from the start
+    for replica in _replicas:
+        _check_replica(replica)
+    _monitor = threading.Thread(target=_monitor_replicas, name='replica-monitor', daemon=True)
+    _monitor.start()
+    logging.info(f"Routing read-only queries to {len(_replicas)} replicas within {CONFIG['replica_max_lag']:g}s of the primary")
+
+def stop_replica_monitor(timeout):
+    _monitor_stop.set()
+    if _monitor is None:
+        return True
+    _monitor.join(timeout)
+    return not _monitor.is_alive()
+
+def _pick_replica(max_lag):
+    """
+    The replica to read from, or None for the primary. A process sticks to
+    one replica while it stays within max_lag, so consecutive reads (an ETag
+    watermark, then the rows it validates) never go back in time; processes
+    start on different replicas to spread the load.
+    """
+    global _preferred
+    now = time.monotonic()
+
+    def within(replica):
+        lag, checked = replica['state']
+        return lag is not None and lag + (now - checked) <= max_lag
+
+    if _preferred is not None and within(_preferred):
+        return _preferred
+    candidates = [replica for replica in _replicas if within(replica)]
+    if not candidates:
+        return None
+    _preferred = candidates[os.getpid() % len(candidates)]
+    return _preferred
+
+@contextmanager
+def read_connection(max_lag=None):
+    """
+    Connection for a read-only query, like db_connection(): a read replica at
+    most max_lag seconds behind the primary (default DB_REPLICA_MAX_LAG), or
+    the primary when none is, when none is configured, or with max_lag=0.
+    """
+    if max_lag is None:
+        max_lag = CONFIG['replica_max_lag']
+    replica = _pick_replica(max_lag) if _replicas and max_lag > 0 else None
+    connection = None
+    if replica is not None:
+        try:
+            connection = _connect_replica(replica)
+        except DB_EXCEPTIONS as e:
+            # Out of rotation until the monitor sees it answer again
+            replica['state'] = (None, time.monotonic())
+            DB_REPLICA_UP.set(0, replica=replica['name'])
+            DB_ERRORS.inc(operation='replica_connect')
+            logging.warning(f"Read replica {replica['name']} unreachable, reading from the primary: {e}", extra={'sampled': True})
+    if connection is None:
+        DB_READS.inc(target='primary')
+        with db_connection() as connection:
+            yield connection
+        return
+    DB_READS.inc(target='replica')
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+def upsert_sql(table, columns, keys, updates=None):
+    """
+    INSERT of `columns` into table that updates the existing row when the
+    unique key `keys` clashes. updates maps each column to change to an
+    expression over {new} (the inserted value) and {old} (the stored one);
+    by default every non-key column takes the new value.
+    """
+    if updates is None:
+        updates = {column: '{new}' for column in columns if column not in keys}
+    if SQLITE:
+        new, clause = 'excluded.{}', f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET"
+    else:
+        new, clause = 'VALUES({})', "ON DUPLICATE KEY UPDATE"
+    assignments = ',\n        '.join(
+        f"{column}={expression.format(new=new.format(column), old=column)}" for column, expression in updates.items()
+    )
+    return f"""
+    INSERT INTO {table} ({', '.join(columns)})
+    VALUES ({', '.join(['%s'] * len(columns))})
+    {clause}
+        {assignments}
+    """
+
+def insert_ignore_sql(table, columns):
+    """INSERT of `columns` into table that skips rows whose unique key already exists."""
+    verb = "INSERT OR IGNORE" if SQLITE else "INSERT IGNORE"
+    return f"""
+    {verb} INTO {table} ({', '.join(columns)})
+    VALUES ({', '.join(['%s'] * len(columns))})
+    """
+
+def hour_bucket(expression):
+    """SQL truncating a DATETIME expression to the 'YYYY-MM-DD HH:00:00' of its hour."""
+    if SQLITE:
+        return f"strftime('%%Y-%%m-%%d %%H:00:00', {expression})"
+    return f'DATE_FORMAT({expression}, "%%Y-%%m-%%d %%H:00:00")'
+
+def interval_bucket(expression, minutes):
+    """SQL truncating a DATETIME expression to the start of its `minutes`-minute interval (minutes divides 60)."""
+    if 60 % minutes:
+        raise ValueError(f"Interval of {minutes} minutes does not divide the hour")
+    if SQLITE:
+        return f"strftime('%%Y-%%m-%%d %%H:', {expression}) || printf('%%02d:00', CAST(strftime('%%M', {expression}) AS INTEGER) / {minutes} * {minutes})"
+    return f'TIMESTAMPADD(MINUTE, MINUTE({expression}) DIV {minutes} * {minutes}, DATE_FORMAT({expression}, "%%Y-%%m-%%d %%H:00:00"))'
+
+def _record_write(table, rows, start):
+    DB_WRITE_SECONDS.observe(time.perf_counter() - start, table=table)
+    DB_ROWS_WRITTEN.inc(rows, table=table)
+
+def log_to_db_production(connection, device_id, data_batch):
+    try:
+        start = time.perf_counter()
         with connection.cursor() as cursor:
             sql = """
-            INSERT INTO energyProduction_raw (timestamp, voltage, current, power, energy)
-            VALUES (%s, %s, %s, %s, %s)
+            INSERT INTO energyProduction_raw (device, timestamp, voltage, current, power, energy)
+            VALUES (%s, %s, %s, %s, %s, %s)
             """
-            cursor.executemany(sql, data_batch)
+            cursor.executemany(sql, [(device_id, *row) for row in data_batch])
         connection.commit()
-        logging.info("Batch data logged successfully (production)")
-    except pymysql.MySQLError as e:
-        logging.error(f"Error inserting data into MySQL (production): {e}")
+        _record_write('energyProduction_raw', len(data_batch), start)
+        logging.info("Batch data logged successfully (production)", extra={'sampled': True})
+        return True
+    except DB_EXCEPTIONS as e:
+        DB_ERRORS.inc(operation='insert')
+        logging.error(f"Error inserting data into the database (production): {e}")
+        return False
 
-def log_to_db_consumption(connection, data_batch):
+def log_to_db_consumption(connection, device_id, data_batch):
     try:
+        start = time.perf_counter()
         with connection.cursor() as cursor:
             sql = """
-            INSERT INTO energyConsumption_raw (timestamp, voltage, current, power, energy, frequency, power_factor)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            INSERT INTO energyConsumption_raw (device, timestamp, voltage, current, power, energy, frequency, power_factor)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
             """
-            cursor.executemany(sql, data_batch)
+            cursor.executemany(sql, [(device_id, *row) for row in data_batch])
         connection.commit()
-        logging.info("Batch data logged successfully (consumption)")
-    except pymysql.MySQLError as e:
-        logging.error(f"Error inserting data into MySQL (consumption): {e}")
+        _record_write('energyConsumption_raw', len(data_batch), start)
+        logging.info("Batch data logged successfully (consumption)", extra={'sampled': True})
+        return True
+    except DB_EXCEPTIONS as e:
+        DB_ERRORS.inc(operation='insert')
+        logging.error(f"Error inserting data into the database (consumption): {e}")
+        return False
 
-def save_hourly_consumption_summary(connection, data_batch):
+def log_to_db_production_compact(connection, device_id, data_batch):
     """
-    Save a batch of hourly consumption summary records to the hourSummary table.
-    Each item in data_batch should be a tuple:
-    (timestamp, energyConsumption, avgVoltage, avgCurrent, avgPower, avgFrequency, avgPF)
+    Insert a batch of production samples into energyProduction_compact.
+    data_batch holds the same (timestamp, voltage, current, power, energy) tuples
+    as log_to_db_production; values are stored as integer register values.
+    Returns False if the insert failed.
+    """
+    try:
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            sql = upsert_sql('energyProduction_compact', ('device', 'timestamp') + PRODUCTION_COLUMNS, ('device', 'timestamp'))
+            cursor.executemany(sql, encode_production_batch(device_id, data_batch))
+        connection.commit()
+        _record_write('energyProduction_compact', len(data_batch), start)
+        logging.info("Batch data logged successfully (production, compact)", extra={'sampled': True})
+        return True
+    except DB_EXCEPTIONS as e:
+        DB_ERRORS.inc(operation='insert')
+        logging.error(f"Error inserting data into the database (production, compact): {e}")
+        return False
+
+def log_to_db_consumption_compact(connection, device_id, data_batch):
+    """
+    Insert a batch of consumption samples into energyConsumption_compact.
+    data_batch holds the same tuples as log_to_db_consumption.
+    Returns False if the insert failed.
     """
     try:
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            sql = upsert_sql('energyConsumption_compact', ('device', 'timestamp') + CONSUMPTION_COLUMNS, ('device', 'timestamp'))
+            cursor.executemany(sql, encode_consumption_batch(device_id, data_batch))
+        connection.commit()
+        _record_write('energyConsumption_compact', len(data_batch), start)
+        logging.info("Batch data logged successfully (consumption, compact)", extra={'sampled': True})
+        return True
+    except DB_EXCEPTIONS as e:
+        DB_ERRORS.inc(operation='insert')
+        logging.error(f"Error inserting data into the database (consumption, compact): {e}")
+        return False
+
+def log_burst_windows(connection, device_id, records):
+    """
+    Insert a batch of burst window records (see common/burst.py) into
+    energyConsumption_burst. Returns False if the insert failed.
+    """
+    columns = window_columns(CONSUMPTION_COLUMNS)
+    rows = [(device_id, record['timestamp'], *(record[column] for column in columns)) for record in records]
+    try:
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            sql = insert_ignore_sql('energyConsumption_burst', ('device', 'timestamp', *columns))
+            cursor.executemany(sql, rows)
+        connection.commit()
+        _record_write('energyConsumption_burst', len(rows), start)
+        logging.info("Batch burst windows logged successfully", extra={'sampled': True})
+        return True
+    except DB_EXCEPTIONS as e:
+        DB_ERRORS.inc(operation='insert')
+        logging.error(f"Error inserting burst windows: {e}")
+        return False
+
+def log_peak_events(connection, device_id, events):
+    """
+    Insert peak-power events. Each item in events should be a tuple:
+    (timestamp, peakPower, meanPower, minVoltage, samples)
+    Returns False if the insert failed.
+    """
+    rows = [(device_id, *event) for event in events]
+    try:
+        start = time.perf_counter()
         with connection.cursor() as cursor:
             sql = """
-            INSERT INTO hourSummary (timestamp, energyConsumption, avgVoltage, avgCurrent, avgPower, avgFrequency, avgPF)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-                energyConsumption=VALUES(energyConsumption),
-                avgVoltage=VALUES(avgVoltage),
-                avgCurrent=VALUES(avgCurrent),
-                avgPower=VALUES(avgPower),
-                avgFrequency=VALUES(avgFrequency),
-                avgPF=VALUES(avgPF)
+            INSERT INTO powerPeakEvents (device, timestamp, peakPower, meanPower, minVoltage, samples)
+            VALUES (%s, %s, %s, %s, %s, %s)
             """
-            cursor.executemany(sql, data_batch)
+            cursor.executemany(sql, rows)
+        connection.commit()
+        _record_write('powerPeakEvents', len(rows), start)
+        logging.info(f"Logged {len(events)} peak power events")
+        return True
+    except DB_EXCEPTIONS as e:
+        DB_ERRORS.inc(operation='insert')
+        logging.error(f"Error inserting peak power events: {e}")
+        return False
+
+def log_alert_events(connection, events):
+    """
+    Insert raised and resolved alerts. Each item in events should be a tuple:
+    (device, rule, severity, state, timestamp, value, threshold, message)
+    Returns False if the insert failed.
+    """
+    try:
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            sql = """
+            INSERT INTO alertEvents (device, rule, severity, state, timestamp, value, threshold, message)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            """
+            cursor.executemany(sql, events)
+        connection.commit()
+        _record_write('alertEvents', len(events), start)
+        logging.info(f"Logged {len(events)} alert events")
+        return True
+    except DB_EXCEPTIONS as e:
+        DB_ERRORS.inc(operation='insert')
+        logging.error(f"Error inserting alert events: {e}")
+        return False
+
+MIDNIGHT_SNAPSHOT_COLUMNS = {
+    'consumption': 'energyConsumption',
+    'production': 'energyProduction',
+}
+
+def save_midnight_snapshots(connection, kind, device_id, data_batch, overwrite=True):
+    """
+    Save a device's energy register values at midnight to energyMidnightSnapshot.
+    kind is 'consumption' or 'production'; each item in data_batch should be a
+    tuple (date, energy). With overwrite=False existing values are kept, which
+    lets backfills run without clobbering live snapshots.
+    """
+    column = MIDNIGHT_SNAPSHOT_COLUMNS[kind]
+    update = '{new}' if overwrite else 'COALESCE({old}, {new})'
+    try:
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            sql = upsert_sql('energyMidnightSnapshot', ('device', 'date', column), ('device', 'date'), {column: update})
+            cursor.executemany(sql, [(device_id, *row) for row in data_batch])
+        connection.commit()
+        _record_write('energyMidnightSnapshot', len(data_batch), start)
+        logging.info(f"Batch midnight snapshots saved successfully ({kind}).")
+    except DB_EXCEPTIONS as e:
+        DB_ERRORS.inc(operation='insert')
+        logging.error(f"Error inserting midnight snapshots ({kind}): {e}")
+
+HOUR_SUMMARY_COLUMNS = ('device', 'timestamp', 'energyConsumption', 'avgVoltage', 'avgCurrent', 'avgPower', 'avgFrequency', 'avgPF', 'version')
+HOUR_SUMMARY_SOLAR_COLUMNS = ('device', 'timestamp', 'energyProduced', 'minVoltage', 'maxVoltage', 'avgVoltage',
+                              'minCurrent', 'maxCurrent', 'avgCurrent', 'minPower', 'maxPower', 'version')
+
+def next_version(cursor):
+    """
+    Allocate the change version stamped on every row of one summary write,
+    inside that write's transaction. The changeVersion row stays locked until
+    commit, so versions become visible in allocation order and the committed
+    counter is a watermark below which no write is still in flight (see
+    get_summary_changes in features/summary/service.py). updatedAt (UTC)
+    is the summaries' Last-Modified.
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    cursor.execute("UPDATE changeVersion SET version = version + 1, updatedAt = %s WHERE id = 1", (now,))
+    cursor.execute("SELECT version FROM changeVersion WHERE id = 1")
+    return cursor.fetchone()['version']
+
+def save_hourly_consumption_summary(connection, device_id, data_batch):
+    """
+    Save a device's hourly consumption summary records to the hourSummary table.
+    Each item in data_batch should be a tuple:
+    (timestamp, energyConsumption, avgVoltage, avgCurrent, avgPower, avgFrequency, avgPF)
+    """
+    try:
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            sql = upsert_sql('hourSummary', HOUR_SUMMARY_COLUMNS, ('device', 'timestamp'))
+            version = next_version(cursor)
+            cursor.executemany(sql, [(device_id, *row, version) for row in data_batch])
         connection.commit()
+        _record_write('hourSummary', len(data_batch), start)
         logging.info("Batch hourly consumption summary saved successfully.")
-    except pymysql.MySQLError as e:
+    except DB_EXCEPTIONS as e:
+        DB_ERRORS.inc(operation='insert')
         logging.error(f"Error inserting hourly consumption summary: {e}")
 
-def save_hourly_solar_summary(connection, data_batch):
+def save_hourly_solar_summary(connection, device_id, data_batch):
     """
-    Save a batch of hourly solar summary records to the hourSummarySolar table.
+    Save a device's hourly solar summary records to the hourSummarySolar table.
     Each item in data_batch should be a tuple:
     (timestamp, energyProduced, minVoltage, maxVoltage, avgVoltage, minCurrent, maxCurrent, avgCurrent, minPower, maxPower)
     """
     try:
+        start = time.perf_counter()
         with connection.cursor() as cursor:
-            sql = """
-            INSERT INTO hourSummarySolar (timestamp, energyProduced, minVoltage, maxVoltage, avgVoltage, minCurrent, maxCurrent, avgCurrent, minPower, maxPower)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-                energyProduced=VALUES(energyProduced),
-                minVoltage=VALUES(minVoltage),
-                maxVoltage=VALUES(maxVoltage),
-                avgVoltage=VALUES(avgVoltage),
-                minCurrent=VALUES(minCurrent),
-                maxCurrent=VALUES(maxCurrent),
-                avgCurrent=VALUES(avgCurrent),
-                minPower=VALUES(minPower),
-                maxPower=VALUES(maxPower)
-            """
-            cursor.executemany(sql, data_batch)
+            sql = upsert_sql('hourSummarySolar', HOUR_SUMMARY_SOLAR_COLUMNS, ('device', 'timestamp'))
+            version = next_version(cursor)
+            cursor.executemany(sql, [(device_id, *row, version) for row in data_batch])
         connection.commit()
+        _record_write('hourSummarySolar', len(data_batch), start)
         logging.info("Batch hourly solar summary saved successfully.")
-    except pymysql.MySQLError as e:
+    except DB_EXCEPTIONS as e:
+        DB_ERRORS.inc(operation='insert')
         logging.error(f"Error inserting hourly solar summary: {e}")
 
-def save_daily_summary(connection, data_batch):
+def save_daily_summary(connection, device_id, data_batch):
     """
-    Save a batch of daily summary records to the dailySummary table.
+    Save a device's daily summary records to the dailySummary table.
     Each item in data_batch should be a tuple:
-    (date, energyConsumption, solarProduction)
+    (date, energyConsumption, solarProduction); a consumption meter leaves
+    solarProduction None and a production meter energyConsumption.
     """
     try:
+        start = time.perf_counter()
         with connection.cursor() as cursor:
-            sql = """
-            INSERT INTO dailySummary (date, energyConsumption, solarProduction)
-            VALUES (%s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-                energyConsumption=VALUES(energyConsumption),
-                solarProduction=VALUES(solarProduction)
-            """
-            cursor.executemany(sql, data_batch)
+            sql = upsert_sql('dailySummary', ('device', 'date', 'energyConsumption', 'solarProduction', 'version'), ('device', 'date'), {
+                'energyConsumption': 'COALESCE({new}, {old})',
+                'solarProduction': 'COALESCE({new}, {old})',
+                'version': '{new}',
+            })
+            version = next_version(cursor)
+            cursor.executemany(sql, [(device_id, *row, version) for row in data_batch])
         connection.commit()
+        _record_write('dailySummary', len(data_batch), start)
         logging.info("Batch daily summary saved successfully.")
-    except pymysql.MySQLError as e:
+    except DB_EXCEPTIONS as e:
+        DB_ERRORS.inc(operation='insert')
         logging.error(f"Error inserting daily summary: {e}")
+
+def save_demand_peaks(connection, device_id, data_batch):
+    """
+    Save a device's daily peak interval demand to demandPeak.
+    Each item in data_batch should be a tuple (date, peakDemand, peakAt).
+    """
+    try:
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            sql = upsert_sql('demandPeak', ('device', 'date', 'peakDemand', 'peakAt'), ('device', 'date'))
+            cursor.executemany(sql, [(device_id, *row) for row in data_batch])
+        connection.commit()
+        _record_write('demandPeak', len(data_batch), start)
+        logging.info("Batch demand peaks saved successfully.")
+    except DB_EXCEPTIONS as e:
+        DB_ERRORS.inc(operation='insert')
+        logging.error(f"Error inserting demand peaks: {e}")
+
+def _set_progress(cursor, device_id, name, upto):
+    cursor.execute(upsert_sql('analyticsProgress', ('device', 'name', 'upto'), ('device', 'name')), (device_id, name, upto))
+
+def add_load_heatmap(connection, device_id, cells, upto):
+    """
+    Add hours to a device's hour-of-week load accumulators in loadHeatmap and
+    record that its hourly summaries before upto are counted, in one
+    transaction, so no hour is counted twice. Each item in cells should be a
+    tuple (weekday, hour, hours, energy).
+    """
+    try:
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            sql = upsert_sql('loadHeatmap', ('device', 'weekday', 'hour', 'hours', 'energy'), ('device', 'weekday', 'hour'), {
+                'hours': '{old} + {new}',
+                'energy': '{old} + {new}',
+            })
+            cursor.executemany(sql, [(device_id, *cell) for cell in cells])
+            _set_progress(cursor, device_id, 'loadHeatmap', upto)
+        connection.commit()
+        _record_write('loadHeatmap', len(cells), start)
+        logging.info("Load heatmap accumulators updated successfully.")
+    except DB_EXCEPTIONS as e:
+        DB_ERRORS.inc(operation='insert')
+        logging.error(f"Error updating load heatmap: {e}")
+
+def add_solar_yield(connection, device_id, bins, upto):
+    """
+    Add days to a device's daily solar yield histogram in solarYieldHistogram
+    and record that its daily summaries before upto are counted, in one
+    transaction. Each item in bins should be a tuple (month, bin, days).
+    """
+    try:
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            sql = upsert_sql('solarYieldHistogram', ('device', 'month', 'bin', 'days'), ('device', 'month', 'bin'), {
+                'days': '{old} + {new}',
+            })
+            cursor.executemany(sql, [(device_id, *row) for row in bins])
+            _set_progress(cursor, device_id, 'solarYield', upto)
+        connection.commit()
+        _record_write('solarYieldHistogram', len(bins), start)
+        logging.info("Solar yield histogram updated successfully.")
+    except DB_EXCEPTIONS as e:
+        DB_ERRORS.inc(operation='insert')
+        logging.error(f"Error updating solar yield histogram: {e}")
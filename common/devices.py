@@ -0,0 +1,86 @@
+import json
+from functools import lru_cache
+from config import get_ac_config, get_solar_config, get_fleet_config
+
+# Meter registry.
+#
+# Every stored row carries the id of the meter it came from, and every meter
+# belongs to a site. Without DEVICES_FILE the instance has the two meters
+# configured through AC_* (consumption, AC_DEVICE_ID) and SOLAR_* (production,
+# SOLAR_DEVICE_ID), both on SITE_ID. For a fleet, DEVICES_FILE is a JSON list:
+#
+#     [{"device_id": 1, "kind": "consumption", "site_id": 1, "name": "main",
+#       "serial_port": "/dev/ttyUSB0", "slave_address": 1},
+#      {"device_id": 3, "kind": "consumption", "site_id": 1, "name": "kitchen",
+#       "serial_port": "/dev/ttyUSB0", "slave_address": 3}, ...]
+#
+# Each entry inherits the AC_* (consumption) or SOLAR_* (production) settings
+# it does not override. Meters sharing an RS-485 port are polled over one bus
+# in the async capture mode; the thread mode opens each meter's port itself,
+# so it needs one port per meter.
+
+KINDS = ('consumption', 'production')
+STREAMS = {'consumption': 'ac', 'production': 'solar'}
+
+
+def _base_config(kind):
+    return get_ac_config() if kind == 'consumption' else get_solar_config()
+
+
+@lru_cache(maxsize=1)
+def _registry():
+    fleet = get_fleet_config()
+    if not fleet['devices_file']:
+        return (
+            dict(get_ac_config(), kind='consumption', site_id=fleet['site_id'], name='ac'),
+            dict(get_solar_config(), kind='production', site_id=fleet['site_id'], name='solar'),
+        )
+    with open(fleet['devices_file']) as f:
+        entries = json.load(f)
+    devices = []
+    seen = set()
+    for entry in entries:
+        kind = entry.get('kind')
+        if kind not in KINDS:
+            raise ValueError(f"{fleet['devices_file']}: device kind must be one of {', '.join(KINDS)}, not {kind!r}")
+        if entry.get('device_id') in seen:
+            raise ValueError(f"{fleet['devices_file']}: duplicate device_id {entry.get('device_id')}")
+        seen.add(entry['device_id'])
+        device = dict(_base_config(kind), site_id=fleet['site_id'], name=f"{STREAMS[kind]}-{entry['device_id']}")
+        device.update(entry)
+        devices.append(device)
+    return tuple(devices)
+
+
+def reset():
+    """Forget the cached registry so the next lookup reads the environment again (benchmarks, tools)."""
+    _registry.cache_clear()
+
+
+def get_devices(kind=None, site_id=None):
+    """Device configs, optionally only those of one kind and/or site."""
+    return [
+        device for device in _registry()
+        if (kind is None or device['kind'] == kind) and (site_id is None or device['site_id'] == site_id)
+    ]
+
+
+def get_device(device_id, kind=None):
+    """Config of one device, or None if there is no such device (of that kind)."""
+    for device in get_devices(kind):
+        if device['device_id'] == device_id:
+            return device
+    return None
+
+
+def default_device(kind):
+    """The device routes use when no device_id is given: the configured AC/SOLAR meter, else the first of its kind."""
+    device = get_device(_base_config(kind)['device_id'], kind)
+    if device is None:
+        devices = get_devices(kind)
+        device = devices[0] if devices else None
+    return device
+
+
+def site_ids():
+    return sorted({device['site_id'] for device in _registry()})
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+from config import get_deployment_config
+from common.metrics import gauge, counter
+from common.supervisor import Backoff, device_health, set_remote_health
+
+# Live sample fan-out between processes.
+#
+# With ROLE=all (the default) one process captures, stores and serves HTTP,
+# and samples go from capture straight to that process's SSE queues. To serve
+# HTTP from several cores, run exactly one ingest process, which owns the
+# serial ports, DB writers and scheduler, and any number of API workers:
+#
+#     ROLE=ingest uvicorn main:app --host 127.0.0.1 --port 8001
+#     ROLE=api uvicorn main:app --host 0.0.0.0 --port 8000 --workers 4
+#
+# The ingest process listens on a Unix socket (LIVE_SOCKET). Every sample it
+# publishes is written once per subscriber as a newline-delimited JSON
+# [stream, item] message. Each API worker subscribes, replays the messages
+# into the handler registered for the stream (its local SSE fan-out) and so
+# keeps its own latest values. A subscriber that connects is first sent the
+# latest item of every stream and device. Device health is broadcast every
+# LIVE_HEALTH_INTERVAL seconds, so /health works on API workers too. A
+# subscriber that cannot keep up is disconnected rather than buffered
+# without bound; it reconnects and resumes from the latest values.
+
+ROLES = ('all', 'ingest', 'api')
+MAX_SUBSCRIBER_BUFFER = 1 << 20  # bytes queued for one subscriber before it is dropped
+LINE_LIMIT = 1 << 20
+
+LIVE_SUBSCRIBERS = gauge('powermon_live_subscribers', 'API workers subscribed to the live socket')
+LIVE_SUBSCRIBERS_DROPPED = counter('powermon_live_subscribers_dropped_total', 'Live socket subscribers disconnected for falling behind')
+LIVE_MESSAGES_RECEIVED = counter('powermon_live_messages_received_total', 'Live messages received from the ingest process', ('stream',))
+
+_handlers = {}
+_latest = {}
+_subscribers = set()
+_server = None
+_tasks = set()  # strong references; the loop only keeps weak ones to tasks
+
+
+def current_role():
+    role = get_deployment_config()['role']
+    if role not in ROLES:
+        raise ValueError(f"ROLE must be one of {', '.join(ROLES)}, not {role!r}")
+    return role
+
+
+def ingest_enabled():
+    """True where this process owns capture, storage and scheduling."""
+    return current_role() != 'api'
+
+
+def register_stream(stream, handler):
+    """Call handler(item) on the event loop for each `stream` item received from the ingest process."""
+    _handlers[stream] = handler
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+def _encode(stream, item):
+    return (json.dumps([stream, item], separators=(',', ':')) + '\n').encode()
+
+
+def publish(stream, item, key=None):
+    """
+    Send one item to every subscribed API worker. Must run on the event loop;
+    a no-op apart from remembering the latest item (per stream and key, e.g.
+    device) when nobody is subscribed.
+    """
+    _latest[stream, key] = item
+    if not _subscribers:
+        return
+    message = _encode(stream, item)
+    for writer in list(_subscribers):
+        if writer.transport.get_write_buffer_size() > MAX_SUBSCRIBER_BUFFER:
+            LIVE_SUBSCRIBERS_DROPPED.inc()
+            logging.warning("Live subscriber fell behind, disconnecting it", extra={'sampled': True})
+            _subscribers.discard(writer)
+            writer.close()
+            continue
+        writer.write(message)
+    LIVE_SUBSCRIBERS.set(len(_subscribers))
+
+
+async def _serve_subscriber(reader, writer):
+    for (stream, _), item in list(_latest.items()):
+        writer.write(_encode(stream, item))
+    _subscribers.add(writer)
+    LIVE_SUBSCRIBERS.set(len(_subscribers))
+    try:
+        # Subscribers never send anything; EOF means the worker went away
+        await reader.read()
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        _subscribers.discard(writer)
+        LIVE_SUBSCRIBERS.set(len(_subscribers))
+        writer.close()
+
+
+def _claim_socket(path):
+    """Remove a stale socket file, refusing to if another ingest process is serving it."""
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f"Another ingest process is already serving {path}; run exactly one ROLE=ingest process")
+
+
+async def _broadcast_health(interval):
+    while True:
+        publish('health', device_health())
+        await asyncio.sleep(interval)
+
+
+async def subscribe(path):
+    """API worker side: receive live messages from the ingest process, reconnecting forever."""
+    backoff = Backoff()
+    while True:
+        try:
+            reader, writer = await asyncio.open_unix_connection(path, limit=LINE_LIMIT)
+        except OSError as e:
+            delay = backoff.next()
+            logging.warning("Live socket %s unavailable (%s), retrying in %.2fs", path, e, delay, extra={'sampled': True})
+            await asyncio.sleep(delay)
+            continue
+        logging.info(f"Subscribed to live samples on {path}")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                stream, item = json.loads(line)
+                backoff.reset()
+                LIVE_MESSAGES_RECEIVED.inc(stream=stream)
+                handler = _handlers.get(stream)
+                if handler:
+                    try:
+                        handler(item)
+                    except Exception as e:
+                        logging.error("Error handling live %s message: %s", stream, e, extra={'sampled': True})
+        except (ConnectionError, OSError, ValueError) as e:
+            logging.error(f"Live socket {path} failed: {e}")
+        finally:
+            writer.close()
+        delay = backoff.next()
+        logging.warning(f"Lost live socket {path}, reconnecting in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+
+async def start():
+    """Start the socket server (ingest) or the subscription (api) for this process's role."""
+    global _server
+    config = get_deployment_config()
+    role = current_role()
+    if role == 'ingest':
+        _claim_socket(config['live_socket'])
+        _server = await asyncio.start_unix_server(_serve_subscriber, config['live_socket'])
+        os.chmod(config['live_socket'], 0o660)
+        _spawn(_broadcast_health(config['health_interval']))
+        logging.info(f"Ingest process serving live samples on {config['live_socket']}")
+    elif role == 'api':
+        register_stream('health', set_remote_health)
+        _spawn(subscribe(config['live_socket']))
+
+
+async def stop():
+    global _server
+    for task in list(_tasks):
+        task.cancel()
+    if _server is None:
+        return
+    _server.close()
+    for writer in list(_subscribers):
+        writer.close()
+    _subscribers.clear()
+    await _server.wait_closed()
+    _server = None
+    try:
+        os.unlink(get_deployment_config()['live_socket'])
+    except FileNotFoundError:
+        pass
@@ -1,6 +1,10 @@
+import atexit
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import threading
+import time
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
 # Ensure log directory exists
 LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs')
@@ -8,24 +12,114 @@ os.makedirs(LOG_DIR, exist_ok=True)
 
 LOG_FILE = os.path.join(LOG_DIR, 'app.log')
 
+# Minimum seconds between two emitted records of the same sampled message
+SAMPLE_INTERVAL = float(os.getenv('LOG_SAMPLE_INTERVAL', 60))
+
+_listener = None
+_queue_handler = None
+_setup_lock = threading.Lock()
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread. The stock
+    prepare() formats the message in the caller, which is exactly the work we
+    want off the capture threads and the event loop. Records are only shared
+    in-process, so they do not need to be made picklable.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class SampledFilter(logging.Filter):
+    """
+    Rate-limit records below WARNING logged with extra={'sampled': True}: at
+    most one record per (logger, message template) every `interval` seconds
+    passes. Warnings and errors always pass, so a repeated failure stays
+    visible. Dropped records are counted; the next record that passes carries
+    the count in record.suppressed and its message says how many similar
+    ones were skipped.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        super().__init__()
+        self.interval = interval
+        self.suppressed_total = 0
+        self._last = {}
+        self._suppressed = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, 'sampled', False) or record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last.get(key, -self.interval) < self.interval:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                self.suppressed_total += 1
+                return False
+            self._last[key] = now
+            suppressed = self._suppressed.pop(key, 0)
+        if suppressed:
+            # Format here, whatever the args (tuple or mapping), and append the count
+            message = record.getMessage()
+            record.suppressed = suppressed
+            record.msg = "%s (%d similar messages suppressed)"
+            record.args = (message, suppressed)
+        return True
+
+
+sampled_filter = SampledFilter()
+
+
 # Logging configuration
 def setup_logging():
+    """
+    Route all logging through a queue drained by a background listener that
+    writes to the console and the rotating log file. Safe to call repeatedly:
+    handlers are only installed once per process.
+    """
+    global _listener, _queue_handler
     logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
+    with _setup_lock:
+        if _listener is not None:
+            return logger
+        logger.setLevel(logging.INFO)
+
+        formatter = logging.Formatter('[%(asctime)s] %(levelname)s in %(module)s: %(message)s')
 
-    formatter = logging.Formatter('[%(asctime)s] %(levelname)s in %(module)s: %(message)s')
+        # Console handler
+        ch = logging.StreamHandler()
+        ch.setFormatter(formatter)
 
-    # Console handler
-    ch = logging.StreamHandler()
-    ch.setFormatter(formatter)
-    logger.addHandler(ch)
+        # Rotating file handler
+        fh = RotatingFileHandler(LOG_FILE, maxBytes=5*1024*1024, backupCount=3)
+        fh.setFormatter(formatter)
 
-    # Rotating file handler
-    fh = RotatingFileHandler(LOG_FILE, maxBytes=5*1024*1024, backupCount=3)
-    fh.setFormatter(formatter)
-    logger.addHandler(fh)
+        log_queue = queue.SimpleQueue()
+        _queue_handler = DeferredQueueHandler(log_queue)
+        _queue_handler.addFilter(sampled_filter)
+        logger.addHandler(_queue_handler)
+
+        _listener = QueueListener(log_queue, ch, fh, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
 
     return logger
 
+
+def shutdown_logging():
+    """Flush queued records and stop the background writer."""
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _listener is not None:
+            logging.getLogger().removeHandler(_queue_handler)
+            _listener.stop()
+            _listener = None
+            _queue_handler = None
+
+
 # Call this in your main.py before app startup
 # logger = setup_logging()
@@ -0,0 +1,232 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# In-process metrics registry rendered in the Prometheus text exposition format.
+#
+# Metrics are module-level singletons created with counter()/gauge()/histogram()
+# and updated from capture threads, DB writers and the event loop. Each metric
+# guards its values with its own lock held only for a dict update, so the
+# instrumentation cost on the hot path is a few hundred nanoseconds.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _label_key(labelnames, labels):
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Expected labels {labelnames}, got {tuple(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = [(name, value) for name, value in zip(labelnames, key)] + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        f'{name}="' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function, **labels):
+        """Evaluate function() at scrape time instead of tracking a value."""
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def value(self, **labels):
+        key = _label_key(self.labelnames, labels)
+        if key in self._functions:
+            return self._functions[key]()
+        return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+            functions = list(self._functions.items())
+        for key, function in functions:
+            try:
+                items.append((key, function()))
+            except Exception:
+                continue
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        # Index of the first bucket the value fits in; counts are made cumulative at render time
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 3)
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), state):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(float(state[-2]))}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+def _register(cls, name, *args, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, *args, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric {name} already registered as {metric.type}")
+        return metric
+
+
+def counter(name, documentation, labelnames=()):
+    return _register(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    return _register(Gauge, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def render_metrics():
+    """All registered metrics in Prometheus text format (version 0.0.4)."""
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda metric: metric.name)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.header())
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+# Pipeline metrics shared across features
+MODBUS_REQUESTS = counter('powermon_modbus_requests_total', 'Modbus requests sent', ('port',))
+MODBUS_CRC_ERRORS = counter('powermon_modbus_crc_errors_total', 'Modbus responses with a CRC mismatch', ('port',))
+MODBUS_SHORT_READS = counter('powermon_modbus_short_reads_total', 'Modbus responses shorter than expected', ('port',))
+MODBUS_SERIAL_ERRORS = counter('powermon_modbus_serial_errors_total', 'Serial communication errors', ('port',))
+MODBUS_REQUEST_SECONDS = histogram('powermon_modbus_request_seconds', 'Modbus request round-trip time', ('port',))
+
+SAMPLES_CAPTURED = counter('powermon_samples_captured_total', 'Samples captured and queued', ('stream',))
+LAST_SAMPLE_TIMESTAMP = gauge('powermon_last_sample_timestamp_seconds', 'Unix time of the last captured sample', ('stream',))
+CAPTURE_QUEUE_DEPTH = gauge('powermon_capture_queue_depth', 'Samples waiting in the capture queue', ('stream',))
+SAMPLES_DROPPED = counter('powermon_samples_dropped_total', 'Samples dropped because a storage queue was full', ('stream',))
+
+DB_WRITE_SECONDS = histogram('powermon_db_write_seconds', 'executemany + commit latency', ('table',))
+DB_ROWS_WRITTEN = counter('powermon_db_rows_written_total', 'Rows written', ('table',))
+DB_ERRORS = counter('powermon_db_errors_total', 'Database errors', ('operation',))
+DB_READS = counter('powermon_db_reads_total', 'Read-only connections opened', ('target',))
+DB_REPLICA_UP = gauge('powermon_db_replica_up', 'Read replica answering and replicating (1) or not (0)', ('replica',))
+DB_REPLICA_LAG = gauge('powermon_db_replica_lag_seconds', 'Replication lag of a read replica at its last check', ('replica',))
+
+SSE_CLIENTS = gauge('powermon_sse_clients', 'Connected live-stream clients', ('stream',))
+SSE_DROPPED = counter('powermon_sse_dropped_total', 'Live samples dropped for slow clients', ('stream',))
+
+SCHEDULER_JOB_SECONDS = histogram(
+    'powermon_scheduler_job_seconds', 'Summary job duration', ('job',),
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+)
+SCHEDULER_JOB_FAILURES = counter('powermon_scheduler_job_failures_total', 'Summary jobs that raised', ('job',))
+
+COMPRESSION_RATIO = gauge('powermon_compression_ratio', 'Samples received per row stored by the compressor', ('stream',))
@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import time
+import serial
+from common.metrics import (
+    MODBUS_REQUESTS,
+    MODBUS_CRC_ERRORS,
+    MODBUS_SHORT_READS,
+    MODBUS_SERIAL_ERRORS,
+    MODBUS_REQUEST_SECONDS
+)
+from common.modbus import request_frame, response_length, frame_ok, decode_registers
+from common.supervisor import Backoff, wait_for_device_async
+from common import pipeline
+
+# asyncio Modbus RTU transport.
+#
+# One AsyncModbusBus per serial port owns the file descriptor, registered with
+# the event loop via add_reader, and a request pipeline: callers await
+# request(), which queues the transaction for the bus worker. RS-485 is
+# half-duplex, so the worker runs one transaction at a time and keeps the
+# 3.5-character silent interval between frames. A reply ends when the expected
+# length has arrived; after t3.5 of silence a shorter buffer is accepted only
+# if it is itself a valid frame (exception replies), because USB adapters
+# deliver bytes in bursts with gaps longer than t3.5. Every transaction has its
+# own timeout, so a missing slave costs only that slave's slot, not a thread.
+#
+# Several devices on the same port (multi-drop) share one bus via get_bus().
+
+_buses = {}
+
+
+def silent_interval(baud_rate):
+    """Modbus RTU t3.5: 3.5 characters of 11 bits, fixed at 1.75 ms above 19200 baud."""
+    if baud_rate > 19200:
+        return 0.00175
+    return 3.5 * 11 / baud_rate
+
+
+class AsyncModbusBus:
+    def __init__(self, port, baud_rate=9600, timeout=1.0):
+        self.port = port
+        self.baud_rate = baud_rate
+        self.timeout = timeout
+        self.silence = silent_interval(baud_rate)
+        self._serial = None
+        self._loop = None
+        self._requests = None
+        self._worker = None
+        self._buffer = bytearray()
+        self._expected = 0
+        self._reply = None
+        self._silence_timer = None
+        self._last_activity = 0.0
+
+    @property
+    def is_open(self):
+        return self._serial is not None
+
+    def open(self):
+        """Open the port non-blocking and register it with the running loop."""
+        if self._serial is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._serial = serial.Serial(self.port, self.baud_rate, timeout=0, write_timeout=0)
+        self._loop.add_reader(self._serial.fileno(), self._on_readable)
+        logging.info(f"Connected to serial port: {self.port} (async, t3.5={self.silence * 1000:.2f}ms)")
+
+    def close(self):
+        if self._serial is None:
+            return
+        try:
+            self._loop.remove_reader(self._serial.fileno())
+        except (ValueError, OSError):
+            pass
+        try:
+            self._serial.close()
+        except (serial.SerialException, OSError):
+            pass
+        self._serial = None
+        self._fail_reply(None)
+        logging.info(f"Serial port {self.port} closed.")
+
+    def _fail_reply(self, exc):
+        if self._reply is not None and not self._reply.done():
+            if exc is None:
+                self._reply.set_result(bytes(self._buffer))
+            else:
+                self._reply.set_exception(exc)
+
+    def _on_readable(self):
+        try:
+            data = self._serial.read(self._serial.in_waiting or 1)
+        except (serial.SerialException, OSError) as e:
+            # Device unplugged: the fd stays readable forever, so stop watching
+            # it and close the port, so pollers see it closed and reopen it
+            MODBUS_SERIAL_ERRORS.inc(port=self.port)
+            logging.error("Serial communication error: %s", e, extra={'sampled': True})
+            self._fail_reply(serial.SerialException(str(e)))
+            self.close()
+            return
+        self._last_activity = time.monotonic()
+        if self._reply is None or self._reply.done():
+            return  # stray bytes outside a transaction
+        self._buffer += data
+        if self._silence_timer:
+            self._silence_timer.cancel()
+            self._silence_timer = None
+        if len(self._buffer) >= self._expected:
+            self._reply.set_result(bytes(self._buffer[:self._expected]))
+        elif len(self._buffer) >= 5 and self._buffer[1] & 0x80:
+            self._reply.set_result(bytes(self._buffer[:5]))  # exception reply
+        else:
+            self._silence_timer = self._loop.call_later(self.silence, self._on_silence)
+
+    def _on_silence(self):
+        self._silence_timer = None
+        if self._reply is not None and not self._reply.done() and len(self._buffer) >= 4 and frame_ok(self._buffer):
+            self._reply.set_result(bytes(self._buffer))
+
+    async def _transact(self, slave_address, function_code, register_address, num_registers, timeout):
+        self.open()
+        # Keep the inter-frame gap after the previous reply (or stray bytes)
+        gap = self._last_activity + self.silence - time.monotonic()
+        if gap > 0:
+            await asyncio.sleep(gap)
+        self._buffer.clear()
+        self._expected = response_length(num_registers)
+        self._reply = self._loop.create_future()
+        MODBUS_REQUESTS.inc(port=self.port)
+        start = time.perf_counter()
+        try:
+            self._serial.write(request_frame(slave_address, function_code, register_address, num_registers))
+            response = await asyncio.wait_for(self._reply, timeout)
+        except asyncio.TimeoutError:
+            response = bytes(self._buffer)
+        finally:
+            self._last_activity = time.monotonic()
+            self._reply = None
+            if self._silence_timer:
+                self._silence_timer.cancel()
+                self._silence_timer = None
+        MODBUS_REQUEST_SECONDS.observe(time.perf_counter() - start, port=self.port)
+        if len(response) < self._expected:
+            MODBUS_SHORT_READS.inc(port=self.port)
+            if len(response) == 5 and response[1] & 0x80 and frame_ok(response):
+                logging.warning("Modbus exception %d from slave %d", response[2], slave_address, extra={'sampled': True})
+            else:
+                logging.warning("Incomplete response received", extra={'sampled': True})
+            return None
+        if not frame_ok(response):
+            MODBUS_CRC_ERRORS.inc(port=self.port)
+            logging.warning("CRC mismatch in response", extra={'sampled': True})
+            return None
+        if response[0] != slave_address or response[1] != function_code or response[2] != 2 * num_registers:
+            logging.warning("Unexpected response header from slave %d", slave_address, extra={'sampled': True})
+            return None
+        return decode_registers(response, num_registers)
+
+    async def _run(self):
+        while True:
+            args, future = await self._requests.get()
+            if future.cancelled():
+                continue
+            try:
+                result = await self._transact(*args)
+            except (serial.SerialException, OSError) as e:
+                MODBUS_SERIAL_ERRORS.inc(port=self.port)
+                logging.error("Serial communication error: %s", e, extra={'sampled': True})
+                self.close()
+                result = None
+            except Exception as e:
+                logging.error(f"Unexpected error in Modbus communication: {e}")
+                result = None
+            if not future.done():
+                future.set_result(result)
+
+    async def request(self, slave_address, function_code, register_address, num_registers, timeout=None):
+        """
+        Queue one read on this bus and return the register tuple, or None on
+        timeout, a corrupt reply or a serial error.
+        """
+        if self._worker is None or self._worker.done():
+            self._requests = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        args = (slave_address, function_code, register_address, num_registers, timeout or self.timeout)
+        await self._requests.put((args, future))
+        return await future
+
+    async def aclose(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self.close()
+
+
+def get_bus(port, baud_rate=9600, timeout=1.0):
+    """Shared bus for a serial port, so devices on one RS-485 line share its pipeline."""
+    bus = _buses.get(port)
+    if bus is None:
+        bus = _buses[port] = AsyncModbusBus(port, baud_rate, timeout)
+    return bus
+
+
+async def close_buses(timeout=None):
+    """Stop every bus worker and close its port; run once the capture tasks polling them have stopped."""
+    for bus in list(_buses.values()):
+        await bus.aclose()
+
+pipeline.register('serial-buses', pipeline.SERIAL, None, close_buses)
+
+
+async def poll(bus, slave_address, function_code, register_address, num_registers, interval, handle,
+               stop_event=None, health=None):
+    """
+    Read registers every `interval` seconds on a fixed schedule and call
+    handle(registers) in the loop for each good reply. Slow or failed reads
+    do not shift the schedule; missed ticks are skipped rather than bunched.
+    While the port is closed it is reopened with jittered backoff, woken early
+    when the device node reappears; health (a DeviceHealth) tracks the state.
+    """
+    loop = asyncio.get_running_loop()
+    backoff = Backoff()
+    next_tick = loop.time()
+    while not (stop_event and stop_event.is_set()):
+        if not bus.is_open:
+            try:
+                bus.open()
+            except (serial.SerialException, OSError) as e:
+                delay = backoff.next()
+                if health:
+                    health.mark_disconnected(e, delay)
+                await wait_for_device_async(bus.port, delay)
+                next_tick = loop.time()
+                continue
+            if health:
+                health.mark_connected()
+        registers = await bus.request(slave_address, function_code, register_address, num_registers)
+        if registers is not None:
+            backoff.reset()
+            if health:
+                health.mark_ok()
+            try:
+                handle(registers)
+            except Exception as e:
+                logging.error("Error in data capture: %s", e, extra={'sampled': True})
+        elif not bus.is_open:
+            # A serial error closed the port; the backoff only resets after a good read,
+            # so a port that opens but keeps failing is not reopened in a tight loop
+            delay = backoff.next()
+            if health:
+                health.mark_disconnected("serial error during request", delay)
+            await wait_for_device_async(bus.port, delay)
+            next_tick = loop.time()
+            continue
+        else:
+            if health:
+                health.mark_failure("no valid reply")
+            logging.warning("No data received from PZEM device", extra={'sampled': True})
+        next_tick += interval
+        now = loop.time()
+        if next_tick < now:
+            next_tick = now + interval - (now - next_tick) % interval
+        await asyncio.sleep(next_tick - now)
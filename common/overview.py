@@ -0,0 +1,202 @@
+import logging
+from datetime import datetime, timedelta
+from common.compact import raw_source
+from common.database import db_connection
+from common.devices import get_devices, get_device
+
+# Running "today" counters behind /overview.
+#
+# publish_ac_sample / publish_solar_sample call observe() with every sample,
+# on the event loop, in every process that serves HTTP (API workers receive
+# the samples over the live socket), so no locking is needed. Each meter
+# keeps the energy register reading it counts today's energy from; when a
+# sample falls on a new date, the previous reading (the last one before
+# midnight) becomes that baseline, as in common/snapshots.py. At startup
+# seed() loads the baseline from today's energyMidnightSnapshot row (or the
+# last raw reading before midnight) and today's peak power, so a restart
+# does not lose the day. Reading the overview touches no database.
+
+_counters = {}  # device_id -> DayCounter
+_site_peaks = {}  # site_id -> [date, peak W, at]
+_seeded = False
+
+
+class DayCounter:
+    """Today's energy and peak power of one meter, from its register readings."""
+
+    __slots__ = ('device_id', 'kind', 'site_id', 'day', 'baseline', 'last_energy', 'power', 'timestamp', 'peak', 'peak_at')
+
+    def __init__(self, device):
+        self.device_id = device['device_id']
+        self.kind = device['kind']
+        self.site_id = device['site_id']
+        self.day = None
+        self.baseline = None
+        self.last_energy = None
+        self.power = None
+        self.timestamp = None
+        self.peak = None
+        self.peak_at = None
+
+    def observe(self, timestamp, power, energy):
+        day = timestamp[:10]
+        if day != self.day:
+            # Day boundary: count the new day from the last reading before midnight
+            self.day = day
+            self.baseline = self.last_energy
+            self.peak = None
+        if self.baseline is None:
+            self.baseline = energy
+        else:
+            previous = self.last_energy if self.last_energy is not None else self.baseline
+            if energy < previous:
+                # Register reset: keep what was counted so far and carry on from the new reading
+                self.baseline -= previous
+        self.last_energy = energy
+        self.power = power
+        self.timestamp = timestamp
+        if self.peak is None or power > self.peak:
+            self.peak = power
+            self.peak_at = timestamp
+
+    def today_energy(self, day):
+        """Wh counted on `day` (YYYY-MM-DD), 0 when the meter has no reading from that day."""
+        if self.day != day or self.last_energy is None:
+            return 0.0
+        return self.last_energy - self.baseline
+
+
+def _counter(device_id):
+    counter = _counters.get(device_id)
+    if counter is None:
+        device = get_device(device_id)
+        if device is None:
+            return None
+        counter = _counters[device_id] = DayCounter(device)
+    return counter
+
+
+def observe(device_id, timestamp, power, energy):
+    """Count one sample (timestamp 'YYYY-MM-DD HH:MM:SS', power W, energy register Wh) of a meter."""
+    counter = _counter(device_id)
+    if counter is None:
+        return
+    counter.observe(timestamp, power, energy)
+    if counter.kind != 'consumption':
+        return
+    # Site peak is coincident: the sum of the latest readings of the site's consumption meters
+    site_power = sum(
+        other.power for other in _counters.values()
+        if other.site_id == counter.site_id and other.kind == 'consumption' and other.day == counter.day and other.power is not None
+    )
+    peak = _site_peaks.get(counter.site_id)
+    if peak is None or peak[0] != counter.day or site_power > peak[1]:
+        _site_peaks[counter.site_id] = [counter.day, site_power, timestamp]
+
+
+def _seed_device(connection, counter, today):
+    midnight = datetime.combine(today, datetime.min.time())
+    column = 'energyConsumption' if counter.kind == 'consumption' else 'energyProduction'
+    table, col, device_condition, device_params = raw_source(counter.kind, counter.device_id)
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {column} AS energy FROM energyMidnightSnapshot WHERE device = %s AND date = %s", (counter.device_id, today))
+        row = cursor.fetchone()
+        if not row or row['energy'] is None:
+            cursor.execute(f"""
+                SELECT {col['energy']} AS energy FROM {table}
+                WHERE {device_condition} AND timestamp < %s
+                ORDER BY timestamp DESC LIMIT 1
+            """, (*device_params, midnight))
+            row = cursor.fetchone()
+        baseline = float(row['energy']) if row and row['energy'] is not None else None
+        # Today's samples only, read off the (device, timestamp) index
+        cursor.execute(f"""
+            SELECT timestamp, {col['power']} AS power FROM {table}
+            WHERE {device_condition} AND timestamp >= %s AND timestamp < %s
+            ORDER BY {col['power']} DESC LIMIT 1
+        """, (*device_params, midnight, midnight + timedelta(days=1)))
+        peak = cursor.fetchone()
+    day = today.isoformat()
+    if counter.day not in (None, day):
+        return
+    counter.day = day
+    if baseline is not None and (counter.baseline is None or baseline < counter.baseline):
+        counter.baseline = baseline
+    if peak and (counter.peak is None or float(peak['power']) > counter.peak):
+        counter.peak = float(peak['power'])
+        counter.peak_at = peak['timestamp'].strftime('%Y-%m-%d %H:%M:%S')
+
+
+def seed():
+    """Load every meter's midnight baseline and peak so far today; blocking, run once at startup."""
+    global _seeded
+    if _seeded:
+        return
+    _seeded = True
+    today = datetime.now().date()
+    with db_connection() as connection:
+        if not connection:
+            logging.warning("Overview counters not seeded (no database); today's energy counts from the first sample")
+            return
+        for device in get_devices():
+            counter = _counter(device['device_id'])
+            try:
+                _seed_device(connection, counter, today)
+            except Exception as e:
+                logging.error(f"Could not seed overview counters for device {device['device_id']}: {e}")
+    day = today.isoformat()
+    for site_id in {device['site_id'] for device in get_devices()}:
+        peaks = [
+            counter for counter in _counters.values()
+            if counter.site_id == site_id and counter.kind == 'consumption' and counter.day == day and counter.peak is not None
+        ]
+        if peaks and site_id not in _site_peaks:
+            best = max(peaks, key=lambda counter: counter.peak)
+            # Per-meter peaks were not simultaneous; the largest is a lower bound until samples arrive
+            _site_peaks[site_id] = [day, best.peak, best.peak_at]
+    logging.info(f"Overview counters seeded for {len(_counters)} devices")
+
+
+def overview(site_id):
+    """Current power, today's energy and peak of a site's meters, from the counters alone."""
+    day = datetime.now().strftime('%Y-%m-%d')
+    totals = {'consumption': [0.0, 0.0], 'production': [0.0, 0.0]}  # kind -> [power W, today Wh]
+    devices = []
+    latest = None
+    for device in get_devices(site_id=site_id):
+        counter = _counters.get(device['device_id'])
+        power = counter.power if counter and counter.day == day else None
+        energy = counter.today_energy(day) if counter else 0.0
+        totals[device['kind']][0] += power or 0.0
+        totals[device['kind']][1] += energy
+        if counter and counter.timestamp and (latest is None or counter.timestamp > latest):
+            latest = counter.timestamp
+        devices.append({
+            'deviceId': device['device_id'],
+            'kind': device['kind'],
+            'power': power,
+            'todayKWh': round(energy / 1000, 3),
+            'peakPower': counter.peak if counter and counter.day == day else None,
+            'peakAt': counter.peak_at if counter and counter.day == day else None,
+            'lastSample': counter.timestamp if counter else None,
+        })
+    consumption_power, consumed = totals['consumption']
+    production_power, produced = totals['production']
+    peak = _site_peaks.get(site_id)
+    if peak and peak[0] != day:
+        peak = None
+    return {
+        'siteId': site_id,
+        'date': day,
+        'lastSample': latest,
+        'consumptionPower': round(consumption_power, 1),
+        'productionPower': round(production_power, 1),
+        # Positive when importing from the grid, negative when exporting
+        'netPower': round(consumption_power - production_power, 1),
+        'consumedTodayKWh': round(consumed / 1000, 3),
+        'producedTodayKWh': round(produced / 1000, 3),
+        'netTodayKWh': round((consumed - produced) / 1000, 3),
+        'peakPowerToday': peak[1] if peak else None,
+        'peakAt': peak[2] if peak else None,
+        'devices': devices,
+    }
@@ -0,0 +1,179 @@
+import asyncio
+import inspect
+import logging
+import time
+from config import get_deployment_config
+from common import livebus
+from common.database import ping, start_replica_monitor, stop_replica_monitor
+from common.metrics import gauge
+
+# Background pipeline of a process, started and stopped by the app lifespan
+# (main.py), exactly once.
+#
+# Every long-running component (live socket, DB writers, alert engine, serial
+# capture, summary scheduler) registers itself at import with a stage, and
+# components start in stage order:
+#
+#     STORAGE     database check, read-replica lag monitor, live socket
+#     WRITERS     per-meter DB writer threads, so storage queues drain from
+#                 the first sample
+#     PROCESSING  overview counters, alert engine
+#     SERIAL      shared event-loop Modbus buses
+#     CAPTURE     serial polling (threads or event-loop tasks) and forwarders
+#     SCHEDULING  summary jobs
+#
+# and stop in reverse. Capture stops first, so nothing new is queued and the
+# ports are closed; then each writer stores everything still queued (and the
+# point its compressor holds) before exiting. The whole stop is bounded by
+# SHUTDOWN_DRAIN_TIMEOUT: a component still busy at the deadline is logged
+# and abandoned (its threads are daemons), so a rolling restart finishes in
+# bounded time. uvicorn only runs the lifespan shutdown once open responses
+# have finished, and live SSE streams never do, so run it with
+# --timeout-graceful-shutdown to bound that wait too.
+#
+# start() may be a coroutine function; stop(timeout) may be one too, or
+# a blocking function, which is run in a worker thread, returning False if it
+# gave up before finishing. Components registered ingest_only do not run on
+# ROLE=api workers.
+#
+# /ready answers 200 once every started component with a ready() check
+# passes: the database answers and every meter has answered a poll.
+
+STORAGE, WRITERS, PROCESSING, SERIAL, CAPTURE, SCHEDULING = range(6)
+
+PIPELINE_READY = gauge('powermon_pipeline_ready', 'Pipeline started with the database and every meter up (1) or not (0)')
+
+_components = []
+_started = []
+_tasks = set()  # strong references; the loop only keeps weak ones to tasks
+_stopping = False
+
+
+class Component:
+    def __init__(self, name, stage, start, stop=None, ready=None, ingest_only=True):
+        self.name = name
+        self.stage = stage
+        self.start = start
+        self.stop = stop
+        self.ready = ready
+        self.ingest_only = ingest_only
+
+
+def register(name, stage, start, stop=None, ready=None, ingest_only=True):
+    """Add a component; start() runs at startup, stop(timeout) at shutdown and ready() for /ready."""
+    _components.append(Component(name, stage, start, stop, ready, ingest_only))
+
+
+def spawn(coro):
+    """Run a coroutine as a task that is kept referenced until it finishes."""
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+def join_threads(threads, timeout):
+    """Join threads until the timeout runs out; True if all of them finished."""
+    deadline = time.monotonic() + timeout
+    for thread in threads:
+        thread.join(max(deadline - time.monotonic(), 0))
+    return not any(thread.is_alive() for thread in threads)
+
+
+def status():
+    """{component name: ready} for the started components that have a ready() check."""
+    checks = {}
+    for component in _started:
+        if component.ready is None:
+            continue
+        try:
+            checks[component.name] = bool(component.ready())
+        except Exception as e:
+            logging.error(f"Readiness check of {component.name} failed: {e}")
+            checks[component.name] = False
+    return checks
+
+
+def is_ready(checks=None):
+    """True once started, not stopping, and every ready() check (checks: a status() result) passes."""
+    if checks is None:
+        checks = status()
+    return bool(_started) and not _stopping and all(checks.values())
+
+
+async def _report_ready(started):
+    delay = 0.25
+    while not is_ready():
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 10)
+    PIPELINE_READY.set(1)
+    logging.info(f"Pipeline ready {time.monotonic() - started:.1f}s after startup")
+
+
+async def start():
+    """Start the components this process's role runs, in stage order."""
+    ingest = livebus.ingest_enabled()
+    started = time.monotonic()
+    try:
+        for component in sorted(_components, key=lambda component: component.stage):
+            if component.ingest_only and not ingest:
+                continue
+            result = component.start() if component.start else None
+            if inspect.isawaitable(result):
+                await result
+            _started.append(component)
+            logging.info(f"Started {component.name}")
+    except Exception:
+        logging.exception("Pipeline startup failed, stopping the components already started")
+        await stop()
+        raise
+    spawn(_report_ready(started))
+
+
+async def _stop_component(component, timeout):
+    if inspect.iscoroutinefunction(component.stop):
+        return await asyncio.wait_for(component.stop(timeout), timeout)
+    # Blocking stops join threads; run them off the loop so event-loop components keep running
+    return await asyncio.wait_for(asyncio.to_thread(component.stop, timeout), timeout + 1)
+
+
+async def stop():
+    """Stop the started components in reverse order within SHUTDOWN_DRAIN_TIMEOUT."""
+    global _stopping
+    _stopping = True
+    PIPELINE_READY.set(0)
+    for task in list(_tasks):
+        task.cancel()
+    timeout = get_deployment_config()['drain_timeout']
+    deadline = time.monotonic() + timeout
+    while _started:
+        component = _started.pop()
+        if component.stop is None:
+            continue
+        # Past the deadline a component still gets a moment to signal its threads to stop
+        remaining = max(deadline - time.monotonic(), 0.1)
+        try:
+            finished = await _stop_component(component, remaining)
+        except asyncio.TimeoutError:
+            finished = False
+        except Exception as e:
+            logging.error(f"Error stopping {component.name}: {e}")
+            continue
+        if finished is False:
+            logging.error(f"{component.name} did not stop within the {timeout:g}s shutdown deadline")
+        else:
+            logging.info(f"Stopped {component.name}")
+
+
+def _check_database():
+    if not ping():
+        logging.warning("Database unreachable at startup; the writers keep retrying")
+
+
+async def _stop_live_socket(timeout):
+    await livebus.stop()
+
+
+register('database', STORAGE, _check_database, ready=ping, ingest_only=False)
+register('replicas', STORAGE, start_replica_monitor, stop_replica_monitor, ingest_only=False)
+register('live-socket', STORAGE, livebus.start, _stop_live_socket, ingest_only=False)
@@ -0,0 +1,135 @@
+import gzip
+import json
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import Response
+
+# Bulk JSON responses (summary listings, history ranges).
+#
+# Routes returning many DB rows hand the row dicts straight to json_response,
+# which encodes them to bytes in one call (orjson when installed, else the
+# stdlib encoder) instead of building a Pydantic model per row and having
+# FastAPI validate and re-encode them. Bodies above MIN_COMPRESS_SIZE are
+# compressed with brotli (when installed) or gzip, as the client accepts.
+# Routes that know when their data last changed pass an ETag/Last-Modified,
+# and not_modified() answers a matching conditional request before any rows
+# are read.
+
+MIN_COMPRESS_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+try:
+    import orjson
+    JSON_BACKEND = 'orjson'
+except ImportError:
+    orjson = None
+    JSON_BACKEND = 'json'
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _default(value):
+    # DECIMAL results (compact-schema expressions) and anything orjson does not know
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content):
+    """Encode rows (dicts of DB values) to JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(content, default=_default, separators=(',', ':')).encode()
+
+
+def _accepted_encodings(request):
+    """Content codings the request accepts (q > 0)."""
+    accepted = set()
+    for part in request.headers.get('accept-encoding', '').split(','):
+        coding, *params = part.split(';')
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition('=')
+            if name.lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _compress(request, body):
+    """(body, content-encoding) in the best encoding the client accepts, or unchanged."""
+    if len(body) < MIN_COMPRESS_SIZE:
+        return body, None
+    accepted = _accepted_encodings(request)
+    if brotli is not None and 'br' in accepted:
+        return brotli.compress(body, quality=BROTLI_QUALITY), 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return gzip.compress(body, GZIP_LEVEL), 'gzip'
+    return body, None
+
+
+def http_date(moment):
+    """HTTP-date for a naive UTC or aware datetime."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return format_datetime(moment.astimezone(timezone.utc), usegmt=True)
+
+
+def _validator_headers(etag, last_modified):
+    headers = {'Cache-Control': 'no-cache'}
+    if etag:
+        headers['ETag'] = etag
+    if last_modified:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+
+def not_modified(request, etag=None, last_modified=None):
+    """
+    304 response if the request's If-None-Match / If-Modified-Since show the
+    client already has this representation, else None. If-None-Match wins
+    when both are sent and is compared weakly, since one ETag covers every
+    content encoding of the same data.
+    """
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        if not etag:
+            return None
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        if '*' not in tags and etag.removeprefix('W/') not in tags:
+            return None
+    elif last_modified is not None and request.headers.get('if-modified-since'):
+        try:
+            since = parsedate_to_datetime(request.headers['if-modified-since'])
+        except (TypeError, ValueError):
+            return None
+        modified = last_modified if last_modified.tzinfo else last_modified.replace(tzinfo=timezone.utc)
+        if since.tzinfo is None or modified.replace(microsecond=0) > since:
+            return None
+    else:
+        return None
+    return Response(status_code=304, headers=_validator_headers(etag, last_modified))
+
+
+def json_response(request, content, etag=None, last_modified=None, headers=None, status_code=200):
+    """Serialized, negotiated-compression JSON response for content (rows, or a dict of rows)."""
+    body, encoding = _compress(request, dumps(content))
+    response_headers = {'Vary': 'Accept-Encoding'}
+    if etag or last_modified:
+        response_headers.update(_validator_headers(etag, last_modified))
+    if encoding:
+        response_headers['Content-Encoding'] = encoding
+    if headers:
+        response_headers.update(headers)
+    return Response(body, status_code=status_code, media_type='application/json', headers=response_headers)
@@ -0,0 +1,50 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+from common.database import db_connection, save_midnight_snapshots
+
+# Live capture of the meter energy registers at each day boundary.
+#
+# The capture loops feed every sample's timestamp and energy register to a
+# MidnightTracker. When a sample falls on a later date than the previous one,
+# the previous reading is the last value before midnight and becomes the
+# snapshot for every date that started in between (the register does not move
+# while a solar meter is dark overnight).
+
+
+class MidnightTracker:
+    def __init__(self, kind, device_id):
+        self.kind = kind
+        self.device_id = device_id
+        self.last_date = None
+        self.last_energy = None
+
+    def observe(self, timestamp, energy):
+        """
+        Record a sample; returns [(date, energy)] snapshots for any day
+        boundaries crossed since the previous sample.
+        """
+        date = datetime.strptime(timestamp[:10], '%Y-%m-%d').date()
+        snapshots = []
+        if self.last_date is not None and date > self.last_date:
+            day = self.last_date + timedelta(days=1)
+            while day <= date:
+                snapshots.append((day, self.last_energy))
+                day += timedelta(days=1)
+        self.last_date = date
+        self.last_energy = energy
+        if snapshots:
+            record_midnight_snapshots(self.kind, self.device_id, snapshots)
+        return snapshots
+
+
+def _save(kind, device_id, snapshots):
+    with db_connection() as connection:
+        if connection:
+            save_midnight_snapshots(connection, kind, device_id, snapshots)
+            logging.info(f"Recorded midnight energy snapshot ({kind}, device {device_id}): {snapshots[-1][0]}")
+
+
+def record_midnight_snapshots(kind, device_id, snapshots):
+    """Write snapshots off the capture thread so a slow database cannot stall polling."""
+    threading.Thread(target=_save, args=(kind, device_id, snapshots), daemon=True).start()
@@ -0,0 +1,342 @@
+import re
+import sqlite3
+import threading
+from datetime import date, datetime
+from functools import lru_cache
+
+# Embedded storage engine (DB_BACKEND=sqlite) for edge sites.
+#
+# The same tables as init_db.py live in one SQLite file in WAL mode, so the
+# capture writers, the summary jobs and the API read concurrently without a
+# database server: readers never block the single writer, and each batch the
+# transfer threads flush is one transaction. With synchronous=NORMAL a commit
+# only appends to the WAL; the file is fsynced at checkpoints, which can lose
+# the last batches on power loss but never corrupts the database.
+#
+# Connections are wrapped to look like the pymysql DictCursor connections the
+# rest of the code uses: "%s" placeholders (and "%%" escapes) are rewritten to
+# SQLite's "?", rows come back as dicts, and TIMESTAMP/DATE columns come back
+# as datetime/date. Dialect differences in SQL text (upserts, hour buckets)
+# are handled in common/database.py.
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS energyProduction_raw (
+        id INTEGER PRIMARY KEY,
+        device INTEGER NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        voltage REAL NOT NULL,
+        current REAL NOT NULL,
+        power REAL NOT NULL,
+        energy REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_production_device_time ON energyProduction_raw (device, timestamp)",
+    """
+    CREATE TABLE IF NOT EXISTS energyConsumption_raw (
+        id INTEGER PRIMARY KEY,
+        device INTEGER NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        voltage REAL NOT NULL,
+        current REAL NOT NULL,
+        power REAL NOT NULL,
+        energy REAL NOT NULL,
+        frequency REAL NOT NULL,
+        power_factor REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_consumption_device_time ON energyConsumption_raw (device, timestamp)",
+    """
+    CREATE TABLE IF NOT EXISTS energyProduction_compact (
+        device INTEGER NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        voltage INTEGER NOT NULL,
+        current INTEGER NOT NULL,
+        power INTEGER NOT NULL,
+        energy INTEGER NOT NULL,
+        PRIMARY KEY (device, timestamp)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS energyConsumption_compact (
+        device INTEGER NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        voltage INTEGER NOT NULL,
+        current INTEGER NOT NULL,
+        power INTEGER NOT NULL,
+        energy INTEGER NOT NULL,
+        frequency INTEGER NOT NULL,
+        power_factor INTEGER NOT NULL,
+        PRIMARY KEY (device, timestamp)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS energyConsumption_burst (
+        device INTEGER NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        samples INTEGER NOT NULL,
+        voltage_min REAL NOT NULL,
+        voltage_max REAL NOT NULL,
+        voltage_mean REAL NOT NULL,
+        voltage_last REAL NOT NULL,
+        current_min REAL NOT NULL,
+        current_max REAL NOT NULL,
+        current_mean REAL NOT NULL,
+        current_last REAL NOT NULL,
+        power_min REAL NOT NULL,
+        power_max REAL NOT NULL,
+        power_mean REAL NOT NULL,
+        power_last REAL NOT NULL,
+        energy_last REAL NOT NULL,
+        frequency_min REAL NOT NULL,
+        frequency_max REAL NOT NULL,
+        frequency_mean REAL NOT NULL,
+        frequency_last REAL NOT NULL,
+        power_factor_min REAL NOT NULL,
+        power_factor_max REAL NOT NULL,
+        power_factor_mean REAL NOT NULL,
+        power_factor_last REAL NOT NULL,
+        peak_offset_ms INTEGER NOT NULL,
+        PRIMARY KEY (device, timestamp)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS powerPeakEvents (
+        id INTEGER PRIMARY KEY,
+        device INTEGER NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        peakPower REAL NOT NULL,
+        meanPower REAL NOT NULL,
+        minVoltage REAL NOT NULL,
+        samples INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_peak_device_time ON powerPeakEvents (device, timestamp)",
+    """
+    CREATE TABLE IF NOT EXISTS alertEvents (
+        id INTEGER PRIMARY KEY,
+        device INTEGER NOT NULL,
+        rule TEXT NOT NULL,
+        severity TEXT NOT NULL,
+        state TEXT NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        value REAL,
+        threshold REAL NOT NULL,
+        message TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_alert_device_time ON alertEvents (device, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_alert_device_rule ON alertEvents (device, rule)",
+    """
+    CREATE TABLE IF NOT EXISTS hourSummary (
+        id INTEGER PRIMARY KEY,
+        device INTEGER NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        energyConsumption REAL NOT NULL,
+        avgVoltage REAL NOT NULL,
+        avgCurrent REAL NOT NULL,
+        avgPower REAL NOT NULL,
+        avgFrequency REAL NOT NULL,
+        avgPF REAL NOT NULL,
+        version INTEGER NOT NULL,
+        UNIQUE (device, timestamp)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_hour_version ON hourSummary (version)",
+    """
+    CREATE TABLE IF NOT EXISTS hourSummarySolar (
+        id INTEGER PRIMARY KEY,
+        device INTEGER NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        energyProduced REAL NOT NULL,
+        minVoltage REAL NOT NULL,
+        maxVoltage REAL NOT NULL,
+        avgVoltage REAL NOT NULL,
+        minCurrent REAL NOT NULL,
+        maxCurrent REAL NOT NULL,
+        avgCurrent REAL NOT NULL,
+        minPower REAL NOT NULL,
+        maxPower REAL NOT NULL,
+        version INTEGER NOT NULL,
+        UNIQUE (device, timestamp)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_hour_solar_version ON hourSummarySolar (version)",
+    """
+    CREATE TABLE IF NOT EXISTS dailySummary (
+        id INTEGER PRIMARY KEY,
+        device INTEGER NOT NULL,
+        date DATE NOT NULL,
+        energyConsumption REAL,
+        solarProduction REAL,
+        version INTEGER NOT NULL,
+        UNIQUE (device, date)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_daily_version ON dailySummary (version)",
+    """
+    CREATE TABLE IF NOT EXISTS energyMidnightSnapshot (
+        device INTEGER NOT NULL,
+        date DATE NOT NULL,
+        energyConsumption REAL,
+        energyProduction REAL,
+        PRIMARY KEY (device, date)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS demandPeak (
+        device INTEGER NOT NULL,
+        date DATE NOT NULL,
+        peakDemand REAL NOT NULL,
+        peakAt TIMESTAMP NOT NULL,
+        PRIMARY KEY (device, date)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS loadHeatmap (
+        device INTEGER NOT NULL,
+        weekday INTEGER NOT NULL,
+        hour INTEGER NOT NULL,
+        hours INTEGER NOT NULL,
+        energy REAL NOT NULL,
+        PRIMARY KEY (device, weekday, hour)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS solarYieldHistogram (
+        device INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        bin INTEGER NOT NULL,
+        days INTEGER NOT NULL,
+        PRIMARY KEY (device, month, bin)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS analyticsProgress (
+        device INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        upto TIMESTAMP NOT NULL,
+        PRIMARY KEY (device, name)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS changeVersion (
+        id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL,
+        updatedAt TIMESTAMP
+    )
+    """,
+    "INSERT OR IGNORE INTO changeVersion (id, version, updatedAt) VALUES (1, 1, datetime('now'))",
+)
+
+# Columns added after a table was first shipped, as (table, column, definition, follow-up statement or None)
+MIGRATIONS = (
+    ('hourSummary', 'version', 'INTEGER NOT NULL DEFAULT 1', "CREATE INDEX IF NOT EXISTS idx_hour_version ON hourSummary (version)"),
+    ('hourSummarySolar', 'version', 'INTEGER NOT NULL DEFAULT 1', "CREATE INDEX IF NOT EXISTS idx_hour_solar_version ON hourSummarySolar (version)"),
+    ('dailySummary', 'version', 'INTEGER NOT NULL DEFAULT 1', "CREATE INDEX IF NOT EXISTS idx_daily_version ON dailySummary (version)"),
+    ('changeVersion', 'updatedAt', 'TIMESTAMP', "UPDATE changeVersion SET updatedAt = datetime('now')"),
+)
+
+# Stored as ISO text, which sorts and compares like the values themselves
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()[:10]))
+
+_PLACEHOLDER = re.compile(r'%([s%])')
+_schema_lock = threading.Lock()
+_schema_ready = set()
+
+
+@lru_cache(maxsize=512)
+def _translate(sql):
+    """Rewrite pymysql-style placeholders: %s -> ?, %% -> %."""
+    return _PLACEHOLDER.sub(lambda match: '?' if match.group(1) == 's' else '%', sql)
+
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class Cursor:
+    """DictCursor look-alike over a sqlite3 cursor."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+        return False
+
+    def execute(self, sql, params=None):
+        return self._cursor.execute(_translate(sql), tuple(params) if params is not None else ())
+
+    def executemany(self, sql, rows):
+        return self._cursor.executemany(_translate(sql), rows)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+
+class Connection:
+    def __init__(self, connection):
+        self._connection = connection
+
+    def cursor(self):
+        return Cursor(self._connection.cursor())
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def close(self):
+        self._connection.close()
+
+
+def ensure_schema(path):
+    """Create the database file and its tables once per process, and switch it to WAL mode."""
+    if path in _schema_ready:
+        return
+    with _schema_lock:
+        if path in _schema_ready:
+            return
+        connection = sqlite3.connect(path, timeout=30)
+        try:
+            # WAL is a property of the file, so it only has to be set once
+            connection.execute("PRAGMA journal_mode=WAL")
+            for table, column, definition, follow_up in MIGRATIONS:
+                columns = [row[1] for row in connection.execute(f"PRAGMA table_info({table})")]
+                if columns and column not in columns:
+                    connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                    if follow_up:
+                        connection.execute(follow_up)
+            for statement in SCHEMA:
+                connection.execute(statement)
+            connection.commit()
+        finally:
+            connection.close()
+        _schema_ready.add(path)
+
+
+def connect(config):
+    """Open a connection to the SQLite file at config['sqlite_path'], creating it if needed."""
+    path = config['sqlite_path']
+    ensure_schema(path)
+    connection = sqlite3.connect(path, timeout=config['sqlite_busy_timeout'], detect_types=sqlite3.PARSE_DECLTYPES)
+    connection.row_factory = _dict_row
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute(f"PRAGMA cache_size=-{int(config['sqlite_cache_mb']) * 1024}")
+    connection.execute("PRAGMA temp_store=MEMORY")
+    return Connection(connection)
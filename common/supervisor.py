@@ -0,0 +1,318 @@
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import random
+import select
+import struct
+import threading
+import time
+import serial
+from config import get_capture_config
+from common.metrics import gauge, counter
+
+# Serial device supervision: health state machine, reconnect backoff and
+# hot-plug detection shared by the thread and event-loop capture paths.
+#
+# Each polled meter has a DeviceHealth moving between
+#
+#     starting -> connected <-> degraded
+#                     \            /
+#                      disconnected  (port missing or failed; retried forever)
+#
+# Reconnects use full-jitter exponential backoff, but a wait is cut short as
+# soon as inotify reports the device node being created or its permissions
+# changing (udev applies those after creating the node), so a replugged
+# adapter is reopened within milliseconds rather than at the next retry.
+
+STARTING = 'starting'
+CONNECTED = 'connected'
+DEGRADED = 'degraded'
+DISCONNECTED = 'disconnected'
+
+DEVICE_UP = gauge('powermon_device_up', 'Meter connected and answering (1) or not (0)', ('device',))
+DEVICE_RECONNECTS = counter('powermon_device_reconnects_total', 'Successful serial reconnects', ('device',))
+
+_devices = {}
+_devices_lock = threading.Lock()
+_remote_devices = []
+
+
+class DeviceHealth:
+    """Health of one polled meter; updated by its capture loop, read by the API."""
+
+    def __init__(self, name, port, slave_address=None):
+        config = get_capture_config()
+        self.name = name
+        self.port = port
+        self.slave_address = slave_address
+        self.degraded_after = config['degraded_after']
+        self.state = STARTING
+        self.since = time.time()
+        self.consecutive_failures = 0
+        self.last_success = None
+        self.last_error = None
+        self.reconnects = 0
+        self.next_retry = None
+        self._ever_connected = False
+        DEVICE_UP.set(0, device=name)
+
+    def _transition(self, state):
+        if state == self.state:
+            return
+        level = logging.INFO if state == CONNECTED else logging.WARNING
+        logging.log(level, f"Device {self.name} ({self.port}) {self.state} -> {state}"
+                           + (f": {self.last_error}" if state != CONNECTED and self.last_error else ""))
+        self.state = state
+        self.since = time.time()
+        DEVICE_UP.set(1 if state == CONNECTED else 0, device=self.name)
+
+    def mark_connected(self):
+        """Port opened."""
+        if self._ever_connected:
+            self.reconnects += 1
+            DEVICE_RECONNECTS.inc(device=self.name)
+        self._ever_connected = True
+        self.next_retry = None
+        self.consecutive_failures = 0
+        self._transition(CONNECTED)
+
+    def mark_ok(self):
+        """A poll returned data."""
+        self.consecutive_failures = 0
+        self.last_success = time.time()
+        self._transition(CONNECTED)
+
+    def mark_failure(self, error=None):
+        """A poll failed while the port stayed open (timeout, CRC, no slave)."""
+        self.consecutive_failures += 1
+        if error:
+            self.last_error = str(error)
+        if self.consecutive_failures >= self.degraded_after:
+            self._transition(DEGRADED)
+
+    def mark_disconnected(self, error, retry_in=None):
+        """The port is gone or could not be opened."""
+        self.last_error = str(error)
+        self.next_retry = time.time() + retry_in if retry_in is not None else None
+        self._transition(DISCONNECTED)
+
+    def snapshot(self):
+        return {
+            'device': self.name,
+            'port': self.port,
+            'slave_address': self.slave_address,
+            'state': self.state,
+            'since': self.since,
+            'consecutive_failures': self.consecutive_failures,
+            'last_success': self.last_success,
+            'last_error': self.last_error,
+            'reconnects': self.reconnects,
+            'next_retry': self.next_retry,
+        }
+
+
+def register_device(name, port, slave_address=None):
+    """Create (or replace, on restart) the health record for a device."""
+    health = DeviceHealth(name, port, slave_address)
+    with _devices_lock:
+        _devices[name] = health
+    return health
+
+
+def device_health():
+    """
+    Snapshots of this process's devices; an API worker owns none and reports
+    the ingest process's last broadcast instead (common/livebus.py).
+    """
+    with _devices_lock:
+        devices = list(_devices.values())
+    if not devices:
+        return list(_remote_devices)
+    return [device.snapshot() for device in devices]
+
+
+def devices_answered(names):
+    """True once every named meter of this process has answered a poll."""
+    with _devices_lock:
+        return all(name in _devices and _devices[name].last_success is not None for name in names)
+
+
+def set_remote_health(devices):
+    global _remote_devices
+    _remote_devices = devices
+
+
+class Backoff:
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**attempt))."""
+
+    def __init__(self, base=None, cap=None):
+        config = get_capture_config()
+        self.base = base if base is not None else config['reconnect_base']
+        self.cap = cap if cap is not None else config['reconnect_cap']
+        self.attempt = 0
+
+    def next(self):
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** self.attempt))
+        self.attempt = min(self.attempt + 1, 32)
+        return delay
+
+    def reset(self):
+        self.attempt = 0
+
+
+# inotify via libc; None where unavailable (non-Linux), in which case waits
+# fall back to checking for the device node every HOTPLUG_POLL seconds
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct('iIII')
+HOTPLUG_POLL = 0.1
+
+_libc = None
+try:
+    _libc_name = ctypes.util.find_library('c')
+    if _libc_name:
+        _libc = ctypes.CDLL(_libc_name, use_errno=True)
+        _libc.inotify_init1.argtypes = [ctypes.c_int]
+        _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+except (OSError, AttributeError):
+    _libc = None
+
+
+def _open_watch(path):
+    """inotify fd watching path's directory for the node appearing, or None."""
+    if _libc is None:
+        return None
+    directory = os.path.dirname(os.path.abspath(path)) or '/'
+    if not os.path.isdir(directory):
+        return None
+    fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        return None
+    if _libc.inotify_add_watch(fd, directory.encode(), IN_CREATE | IN_MOVED_TO | IN_ATTRIB) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _matches(fd, name):
+    """Drain pending inotify events; True if any concerns `name`."""
+    found = False
+    while True:
+        try:
+            data = os.read(fd, 4096)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return found
+            raise
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            if data[offset:offset + length].rstrip(b'\0').decode(errors='replace') == name:
+                found = True
+            offset += length
+
+
+def wait_for_device(path, timeout, stop_event=None):
+    """
+    Block up to timeout seconds, returning early (True) when the device node
+    at path is created or changes permissions. For capture threads.
+    """
+    name = os.path.basename(path)
+    deadline = time.monotonic() + timeout
+    fd = _open_watch(path)
+    try:
+        while not (stop_event and stop_event.is_set()):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if fd is None:
+                existed = os.path.exists(path)
+                time.sleep(min(HOTPLUG_POLL, remaining))
+                if not existed and os.path.exists(path):
+                    return True
+                continue
+            readable, _, _ = select.select([fd], [], [], min(remaining, 1.0))
+            if readable and _matches(fd, name):
+                return True
+        return False
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
+async def wait_for_device_async(path, timeout):
+    """Event-loop version of wait_for_device."""
+    name = os.path.basename(path)
+    fd = _open_watch(path)
+    loop = asyncio.get_running_loop()
+    if fd is None:
+        deadline = loop.time() + timeout
+        existed = os.path.exists(path)
+        while loop.time() < deadline:
+            await asyncio.sleep(min(HOTPLUG_POLL, deadline - loop.time()))
+            if not existed and os.path.exists(path):
+                return True
+        return False
+    appeared = loop.create_future()
+
+    def on_event():
+        if _matches(fd, name) and not appeared.done():
+            appeared.set_result(True)
+
+    loop.add_reader(fd, on_event)
+    try:
+        return await asyncio.wait_for(appeared, timeout)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        loop.remove_reader(fd)
+        os.close(fd)
+
+
+def run_supervised(health, open_port, session, stop_event=None):
+    """
+    Thread-side supervisor: open the port with open_port(), run session(ser)
+    until it raises a serial error, then close and reopen with backoff, for as
+    long as stop_event is unset. The backoff restarts once a session has
+    recorded a good read (health.mark_ok), so a port that opens but fails
+    straight away keeps backing off instead of spinning.
+    """
+    backoff = Backoff()
+    while not (stop_event and stop_event.is_set()):
+        try:
+            ser = open_port()
+        except (serial.SerialException, OSError) as e:
+            delay = backoff.next()
+            health.mark_disconnected(e, delay)
+            wait_for_device(health.port, delay, stop_event)
+            continue
+        health.mark_connected()
+        logging.info(f"Connected to serial port: {health.port}")
+        started = time.time()
+        failure = None
+        try:
+            session(ser)
+        except (serial.SerialException, OSError) as e:
+            failure = e
+        finally:
+            # Close before any backoff wait: while the failed fd is open the
+            # kernel keeps its ttyUSB minor, so a replugged adapter would come
+            # back under another name and the watched path never reappear
+            try:
+                ser.close()
+            except (serial.SerialException, OSError):
+                pass
+            logging.info("Serial port closed.")
+        if failure is not None:
+            if health.last_success and health.last_success >= started:
+                backoff.reset()
+            delay = backoff.next()
+            health.mark_disconnected(failure, delay)
+            wait_for_device(health.port, delay, stop_event)
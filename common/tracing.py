@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+from config import get_tracing_config
+from common.metrics import histogram
+
+# Per-stage timing of the capture/storage hot path.
+#
+# A trace covers one unit of work (one sample, one DB flush) on one thread:
+#
+#     with trace_sample('ac'):
+#         with stage('serial_read'):
+#             ...
+#
+# Stages record into the current thread's trace and the stage histogram. When
+# tracing is disabled, trace_sample() and stage() return a shared no-op context
+# manager after a single global check, so instrumentation can stay in place.
+# Traces slower than the latency budget are logged with their breakdown.
+
+STAGE_SECONDS = histogram(
+    'powermon_stage_seconds', 'Hot-path stage duration (tracing enabled only)', ('trace', 'stage'),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5)
+)
+
+_config = get_tracing_config()
+_enabled = _config['enabled']
+_budget = _config['budget_ms'] / 1000
+_local = threading.local()
+
+
+class _Noop:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NOOP = _Noop()
+
+
+class _Stage:
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.trace.stages.append((self.name, elapsed))
+        STAGE_SECONDS.observe(elapsed, trace=self.trace.name, stage=self.name)
+        return False
+
+
+class _Trace:
+    __slots__ = ('name', 'start', 'stages')
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = []
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        _local.trace = self
+        return self
+
+    def __exit__(self, *exc):
+        _local.trace = None
+        total = time.perf_counter() - self.start
+        if total > _budget:
+            breakdown = ', '.join(f"{name}={elapsed * 1000:.2f}ms" for name, elapsed in self.stages)
+            logging.warning("Slow %s sample: %.2fms over %.0fms budget (%s)",
+                            self.name, total * 1000, _budget * 1000, breakdown,
+                            extra={'sampled': True})
+        return False
+
+
+def trace_sample(name):
+    """Context manager tracing one unit of work on the current thread."""
+    if not _enabled:
+        return NOOP
+    return _Trace(name)
+
+
+def stage(name):
+    """Context manager timing one stage of the current thread's trace."""
+    if not _enabled:
+        return NOOP
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return NOOP
+    return _Stage(trace, name)
+
+
+def set_tracing(enabled, budget_ms=None):
+    global _enabled, _budget
+    if budget_ms is not None:
+        _budget = budget_ms / 1000
+    _enabled = enabled
+
+
+def tracing_status():
+    return {'enabled': _enabled, 'budget_ms': _budget * 1000}
@@ -1,2 +1,32 @@
 # Shared utilities
-# ...existing code...
+import time
+from queue import Empty, Full
+
+
+def pause(stop_event, seconds):
+    """Sleep between batches, waking early when stop_event is set."""
+    if stop_event is None:
+        time.sleep(seconds)
+    else:
+        stop_event.wait(seconds)
+
+
+def drain(queue):
+    """Everything currently in a queue, oldest first."""
+    items = []
+    try:
+        while True:
+            items.append(queue.get_nowait())
+    except Empty:
+        return items
+
+
+def offer_live(live_queue, item):
+    """Hand a sample to a live forwarder; the live path is lossy, storage has its own queue."""
+    if live_queue is None:
+        return
+    try:
+        live_queue.put_nowait(item)
+    except Full:
+        pass
+
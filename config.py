@@ -14,7 +14,12 @@ def get_ac_config():
         'db_user': os.getenv('AC_DB_USER', 'python'),
         'db_password': os.getenv('AC_DB_PASSWORD', 'pymysql'),
         'db_name': os.getenv('AC_DB_NAME', 'PowerMon'),
-        'slave_address': int(os.getenv('AC_SLAVE_ADDRESS', '1'), 16)
+        'slave_address': int(os.getenv('AC_SLAVE_ADDRESS', '1'), 16),
+        'device_id': int(os.getenv('AC_DEVICE_ID', '1')),
+        # Burst mode: poll as fast as the bus allows and reduce to 1 s windows
+        'burst_mode': os.getenv('AC_BURST_MODE', '0') == '1',
+        'burst_peak_ratio': float(os.getenv('AC_BURST_PEAK_RATIO', 1.5)),
+        'burst_peak_min_power': float(os.getenv('AC_BURST_PEAK_MIN_POWER', 100))
     }
 
 # Solar system configuration
@@ -27,15 +32,119 @@ def get_solar_config():
         'db_user': os.getenv('SOLAR_DB_USER', 'python'),
         'db_password': os.getenv('SOLAR_DB_PASSWORD', 'pymysql'),
         'db_name': os.getenv('SOLAR_DB_NAME', 'PowerMon'),
-        'slave_address': int(os.getenv('SOLAR_SLAVE_ADDRESS', '2'), 16)
+        'slave_address': int(os.getenv('SOLAR_SLAVE_ADDRESS', '2'), 16),
+        'device_id': int(os.getenv('SOLAR_DEVICE_ID', '2'))
     }
     
+# Storage engine: 'mysql' (DB_* server settings) or 'sqlite' (embedded WAL-mode
+# file at SQLITE_PATH for single-node edge sites, see common/sqlite_store.py)
 def get_database_config():
     return {
+        'backend': os.getenv('DB_BACKEND', 'mysql').lower(),
         'db_host': os.getenv('DB_HOST', 'localhost'),
         'db_user': os.getenv('DB_USER', 'python'),
         'db_password': os.getenv('DB_PASSWORD', 'pymysql'),
-        'db_name': os.getenv('DB_NAME', 'PowerMon')
+        'db_name': os.getenv('DB_NAME', 'PowerMon'),
+        'sqlite_path': os.getenv('SQLITE_PATH', 'powermon.db'),
+        'sqlite_cache_mb': int(os.getenv('SQLITE_CACHE_MB', 16)),
+        'sqlite_busy_timeout': float(os.getenv('SQLITE_BUSY_TIMEOUT', 30)),
+        # MySQL read replicas ('host[:port]', comma separated) for read-only queries,
+        # used while their measured lag stays within replica_max_lag seconds
+        'read_hosts': os.getenv('DB_READ_HOSTS', ''),
+        'read_user': os.getenv('DB_READ_USER') or os.getenv('DB_USER', 'python'),
+        'read_password': os.getenv('DB_READ_PASSWORD') or os.getenv('DB_PASSWORD', 'pymysql'),
+        'replica_max_lag': float(os.getenv('DB_REPLICA_MAX_LAG', 10)),
+        'replica_check_interval': float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 2))
+    }
+
+# Raw sample storage: 'float' (energy*_raw tables) or 'compact' (integer register tables)
+def get_storage_config():
+    return {
+        'schema': os.getenv('STORAGE_SCHEMA', 'float').lower()
+    }
+
+# Ingestion compression: mode is 'off', 'deadband' or 'swinging_door'.
+# Deviations are per metric, absolute ('voltage=0.5') or relative ('power=2%').
+def get_compression_config():
+    return {
+        'mode': os.getenv('COMPRESSION_MODE', 'off').lower(),
+        'ac_deviations': os.getenv('AC_COMPRESSION_DEVIATIONS', 'voltage=0.5,current=0.02,power=2%,frequency=0.05,power_factor=0.01'),
+        'solar_deviations': os.getenv('SOLAR_COMPRESSION_DEVIATIONS', 'voltage=0.1,current=0.02,power=2%'),
+        'energy_step': float(os.getenv('COMPRESSION_ENERGY_STEP', 10)),
+        'max_gap': int(os.getenv('COMPRESSION_MAX_GAP', 300))
+    }
+
+# Hot-path tracing: per-stage timings and a slow-sample log above the budget
+def get_tracing_config():
+    return {
+        'enabled': os.getenv('TRACE_ENABLED', '0') == '1',
+        'budget_ms': float(os.getenv('TRACE_BUDGET_MS', 250))
+    }
+
+# Capture transport: 'async' polls every port from the event loop (common/modbus_async.py),
+# 'thread' runs one blocking serial thread per port. Burst mode always uses a thread.
+def get_capture_config():
+    return {
+        'mode': os.getenv('CAPTURE_MODE', 'async').lower(),
+        'poll_interval': float(os.getenv('CAPTURE_POLL_INTERVAL', 1)),
+        # Reconnect backoff (seconds) and failed polls before a device counts as degraded
+        'reconnect_base': float(os.getenv('RECONNECT_BASE', 0.05)),
+        'reconnect_cap': float(os.getenv('RECONNECT_CAP', 30)),
+        'degraded_after': int(os.getenv('DEGRADED_AFTER', 3))
+    }
+
+# Fleet: DEVICES_FILE lists every meter (see common/devices.py); without it the
+# instance has the AC_* and SOLAR_* meters on site SITE_ID
+def get_fleet_config():
+    return {
+        'devices_file': os.getenv('DEVICES_FILE', ''),
+        'site_id': int(os.getenv('SITE_ID', '1')),
+        # Devices aggregated concurrently by the summary jobs
+        'summary_workers': int(os.getenv('SUMMARY_WORKERS', 4))
+    }
+
+# Process role: 'all' captures, stores and serves HTTP in one process; for
+# several HTTP workers run one 'ingest' process (serial capture, DB writes,
+# scheduler) and any number of 'api' processes fed over the live socket
+def get_deployment_config():
+    return {
+        'role': os.getenv('ROLE', 'all').lower(),
+        'live_socket': os.getenv('LIVE_SOCKET', '/tmp/powermon-live.sock'),
+        # Seconds between device health broadcasts to API workers
+        'health_interval': float(os.getenv('LIVE_HEALTH_INTERVAL', 5)),
+        # Seconds shutdown may spend stopping capture and storing queued samples
+        'drain_timeout': float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', 20))
+    }
+
+# Load analytics kept by the summary jobs: demand is averaged over
+# DEMAND_INTERVAL-minute intervals (a divisor of 60) and daily solar yields are
+# counted in SOLAR_YIELD_BIN_WH-wide histogram bins (clear solarYieldHistogram
+# and its analyticsProgress rows after changing it)
+def get_analytics_config():
+    return {
+        'demand_interval': int(os.getenv('DEMAND_INTERVAL', 15)),
+        'yield_bin': float(os.getenv('SOLAR_YIELD_BIN_WH', 100))
+    }
+
+# Billing: TARIFFS_FILE lists the time-of-use tariffs (see features/billing/tariffs.py);
+# without it there is one flat tariff priced by TARIFF_FLAT_RATE / TARIFF_EXPORT_RATE
+def get_billing_config():
+    return {
+        'tariffs_file': os.getenv('TARIFFS_FILE', ''),
+        'currency': os.getenv('TARIFF_CURRENCY', 'EUR'),
+        'flat_rate': float(os.getenv('TARIFF_FLAT_RATE', 0.25)),
+        'export_rate': float(os.getenv('TARIFF_EXPORT_RATE', 0.08)),
+        'standing_charge': float(os.getenv('TARIFF_STANDING_CHARGE', 0)),
+        # (tariff, scope, month) results kept in memory
+        'cache_size': int(os.getenv('BILLING_CACHE_SIZE', 4096))
+    }
+
+# Alerts: threshold rules evaluated on every live sample by the capture
+# process; ALERT_RULES_FILE replaces the built-in rules (see common/alerts.py)
+def get_alert_config():
+    return {
+        'enabled': os.getenv('ALERTS_ENABLED', '1') == '1',
+        'rules_file': os.getenv('ALERT_RULES_FILE', '')
     }
 
 # Precision for both systems
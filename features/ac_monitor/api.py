@@ -1,56 +1,140 @@
-from fastapi import APIRouter, BackgroundTasks, Request
+from fastapi import APIRouter, BackgroundTasks, Request, Query, HTTPException
 from fastapi.responses import StreamingResponse
 from queue import Queue
+import logging
 import threading
 import asyncio
 import json
-from .models import ACMeasurement, ACMeasurementBatch
-from .service import capture_ac_data, transfer_ac_to_database
+from functools import partial
+from datetime import datetime, timedelta
+from typing import Optional
+from .models import ACMeasurement, ACMeasurementBatch, BurstWindow, PowerPeakEvent
+from .service import (
+    capture_ac_data,
+    capture_ac_async,
+    transfer_ac_to_database,
+    capture_ac_burst,
+    transfer_ac_burst_to_database,
+    get_burst_windows,
+    get_peak_events
+)
+from config import get_capture_config
+from common.devices import get_devices, get_device, default_device
+from common.metrics import CAPTURE_QUEUE_DEPTH, SSE_CLIENTS, SSE_DROPPED
+from common.livebus import register_stream, publish as live_publish
+from common.supervisor import devices_answered
+from common import pipeline
+from common import alerts, overview
+from common.responses import json_response
 
 router = APIRouter(prefix="/ac", tags=["AC Monitor"])
 
-source_ac_data_queue = Queue(maxsize=1000)  # Renamed from data_queue
-ac_client_sse_queues = []  # New global list for client SSE queues
-stop_event = threading.Event()
-threads_started = False
-
-@router.on_event("startup")
-def start_ac_background_threads():
-    global threads_started
-    if not threads_started:
-        capture_thread = threading.Thread(target=capture_ac_data, args=(source_ac_data_queue, stop_event), daemon=True)
-        db_thread = threading.Thread(target=transfer_ac_to_database, args=(source_ac_data_queue, stop_event), daemon=True)
+# Per consumption device (common/devices.py): capture queue, SSE client queues and last sample
+ac_data_queues = {device['device_id']: Queue(maxsize=1000) for device in get_devices('consumption')}
+ac_live_queues = {device_id: Queue(maxsize=100) for device_id in ac_data_queues}  # thread capture -> forwarder
+ac_client_sse_queues = {device_id: [] for device_id in ac_data_queues}
+latest_ac_samples = {}  # Served by /latest
+burst_window_queue = Queue(maxsize=3600)  # Burst mode window records awaiting storage, all devices
+CAPTURE_QUEUE_DEPTH.set_function(lambda: sum(q.qsize() for q in ac_data_queues.values()), stream='ac')
+# Capture stops before the writers, which then store what is still queued (common/pipeline.py)
+capture_stop_event = threading.Event()
+writer_stop_event = threading.Event()
+capture_threads = []
+capture_tasks = []
+writer_threads = []
+
+def start_ac_writers():
+    burst = False
+    for device in get_devices('consumption'):
+        data_queue = ac_data_queues[device['device_id']]
+        writer_threads.append(threading.Thread(target=transfer_ac_to_database, args=(data_queue, writer_stop_event, device), daemon=True))
+        burst = burst or device['burst_mode']
+    if burst:
+        writer_threads.append(threading.Thread(target=transfer_ac_burst_to_database, args=(burst_window_queue, writer_stop_event), daemon=True))
+    for thread in writer_threads:
+        thread.start()
+
+def stop_ac_writers(timeout):
+    writer_stop_event.set()
+    return pipeline.join_threads(writer_threads, timeout)
+
+def start_ac_capture():
+    for device in get_devices('consumption'):
+        device_id = device['device_id']
+        data_queue = ac_data_queues[device_id]
+        publish = partial(publish_ac_sample, device_id)
+        if device['burst_mode']:
+            capture_thread = threading.Thread(target=capture_ac_burst, args=(data_queue, burst_window_queue, capture_stop_event, device, ac_live_queues[device_id]), daemon=True)
+        elif get_capture_config()['mode'] == 'async':
+            # Polled from the event loop; samples reach SSE clients directly via publish_ac_sample
+            capture_tasks.append(asyncio.create_task(capture_ac_async(data_queue, publish, capture_stop_event, device)))
+            continue
+        else:
+            capture_thread = threading.Thread(target=capture_ac_data, args=(data_queue, capture_stop_event, device, ac_live_queues[device_id]), daemon=True)
         capture_thread.start()
-        db_thread.start()
-        # Start the new ac_data_forwarder task
-        asyncio.create_task(ac_data_forwarder())
-        threads_started = True
+        capture_threads.append(capture_thread)
+        capture_tasks.append(asyncio.create_task(ac_data_forwarder(ac_live_queues[device_id], publish)))
+
+async def stop_ac_capture(timeout):
+    capture_stop_event.set()
+    for task in capture_tasks:
+        task.cancel()
+    await asyncio.gather(*capture_tasks, return_exceptions=True)
+    # Capture threads finish their current poll and close their ports
+    return await asyncio.to_thread(pipeline.join_threads, capture_threads, timeout)
+
+pipeline.register('ac-writers', pipeline.WRITERS, start_ac_writers, stop_ac_writers)
+pipeline.register('ac-capture', pipeline.CAPTURE, start_ac_capture, stop_ac_capture,
+                  ready=lambda: devices_answered(device['name'] for device in get_devices('consumption')))
+
+def _device_id(device_id):
+    """Resolve an optional device_id query parameter to a consumption device id, or 404."""
+    device = get_device(device_id, 'consumption') if device_id is not None else default_device('consumption')
+    if device is None:
+        raise HTTPException(status_code=404, detail=f"No consumption device {device_id}")
+    return device['device_id']
+
+def publish_ac_sample(device_id, data_item):
+    """
+    Put one sample of a device into each of its client SSE queues and, in an
+    ingest process, send it to the API workers. Must run on the event loop.
+    """
+    latest_ac_samples[device_id] = data_item
+    overview.observe(device_id, data_item[0], data_item[3], data_item[4])
+    alerts.evaluate('consumption', device_id, data_item)
+    live_publish('ac', [device_id, data_item], key=device_id)
+    # Iterate over a copy of the list to avoid issues if it's modified during iteration
+    for client_q in list(ac_client_sse_queues.get(device_id, ())):
+        try:
+            client_q.put_nowait(data_item)
+        except asyncio.QueueFull:
+            SSE_DROPPED.inc(stream='ac')
+            logging.warning("AC live client queue full, sample dropped for that client", extra={'sampled': True})
+        except Exception as e:
+            logging.error("Error putting data to an AC live client queue: %s", e, extra={'sampled': True})
+
+register_stream('ac', lambda item: publish_ac_sample(item[0], tuple(item[1])))
 
-async def ac_data_forwarder():
+async def ac_data_forwarder(live_queue, publish):
     """
-    Continuously gets data from source_ac_data_queue and puts it into all client_sse_queues.
+    Continuously gets data from a device's live queue and publishes it to its SSE clients.
+    Only used with thread capture; async capture publishes directly.
     """
     while True:
         try:
-            data_item = source_ac_data_queue.get_nowait()  # Non-blocking get
-            # Iterate over a copy of the list to avoid issues if it's modified during iteration
-            for client_q in list(ac_client_sse_queues):
-                try:
-                    await client_q.put(data_item)
-                except asyncio.QueueFull:
-                    # Handle if a specific client queue is full (optional, default asyncio.Queue is unbounded)
-                    print(f"Client queue {client_q} is full. Data item for this client lost.")
-                except Exception as e:
-                    # Other exceptions related to putting data into a client's queue
-                    print(f"Error putting data to client queue {client_q}: {e}")
+            data_item = live_queue.get_nowait()  # Non-blocking get
         except Exception as e: # Should be queue.Empty, but catching broader for safety
             # Queue is empty, wait a bit before trying again to avoid busy-waiting
             await asyncio.sleep(0.05)
+            continue
+        publish(data_item)
 
 
-async def ac_event_generator(request: Request): # Added request parameter
+async def ac_event_generator(request: Request, device_id): # Added request parameter
     client_queue = asyncio.Queue(maxsize=100) # Each client gets its own asyncio Queue
-    ac_client_sse_queues.append(client_queue)
+    client_queues = ac_client_sse_queues.setdefault(device_id, [])
+    client_queues.append(client_queue)
+    SSE_CLIENTS.inc(stream='ac')
     last_sent = None
     try:
         while True:
@@ -76,20 +160,24 @@ async def ac_event_generator(request: Request): # Added request parameter
                 # This exception is raised when the client disconnects.
                 break
             except Exception as e:
-                print(f"Error in AC event generator for a client: {e}")
+                logging.error(f"Error in AC event generator for a client: {e}")
                 # Depending on the error, you might want to break or continue
                 await asyncio.sleep(1) # Avoid tight loop on persistent error
     finally:
         # Ensure the client's queue is removed from the global list
-        if client_queue in ac_client_sse_queues:
-            ac_client_sse_queues.remove(client_queue)
-        print(f"Client {request.client} disconnected, queue removed. Remaining queues: {len(ac_client_sse_queues)}")
+        if client_queue in client_queues:
+            client_queues.remove(client_queue)
+        SSE_CLIENTS.dec(stream='ac')
+        logging.info(f"Client {request.client} disconnected, queue removed. Remaining queues: {len(client_queues)}")
 
 
 @router.get("/latest/live")
-async def live_ac_measurements(request: Request):
+async def live_ac_measurements(
+    request: Request,
+    device_id: Optional[int] = Query(None, description="Consumption device. Defaults to the AC meter.")
+):
     return StreamingResponse(
-        ac_event_generator(request), # Pass the request to the generator
+        ac_event_generator(request, _device_id(device_id)), # Pass the request to the generator
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -99,11 +187,13 @@ async def live_ac_measurements(request: Request):
     )
 
 @router.get("/latest", response_model=ACMeasurement)
-def get_latest_ac_measurement():
+def get_latest_ac_measurement(
+    device_id: Optional[int] = Query(None, description="Consumption device. Defaults to the AC meter.")
+):
+    device_id = _device_id(device_id)
     try:
-        # Get data from the source_ac_data_queue
-        data = source_ac_data_queue.get_nowait()
-        timestamp, voltage, current, power, energy, frequency, power_factor = data
+        # Read the last published sample; taking it from the capture queue would steal it from the DB writer
+        timestamp, voltage, current, power, energy, frequency, power_factor = latest_ac_samples[device_id]
         return ACMeasurement(
             voltage=voltage,
             current=current,
@@ -113,4 +203,38 @@ def get_latest_ac_measurement():
             power_factor=power_factor
         )
     except Exception:
-        return {"detail": "No data available"}
\ No newline at end of file
+        return {"detail": "No data available"}
+
+def _default_range(start, end):
+    end = end or datetime.now()
+    start = start or end - timedelta(hours=1)
+    return start, end
+
+@router.get("/burst", response_model=list[BurstWindow])
+def burst_windows(
+    request: Request,
+    start: Optional[datetime] = Query(None, description="Range start. Defaults to one hour before end."),
+    end: Optional[datetime] = Query(None, description="Range end. Defaults to now."),
+    limit: int = Query(3600, ge=1, le=86400),
+    device_id: Optional[int] = Query(None, description="Consumption device. Defaults to the AC meter.")
+):
+    """
+    Per-second min/max/mean/last windows recorded in burst mode.
+    """
+    start, end = _default_range(start, end)
+    return json_response(request, get_burst_windows(_device_id(device_id), start, end, limit))
+
+@router.get("/peaks", response_model=list[PowerPeakEvent])
+def peak_events(
+    request: Request,
+    start: Optional[datetime] = Query(None, description="Range start. Defaults to one hour before end."),
+    end: Optional[datetime] = Query(None, description="Range end. Defaults to now."),
+    min_power: float = Query(0, ge=0, description="Only events with at least this peak power (W)."),
+    limit: int = Query(1000, ge=1, le=10000),
+    device_id: Optional[int] = Query(None, description="Consumption device. Defaults to the AC meter.")
+):
+    """
+    Transient peak-power events (e.g. motor inrush) detected in burst windows.
+    """
+    start, end = _default_range(start, end)
+    return json_response(request, get_peak_events(_device_id(device_id), start, end, min_power, limit))
@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from datetime import datetime
 
 class ACMeasurement(BaseModel):
     voltage: float
@@ -11,3 +12,36 @@ class ACMeasurement(BaseModel):
 class ACMeasurementBatch(BaseModel):
     measurements: list[ACMeasurement]
     timestamp: str  # ISO format or datetime, adjust as needed
+
+class BurstWindow(BaseModel):
+    timestamp: datetime
+    samples: int
+    voltage_min: float
+    voltage_max: float
+    voltage_mean: float
+    voltage_last: float
+    current_min: float
+    current_max: float
+    current_mean: float
+    current_last: float
+    power_min: float
+    power_max: float
+    power_mean: float
+    power_last: float
+    energy_last: float
+    frequency_min: float
+    frequency_max: float
+    frequency_mean: float
+    frequency_last: float
+    power_factor_min: float
+    power_factor_max: float
+    power_factor_mean: float
+    power_factor_last: float
+    peak_offset_ms: int
+
+class PowerPeakEvent(BaseModel):
+    timestamp: datetime
+    peakPower: float
+    meanPower: float
+    minVoltage: float
+    samples: int
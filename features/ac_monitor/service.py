@@ -1,106 +1,311 @@
 import logging
 import serial
-from datetime import datetime
-from queue import Queue, Empty
+from datetime import datetime, timedelta
+from queue import Queue, Empty, Full
 import threading
 import time
-import subprocess
 from .modbus import read_holding_registers, parse_pzem_data
-from common.database import db_connection, log_to_db_consumption
-from config import get_ac_config
+from common.database import (
+    db_connection,
+    read_connection,
+    log_to_db_consumption,
+    log_to_db_consumption_compact,
+    log_burst_windows,
+    log_peak_events
+)
+from common.burst import WindowReducer, is_peak_event, window_columns
+from common.snapshots import MidnightTracker
+from common.metrics import SAMPLES_CAPTURED, SAMPLES_DROPPED, LAST_SAMPLE_TIMESTAMP
+from common.tracing import trace_sample, stage
+from common.modbus import READ_HOLDING_REGISTERS
+from common.modbus_async import get_bus, poll
+from common.supervisor import register_device, run_supervised
+from common.compact import compact_storage_enabled, CONSUMPTION_COLUMNS
+from common.compression import create_compressor
+from common.utils import drain, offer_live, pause
+from config import get_ac_config, get_capture_config
+from common.devices import default_device
 
-# Helper function to close active serial connections
-def close_active_serial_connections(port):
-    """Attempt to close any active connections to the specified serial port."""
-    try:
-        result = subprocess.run(['lsof', port], capture_output=True, text=True)
-        if result.stdout:
-            lines = result.stdout.splitlines()
-            for line in lines[1:]:  # Skip header
-                pid = line.split()[1]  # Extract PID
-                logging.info(f"Terminating process {pid} using {port}")
-                subprocess.run(['kill', pid])  # Terminate process gracefully
-        else:
-            logging.info(f"No active processes found using {port}")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error checking/closing processes on {port}: {e}")
-    except Exception as e:
-        logging.error(f"Unexpected error while closing connections on {port}: {e}")
-
-# Background thread to capture AC data and put it in a queue
-def capture_ac_data(data_queue, stop_event=None, max_retries=3, retry_delay=2):
-    config = get_ac_config()
-    ser = None
-    retry_count = 0
-    
-    while not (stop_event and stop_event.is_set()) and retry_count <= max_retries:
-        try:
-            ser = serial.Serial(config['serial_port'], config['baud_rate'], timeout=config['serial_timeout'])
-            logging.info(f"Connected to serial port: {config['serial_port']}")
-            base_interval = 1
-            while not (stop_event and stop_event.is_set()):
-                try:
-                    registers = read_holding_registers(ser, 0x00, 10, config)
+# Background thread to capture AC data and put it in a queue. The port is
+# supervised: on a serial error it is closed and reopened with backoff forever.
+# config is one consumption device from common/devices.py (default: the AC meter).
+# Samples also go to live_queue, if given, for the forwarder that publishes them;
+# the storage queue has a single consumer, the DB writer.
+def capture_ac_data(data_queue, stop_event=None, config=None, live_queue=None):
+    config = config or default_device('consumption')
+    midnight = MidnightTracker('consumption', config['device_id'])
+    health = register_device(config['name'], config['serial_port'], config['slave_address'])
+    base_interval = 1
+
+    def session(ser):
+        while not (stop_event and stop_event.is_set()):
+            try:
+                with trace_sample('ac'):
+                    registers = read_holding_registers(ser, 0x00, 10, config, raise_serial_errors=True)
                     if registers:
-                        data = parse_pzem_data(registers, config)
+                        health.mark_ok()
+                        with stage('parse'):
+                            data = parse_pzem_data(registers, config)
                         if data:
                             timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                             data_with_timestamp = (timestamp, data['voltage'], data['current'], data['power'], data['energy'], data['frequency'], data['power_factor'])
-                            data_queue.put(data_with_timestamp)
-                            logging.info(f"Captured data (AC): {timestamp}, Voltage: {data['voltage']}, Current: {data['current']}, Power: {data['power']}, Energy: {data['energy']}, Frequency: {data['frequency']}, Power Factor: {data['power_factor']}")
+                            with stage('enqueue'):
+                                data_queue.put(data_with_timestamp)
+                                offer_live(live_queue, data_with_timestamp)
+                            midnight.observe(timestamp, data['energy'])
+                            SAMPLES_CAPTURED.inc(stream='ac')
+                            LAST_SAMPLE_TIMESTAMP.set(time.time(), stream='ac')
+                            logging.info("Captured data (AC): %s, Voltage: %s, Current: %s, Power: %s, Energy: %s, Frequency: %s, Power Factor: %s",
+                                         timestamp, data['voltage'], data['current'], data['power'], data['energy'], data['frequency'], data['power_factor'],
+                                         extra={'sampled': True})
                     else:
-                        logging.warning("No data received from PZEM device")
-                except Exception as e:
-                    logging.error(f"Error in data capture: {e}")
-                queue_size = data_queue.qsize()
-                sleep_time = max(base_interval - (queue_size / 1000), 0.1)
-                time.sleep(sleep_time)
-        
-        except (serial.SerialException, OSError) as e:
-            logging.error(f"Failed to open serial port {config['serial_port']}: {e}")
-            retry_count += 1
-            if retry_count > max_retries:
-                logging.error(f"Max retries ({max_retries}) reached. Giving up on {config['serial_port']}")
-                break
-            logging.info(f"Attempting to close active connections on {config['serial_port']} (Retry {retry_count}/{max_retries})")
-            if ser and ser.is_open:
-                ser.close()
-                logging.info("Closed existing serial connection.")
-            close_active_serial_connections(config['serial_port'])
-            logging.info(f"Retrying in {retry_delay} seconds...")
-            time.sleep(retry_delay)
-        
-        finally:
-            if ser and ser.is_open:
-                ser.close()
-                logging.info("Serial port closed.")
-    
-    if retry_count > max_retries:
-        logging.error("Exiting capture_ac_data due to repeated serial port failures.")
-
-# Background thread to transfer AC data from queue to database
-def transfer_ac_to_database(data_queue, stop_event=None):
+                        health.mark_failure("no valid reply")
+                        logging.warning("No data received from PZEM device", extra={'sampled': True})
+            except (serial.SerialException, OSError):
+                raise
+            except Exception as e:
+                logging.error("Error in data capture: %s", e, extra={'sampled': True})
+            queue_size = data_queue.qsize()
+            sleep_time = max(base_interval - (queue_size / 1000), 0.1)
+            time.sleep(sleep_time)
+
+    run_supervised(health, lambda: serial.Serial(config['serial_port'], config['baud_rate'], timeout=config['serial_timeout']),
+                   session, stop_event)
+
+# Event-loop capture: polls through the shared async bus and hands each sample
+# to the storage queue and to live subscribers (publish) without a thread hop
+async def capture_ac_async(data_queue, publish, stop_event=None, config=None):
+    config = config or default_device('consumption')
+    midnight = MidnightTracker('consumption', config['device_id'])
+    bus = get_bus(config['serial_port'], config['baud_rate'], config['serial_timeout'])
+    health = register_device(config['name'], config['serial_port'], config['slave_address'])
+
+    def handle(registers):
+        data = parse_pzem_data(registers, config)
+        if not data:
+            return
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        data_with_timestamp = (timestamp, data['voltage'], data['current'], data['power'], data['energy'], data['frequency'], data['power_factor'])
+        try:
+            data_queue.put_nowait(data_with_timestamp)
+        except Full:
+            SAMPLES_DROPPED.inc(stream='ac')
+            logging.warning("AC storage queue full, sample dropped", extra={'sampled': True})
+        publish(data_with_timestamp)
+        midnight.observe(timestamp, data['energy'])
+        SAMPLES_CAPTURED.inc(stream='ac')
+        LAST_SAMPLE_TIMESTAMP.set(time.time(), stream='ac')
+        logging.info("Captured data (AC): %s, Voltage: %s, Current: %s, Power: %s, Energy: %s, Frequency: %s, Power Factor: %s",
+                     timestamp, data['voltage'], data['current'], data['power'], data['energy'], data['frequency'], data['power_factor'],
+                     extra={'sampled': True})
+
+    await poll(bus, config['slave_address'], READ_HOLDING_REGISTERS, 0x00, 10,
+               get_capture_config()['poll_interval'], handle, stop_event, health)
+
+# Background thread for burst mode: poll back-to-back and reduce per second
+def capture_ac_burst(data_queue, burst_queue, stop_event=None, config=None, live_queue=None):
+    """
+    Poll the meter as fast as the bus answers and fold the readings of each
+    second into one window record (min/max/mean/last and sample count). The
+    window's last reading is queued on data_queue like a regular 1 Hz sample;
+    the full record, tagged with its device, goes to burst_queue, and the
+    sample to live_queue if given.
+    """
+    config = config or default_device('consumption')
+    reducer = WindowReducer(CONSUMPTION_COLUMNS)
+    midnight = MidnightTracker('consumption', config['device_id'])
+    health = register_device(config['name'], config['serial_port'], config['slave_address'])
+
+    def session(ser):
+        while not (stop_event and stop_event.is_set()):
+            try:
+                registers = read_holding_registers(ser, 0x00, 10, config, raise_serial_errors=True)
+                if not registers:
+                    health.mark_failure("no valid reply")
+                    continue
+                health.mark_ok()
+                data = parse_pzem_data(registers, config)
+                if data:
+                    record = reducer.add(time.time(), tuple(data[column] for column in CONSUMPTION_COLUMNS))
+                    if record:
+                        record['device'] = config['device_id']
+                        _emit_burst_window(record, data_queue, burst_queue, live_queue)
+                        midnight.observe(record['timestamp'], record['energy_last'])
+            except (serial.SerialException, OSError):
+                raise
+            except Exception as e:
+                logging.error("Error in burst capture: %s", e, extra={'sampled': True})
+
+    try:
+        run_supervised(health, lambda: serial.Serial(config['serial_port'], config['baud_rate'], timeout=config['serial_timeout']),
+                       session, stop_event)
+    finally:
+        record = reducer.flush()
+        if record:
+            record['device'] = config['device_id']
+            _emit_burst_window(record, data_queue, burst_queue, live_queue)
+
+def _emit_burst_window(record, data_queue, burst_queue, live_queue=None):
+    # Never block the polling loop: a full queue drops and counts the window
+    sample = (record['timestamp'], *(record[f'{column}_last'] for column in CONSUMPTION_COLUMNS))
+    try:
+        data_queue.put_nowait(sample)
+    except Full:
+        SAMPLES_DROPPED.inc(stream='ac')
+        logging.warning("AC storage queue full, sample dropped", extra={'sampled': True})
+    offer_live(live_queue, sample)
+    try:
+        burst_queue.put_nowait(record)
+    except Full:
+        SAMPLES_DROPPED.inc(stream='ac_burst')
+        logging.warning("Burst window queue full, window dropped", extra={'sampled': True})
+    SAMPLES_CAPTURED.inc(stream='ac')
+    LAST_SAMPLE_TIMESTAMP.set(time.time(), stream='ac')
+
+def _peak_event(record):
+    start = datetime.strptime(record['timestamp'], '%Y-%m-%d %H:%M:%S')
+    at = start + timedelta(milliseconds=record['peak_offset_ms'])
+    return (
+        at.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
+        record['power_max'], record['power_mean'], record['voltage_min'], record['samples']
+    )
+
+def _store_burst_windows(records, config):
+    """Store window records and their peak events; returns the records that were not written."""
+    by_device = {}
+    for record in records:
+        by_device.setdefault(record['device'], []).append(record)
+    if not by_device:
+        return []
+    unstored = []
+    with db_connection() as connection:
+        if not connection:
+            return records
+        for device_id, device_records in by_device.items():
+            events = [
+                _peak_event(record) for record in device_records
+                if is_peak_event(record, ratio=config['burst_peak_ratio'], minimum=config['burst_peak_min_power'])
+            ]
+            # Windows are insert-ignore, so retrying a device whose events failed stores no duplicate windows
+            if not log_burst_windows(connection, device_id, device_records) or (events and not log_peak_events(connection, device_id, events)):
+                unstored.extend(device_records)
+    return unstored
+
+# Background thread to store burst windows and the peak events found in them,
+# for every burst-mode device sharing burst_queue. Windows whose write fails
+# are retried first, with backoff; while they are pending fewer new windows
+# are taken, so a long outage fills burst_queue and capture counts the drops.
+def transfer_ac_burst_to_database(burst_queue, stop_event=None):
+    config = get_ac_config()
+    pending = []
+    delay = 5
+    while not (stop_event and stop_event.is_set()):
+        records = pending
+        try:
+            for _ in range(300 - len(records)):
+                records.append(burst_queue.get_nowait())
+        except Empty:
+            pass
+        pending = _store_burst_windows(records, config)
+        if pending:
+            delay = min(delay * 2, 60)
+            logging.warning("%d burst windows not stored, retrying in %ds", len(pending), delay, extra={'sampled': True})
+        else:
+            delay = 5
+        pause(stop_event, delay)
+    # Capture has stopped: store every window still queued
+    remaining = _store_burst_windows(pending + drain(burst_queue), config)
+    if remaining:
+        logging.error(f"{len(remaining)} burst windows were lost at shutdown")
+
+def get_burst_windows(device_id, start, end, limit=3600):
+    """BurstWindow-shaped rows for [start, end), oldest first."""
+    query = f"""
+        SELECT timestamp, {', '.join(window_columns(CONSUMPTION_COLUMNS))}
+        FROM energyConsumption_burst
+        WHERE device = %s AND timestamp >= %s AND timestamp < %s
+        ORDER BY timestamp
+        LIMIT %s
+    """
+    with read_connection() as connection:
+        if not connection:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(query, (device_id, start, end, limit))
+            return cursor.fetchall()
+
+def get_peak_events(device_id, start, end, min_power=0, limit=1000):
+    """PowerPeakEvent-shaped rows for [start, end), oldest first."""
+    query = """
+        SELECT timestamp, peakPower, meanPower, minVoltage, samples
+        FROM powerPeakEvents
+        WHERE device = %s AND timestamp >= %s AND timestamp < %s AND peakPower >= %s
+        ORDER BY timestamp
+        LIMIT %s
+    """
+    with read_connection() as connection:
+        if not connection:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(query, (device_id, start, end, min_power, limit))
+            return cursor.fetchall()
+
+def _log_ac_batch(connection, batch, config, compact):
+    if compact:
+        stored = log_to_db_consumption_compact(connection, config['device_id'], batch)
+    else:
+        stored = log_to_db_consumption(connection, config['device_id'], batch)
+    if stored:
+        logging.info("Transferred %d records to the database.", len(batch), extra={'sampled': True})
+    return stored
+
+# Background thread to transfer one device's AC data from its queue to the database
+def transfer_ac_to_database(data_queue, stop_event=None, config=None):
+    config = config or default_device('consumption')
+    compact = compact_storage_enabled()
+    compressor = create_compressor('ac', CONSUMPTION_COLUMNS, config['name'])
+    pending = []  # rows whose write failed, written first; compressed rows are never re-fed to the compressor
     base_interval = 30
     while not (stop_event and stop_event.is_set()):
         batch = []
         try:
-            for _ in range(50):
+            # While a write is failing take fewer new samples, so an outage backs up in the bounded queue
+            for _ in range(max(50 - len(pending), 0)):
                 batch.append(data_queue.get_nowait())
         except Empty:
             pass
+        if compressor:
+            batch = compressor.process(batch)
+        batch = pending + batch
+        pending = []
         if batch:
+            stored = False
             try:
-                with db_connection() as connection:
+                with trace_sample('ac_flush'), db_connection() as connection:
                     if connection:
-                        log_to_db_consumption(connection, batch)
-                        logging.info(f"Transferred {len(batch)} records to the database.")
+                        with stage('db_write'):
+                            stored = _log_ac_batch(connection, batch, config, compact)
+                        if compressor and stored:
+                            logging.info("Compression ratio (%s): %.2f (%d samples, %d stored)",
+                                         config['name'], compressor.ratio, compressor.received, compressor.emitted, extra={'sampled': True})
             except Exception as e:
                 logging.error(f"Database transfer error: {e}")
-                for record in batch:
-                    data_queue.put(record)
+            if not stored:
+                pending = batch
         queue_size = data_queue.qsize()
         sleep_time = max(base_interval - (queue_size / 100), 5)
-        time.sleep(sleep_time)
+        pause(stop_event, sleep_time)
+    # Capture has stopped: store every sample still queued and the point the
+    # compressor is holding, so shutdown loses nothing
+    remaining = drain(data_queue)
+    if compressor:
+        remaining = compressor.process(remaining) + compressor.flush()
+    remaining = pending + remaining
+    if remaining:
+        with db_connection() as connection:
+            stored = connection is not None and _log_ac_batch(connection, remaining, config, compact)
+        if not stored:
+            logging.error(f"{len(remaining)} queued samples of {config['name']} were lost at shutdown")
 
 # Optional: function to display real-time data (for CLI/debug)
 def display_ac_realtime_data(data_queue, stop_event=None):
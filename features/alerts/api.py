@@ -0,0 +1,106 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import asyncio
+import json
+from datetime import datetime, timedelta
+from typing import List, Optional
+from .models import AlertEvent, AlertRule
+from .service import get_alert_history
+from common import alerts, pipeline
+from common.devices import get_device
+from common.metrics import SSE_CLIENTS, SSE_DROPPED
+
+router = APIRouter(prefix="/alerts", tags=["Alerts"])
+
+# (client queue, device filter) per /alerts/live client
+alert_client_sse_queues = []
+
+# Evaluated only where capture runs, from before the first sample; loads alerts left raised by the previous run
+pipeline.register('alerts', pipeline.PROCESSING, alerts.start, alerts.stop)
+
+def publish_alert(event):
+    for client_q, device_id in list(alert_client_sse_queues):
+        if device_id is not None and event['deviceId'] != device_id:
+            continue
+        try:
+            client_q.put_nowait(event)
+        except asyncio.QueueFull:
+            SSE_DROPPED.inc(stream='alert')
+
+alerts.subscribe(publish_alert)
+
+def _check_device(device_id):
+    if device_id is not None and get_device(device_id) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown device {device_id}")
+    return device_id
+
+async def alert_event_generator(request: Request, device_id):
+    client_queue = asyncio.Queue(maxsize=100)
+    entry = (client_queue, device_id)
+    alert_client_sse_queues.append(entry)
+    SSE_CLIENTS.inc(stream='alert')
+    try:
+        # Start with the alerts already raised, then stream changes
+        for event in alerts.active_alerts(device_id):
+            yield f"data: {json.dumps(event)}\n\n"
+        while True:
+            event = await client_queue.get()
+            yield f"data: {json.dumps(event)}\n\n"
+    except asyncio.CancelledError:
+        pass
+    finally:
+        alert_client_sse_queues.remove(entry)
+        SSE_CLIENTS.dec(stream='alert')
+
+@router.get("/live")
+async def live_alerts(
+    request: Request,
+    device_id: Optional[int] = Query(None, description="Only this device's alerts. Defaults to all.")
+):
+    """
+    Server-sent events: every alert currently raised, then each alert as it
+    is raised (state "firing") or resolved.
+    """
+    return StreamingResponse(
+        alert_event_generator(request, _check_device(device_id)),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"  # Disable buffering for nginx
+        }
+    )
+
+@router.get("/active", response_model=List[AlertEvent])
+def get_active_alerts(
+    device_id: Optional[int] = Query(None, description="Only this device's alerts. Defaults to all.")
+):
+    """
+    Alerts raised and not yet resolved, oldest first. Served from memory.
+    """
+    return alerts.active_alerts(_check_device(device_id))
+
+@router.get("/history", response_model=List[AlertEvent])
+def get_alert_events(
+    start: Optional[datetime] = Query(None, description="Range start. Defaults to seven days before end."),
+    end: Optional[datetime] = Query(None, description="Range end. Defaults to now."),
+    device_id: Optional[int] = Query(None, description="Only this device's alerts. Defaults to all."),
+    rule: Optional[str] = Query(None, description="Only this rule's alerts."),
+    limit: int = Query(1000, ge=1, le=10000)
+):
+    """
+    Raised and resolved alerts recorded in the range, newest first.
+    """
+    end = end or datetime.now()
+    start = start or end - timedelta(days=7)
+    events = get_alert_history(start, end, _check_device(device_id), rule, limit)
+    if events is None:
+        return JSONResponse(status_code=500, content={"detail": "Database connection error"})
+    return events
+
+@router.get("/rules", response_model=List[AlertRule])
+def list_alert_rules():
+    """
+    Alert rules evaluated on the live samples (ALERT_RULES_FILE or the built-in defaults).
+    """
+    return [rule.info() for rule in alerts.get_rules()]
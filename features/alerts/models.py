@@ -0,0 +1,29 @@
+from pydantic import BaseModel
+from typing import List, Optional
+
+class AlertRule(BaseModel):
+    name: str
+    kind: str
+    devices: Optional[List[int]] = None
+    metric: str
+    stat: str
+    op: str
+    threshold: float
+    clear: float
+    forSeconds: float
+    clearForSeconds: float
+    severity: str
+    hours: Optional[List[int]] = None
+    minPower: Optional[float] = None
+    description: str = ''
+
+class AlertEvent(BaseModel):
+    deviceId: int
+    rule: str
+    severity: str
+    state: str
+    timestamp: str
+    value: Optional[float] = None
+    threshold: float
+    message: str
+    raisedAt: Optional[str] = None
@@ -0,0 +1,26 @@
+from common.alerts import alert_event
+from common.database import read_connection
+
+def get_alert_history(start, end, device_id=None, rule=None, limit=1000):
+    """Alert events in [start, end), newest first, or None without a database."""
+    conditions = ["timestamp >= %s", "timestamp < %s"]
+    params = [start, end]
+    if device_id is not None:
+        conditions.append("device = %s")
+        params.append(device_id)
+    if rule is not None:
+        conditions.append("rule = %s")
+        params.append(rule)
+    query = f"""
+        SELECT device, rule, severity, state, timestamp, value, threshold, message
+        FROM alertEvents
+        WHERE {' AND '.join(conditions)}
+        ORDER BY timestamp DESC, id DESC
+        LIMIT %s
+    """
+    with read_connection() as connection:
+        if not connection:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(query, (*params, limit))
+            return [alert_event(row) for row in cursor.fetchall()]
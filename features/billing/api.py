@@ -0,0 +1,126 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import JSONResponse
+from datetime import date, datetime
+from typing import List, Optional
+from .models import Bill, Tariff, TariffComparison
+from .service import get_bills, bill_totals, month_range
+from .tariffs import get_tariffs, get_tariff
+from common.devices import get_device, get_devices
+from common.responses import json_response
+
+router = APIRouter(prefix="/billing", tags=["Billing"])
+
+MAX_MONTHS = 120
+
+def _tariff_info(tariff):
+    return {
+        'tariffId': tariff['tariff_id'],
+        'name': tariff['name'],
+        'currency': tariff['currency'],
+        'standingCharge': tariff['standing_charge'],
+        'exportMode': tariff['export_mode'],
+        'exportRate': tariff['export_rate'],
+        'periods': list(tariff['periods']),
+    }
+
+def _check_tariff(tariff_id):
+    tariff = get_tariff(tariff_id)
+    if tariff is None:
+        raise HTTPException(status_code=404, detail=f"Unknown tariff {tariff_id}")
+    return tariff
+
+def _check_scope(site_id, device_id):
+    if device_id is not None and get_device(device_id) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown device {device_id}")
+    if site_id is not None and not get_devices(site_id=site_id):
+        raise HTTPException(status_code=404, detail=f"Unknown site {site_id}")
+
+def _months(start, end):
+    """(year, month) list for the YYYY-MM range; defaults to the twelve months up to the current one."""
+    try:
+        last = datetime.strptime(end, '%Y-%m').date() if end else date.today()
+        if start:
+            first = datetime.strptime(start, '%Y-%m').date()
+        else:
+            first = date(last.year - 1, last.month, 1) if last.month == 12 else date(last.year - 1, last.month + 1, 1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Months must be in YYYY-MM format")
+    months = month_range((first.year, first.month), (last.year, last.month))
+    if not months:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if len(months) > MAX_MONTHS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_MONTHS} months per request")
+    return months
+
+def _label(month):
+    return f"{month[0]:04d}-{month[1]:02d}"
+
+START = Query(None, description="First month (YYYY-MM). Defaults to eleven months before end.")
+END = Query(None, description="Last month (YYYY-MM), inclusive. Defaults to the current month.")
+SITE = Query(None, description="Site whose meters are billed. Defaults to SITE_ID.")
+DEVICE = Query(None, description="Bill one meter instead of a site.")
+
+@router.get("/tariffs", response_model=List[Tariff])
+def list_tariffs():
+    """
+    Configured time-of-use tariffs (TARIFFS_FILE) and their price periods.
+    """
+    return [_tariff_info(tariff) for tariff in get_tariffs()]
+
+@router.get("/bill", response_model=Bill)
+def bill(
+    request: Request,
+    tariff_id: Optional[str] = Query(None, description="Tariff to bill under. Defaults to the first configured tariff."),
+    start: Optional[str] = START,
+    end: Optional[str] = END,
+    site_id: Optional[int] = SITE,
+    device_id: Optional[int] = DEVICE
+):
+    """
+    Monthly bills from the hourly summaries: energy charge per price period,
+    export credit, standing charge, and the saving against the same
+    consumption with no solar production.
+    """
+    tariff = _check_tariff(tariff_id) if tariff_id is not None else get_tariffs()[0]
+    _check_scope(site_id, device_id)
+    months = _months(start, end)
+    bills = get_bills([tariff['tariff_id']], months, site_id, device_id)
+    if bills is None:
+        return JSONResponse(status_code=500, content={"detail": "Database connection error"})
+    monthly = bills[tariff['tariff_id']]
+    return json_response(request, {
+        'tariff': _tariff_info(tariff),
+        'start': _label(months[0]),
+        'end': _label(months[-1]),
+        'months': monthly,
+        'totals': bill_totals(monthly),
+    })
+
+@router.get("/compare", response_model=TariffComparison)
+def compare(
+    request: Request,
+    tariff_id: Optional[List[str]] = Query(None, description="Tariffs to compare (repeatable). Defaults to all."),
+    start: Optional[str] = START,
+    end: Optional[str] = END,
+    site_id: Optional[int] = SITE,
+    device_id: Optional[int] = DEVICE
+):
+    """
+    Totals of the same period under several tariffs, cheapest first.
+    """
+    tariffs = [_check_tariff(t) for t in dict.fromkeys(tariff_id)] if tariff_id else get_tariffs()
+    _check_scope(site_id, device_id)
+    months = _months(start, end)
+    bills = get_bills([tariff['tariff_id'] for tariff in tariffs], months, site_id, device_id)
+    if bills is None:
+        return JSONResponse(status_code=500, content={"detail": "Database connection error"})
+    results = sorted((
+        {'tariff': _tariff_info(tariff), 'totals': bill_totals(bills[tariff['tariff_id']])}
+        for tariff in tariffs
+    ), key=lambda result: result['totals']['total'])
+    return json_response(request, {
+        'start': _label(months[0]),
+        'end': _label(months[-1]),
+        'cheapest': results[0]['tariff']['tariffId'] if results else None,
+        'tariffs': results,
+    })
@@ -0,0 +1,49 @@
+from pydantic import BaseModel
+from typing import Dict, List, Optional
+
+class PeriodCharge(BaseModel):
+    importedKWh: float
+    energyCharge: float
+
+class BillTotals(BaseModel):
+    consumptionKWh: float
+    productionKWh: float
+    importedKWh: float
+    exportedKWh: float
+    energyCharge: float
+    exportCredit: float
+    baselineEnergyCharge: float
+    standingCharge: float
+    total: float
+    baselineTotal: float
+    savings: float
+    periods: Dict[str, PeriodCharge]
+
+class MonthBill(BillTotals):
+    month: str
+
+class Tariff(BaseModel):
+    tariffId: str
+    name: str
+    currency: str
+    standingCharge: float
+    exportMode: str
+    exportRate: Optional[float] = None
+    periods: List[str]
+
+class Bill(BaseModel):
+    tariff: Tariff
+    start: str
+    end: str
+    months: List[MonthBill]
+    totals: BillTotals
+
+class TariffTotals(BaseModel):
+    tariff: Tariff
+    totals: BillTotals
+
+class TariffComparison(BaseModel):
+    start: str
+    end: str
+    cheapest: Optional[str] = None
+    tariffs: List[TariffTotals]
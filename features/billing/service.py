@@ -0,0 +1,255 @@
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from itertools import repeat
+from operator import itemgetter
+import numpy as np
+from common.database import read_connection
+from common.devices import get_devices, get_device
+from common.metrics import counter
+from config import get_billing_config, get_fleet_config
+from .tariffs import get_tariff, month_hours, month_profile
+
+# Billing over the hourly summaries.
+#
+# A month is billed from two arrays of hourly energy (Wh) aligned with
+# month_hours(): the scope's consumption summed over its consumption meters
+# from hourSummary and its production from hourSummarySolar. Settling it
+# against a tariff's hourly rate vectors is a few numpy operations (per-period
+# totals in one bincount each) rather than a Python loop over hours.
+#
+# Energy results are cached per (tariff, scope, month). The cache follows the
+# summary change counter (common/database.py next_version): when it has moved,
+# the earliest hour rewritten since is looked up by version and only the
+# months from there on are dropped, so past months stay cached while the
+# hourly job keeps rewriting the current one. A month is only cached if the
+# counter has not moved since it was read, so a request racing an
+# invalidation cannot put back a stale month. Standing charges depend on the
+# days elapsed, not on the data, and are added when a bill is assembled.
+
+BILLING_CACHE = counter('powermon_billing_cache_total', 'Billed months served from cache or computed', ('result',))
+
+ENERGY_FIELDS = (
+    'consumptionKWh', 'productionKWh', 'importedKWh', 'exportedKWh',
+    'energyCharge', 'exportCredit', 'baselineEnergyCharge',
+)
+TOTAL_FIELDS = ENERGY_FIELDS + ('standingCharge', 'total', 'baselineTotal', 'savings')
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_seen_version = None
+_energy = itemgetter('energy')
+_timestamp = itemgetter('timestamp')
+
+
+def scope_devices(site_id=None, device_id=None):
+    """(consumption device ids, production device ids) billed for a site (default SITE_ID), or for one meter."""
+    if device_id is not None:
+        devices = [get_device(device_id)]
+    else:
+        devices = get_devices(site_id=site_id if site_id is not None else get_fleet_config()['site_id'])
+    return (
+        tuple(device['device_id'] for device in devices if device['kind'] == 'consumption'),
+        tuple(device['device_id'] for device in devices if device['kind'] == 'production'),
+    )
+
+
+def _invalidate(connection):
+    """
+    Drop cached months at or after the earliest hour rewritten since the last
+    check; returns the change version the caller's reads are taken under.
+    """
+    global _seen_version
+    with _cache_lock:
+        seen = _seen_version
+    earliest = []
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT version FROM changeVersion WHERE id = 1")
+        head = cursor.fetchone()['version']
+        if seen is not None and head > seen:
+            for table in ('hourSummary', 'hourSummarySolar'):
+                cursor.execute(f"""
+                    SELECT timestamp FROM {table}
+                    WHERE version > %s AND version <= %s
+                    ORDER BY timestamp
+                    LIMIT 1
+                """, (seen, head))
+                row = cursor.fetchone()
+                if row:
+                    earliest.append(row['timestamp'])
+    with _cache_lock:
+        # Never move back: another request may have got further, or this read
+        # came from a replica that is behind
+        if _seen_version is not None and head <= _seen_version:
+            return head
+        if earliest:
+            first = min(earliest)
+            first = (first.year, first.month)
+            for key in [key for key in _cache if key[2:] >= first]:
+                del _cache[key]
+        _seen_version = head
+    return head
+
+
+def _hourly_energy(connection, table, column, devices, start, end):
+    """{hour: Wh summed over devices} for start <= hour < end."""
+    if not devices:
+        return {}
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT timestamp, SUM({column}) AS energy
+            FROM {table}
+            WHERE device IN ({', '.join(['%s'] * len(devices))}) AND timestamp >= %s AND timestamp < %s
+            GROUP BY timestamp
+        """, (*devices, start, end))
+        rows = cursor.fetchall()
+    return dict(zip(map(_timestamp, rows), map(float, map(_energy, rows))))
+
+
+def _month_vector(energy, year, month):
+    """Hourly Wh of one month as a numpy vector, hours without a summary row counting as 0."""
+    hours = month_hours(year, month)
+    return np.fromiter(map(energy.get, hours, repeat(0.0)), dtype=float, count=len(hours))
+
+
+def _settle(tariff, year, month, consumption, production):
+    """Energy totals and charges of one month's hourly vectors under a tariff (money per kWh, energy in Wh)."""
+    rates, export_rates, periods = month_profile(tariff['tariff_id'], year, month)
+    if tariff['export_mode'] == 'net':
+        net = consumption - production
+        imported = np.maximum(net, 0.0)
+        exported = imported - net
+    else:
+        imported, exported = consumption, production
+    import_costs = imported * rates
+    names = tariff['periods']
+    hours = np.bincount(periods, minlength=len(names))
+    period_energy = np.bincount(periods, weights=imported, minlength=len(names))
+    period_costs = np.bincount(periods, weights=import_costs, minlength=len(names))
+    return {
+        'consumptionKWh': float(consumption.sum()) / 1000,
+        'productionKWh': float(production.sum()) / 1000,
+        'importedKWh': float(imported.sum()) / 1000,
+        'exportedKWh': float(exported.sum()) / 1000,
+        'energyCharge': float(import_costs.sum()) / 1000,
+        'exportCredit': float(exported @ export_rates) / 1000,
+        'baselineEnergyCharge': float(consumption @ rates) / 1000,
+        'periods': {
+            name: {'importedKWh': float(period_energy[i]) / 1000, 'energyCharge': float(period_costs[i]) / 1000}
+            for i, name in enumerate(names) if hours[i]
+        },
+    }
+
+
+def _next_month(year, month):
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _billed_days(year, month, today):
+    """Days of the month the standing charge applies to: all of them, or those elapsed in the current month."""
+    start = date(year, month, 1)
+    end = date(*_next_month(year, month), 1)
+    if start > today:
+        return 0
+    return (min(end, today + timedelta(days=1)) - start).days
+
+
+def _rounded(values):
+    """Money to 4 places and energy to 3, recursing into period breakdowns."""
+    return {
+        field: _rounded(value) if isinstance(value, dict) else round(value, 3 if field.endswith('KWh') else 4)
+        for field, value in values.items()
+    }
+
+
+def _store(key, result, version):
+    """Cache a month computed from reads taken under change version `version`, unless the summaries have moved on since."""
+    limit = get_billing_config()['cache_size']
+    with _cache_lock:
+        if version != _seen_version:
+            # Invalidated while it was computed: it may predate a rewrite
+            return
+        _cache[key] = result
+        _cache.move_to_end(key)
+        while len(_cache) > limit:
+            _cache.popitem(last=False)
+
+
+def month_range(start, end):
+    """Every (year, month) from start to end inclusive."""
+    months = []
+    while start <= end:
+        months.append(start)
+        start = _next_month(*start)
+    return months
+
+
+def get_bills(tariff_ids, months, site_id=None, device_id=None):
+    """
+    Monthly bills for each tariff over the months (list of (year, month)),
+    for a site's meters or one meter: {tariff_id: [month bill, ...]}, or None
+    without a database. Months missing from the cache are loaded with one
+    range query per summary table and settled against every tariff.
+    """
+    consumption_ids, production_ids = scope_devices(site_id, device_id)
+    if device_id is not None:
+        scope = ('device', device_id)
+    else:
+        scope = ('site', site_id if site_id is not None else get_fleet_config()['site_id'])
+    results = {}
+    with read_connection() as connection:
+        if not connection:
+            return None
+        version = _invalidate(connection)
+        with _cache_lock:
+            for tariff_id in tariff_ids:
+                for month in months:
+                    key = (tariff_id, scope, *month)
+                    if key in _cache:
+                        _cache.move_to_end(key)
+                        results[key] = _cache[key]
+        BILLING_CACHE.inc(len(results), result='hit')
+        missing = sorted({month for month in months for tariff_id in tariff_ids if (tariff_id, scope, *month) not in results})
+        if missing:
+            start = datetime(*missing[0], 1)
+            end = datetime(*_next_month(*missing[-1]), 1)
+            consumption = _hourly_energy(connection, 'hourSummary', 'energyConsumption', consumption_ids, start, end)
+            production = _hourly_energy(connection, 'hourSummarySolar', 'energyProduced', production_ids, start, end)
+            for month in missing:
+                consumption_vector = _month_vector(consumption, *month)
+                production_vector = _month_vector(production, *month)
+                for tariff_id in tariff_ids:
+                    key = (tariff_id, scope, *month)
+                    if key not in results:
+                        results[key] = _settle(get_tariff(tariff_id), *month, consumption_vector, production_vector)
+                        _store(key, results[key], version)
+                        BILLING_CACHE.inc(result='miss')
+    today = date.today()
+    bills = {}
+    for tariff_id in tariff_ids:
+        tariff = get_tariff(tariff_id)
+        bills[tariff_id] = []
+        for year, month in months:
+            energy = results[tariff_id, scope, year, month]
+            standing = tariff['standing_charge'] * _billed_days(year, month, today)
+            bill = {'month': f"{year:04d}-{month:02d}", **{field: energy[field] for field in ENERGY_FIELDS}}
+            bill['standingCharge'] = standing
+            bill['total'] = energy['energyCharge'] - energy['exportCredit'] + standing
+            bill['baselineTotal'] = energy['baselineEnergyCharge'] + standing
+            bill['savings'] = bill['baselineTotal'] - bill['total']
+            bill['periods'] = energy['periods']
+            bills[tariff_id].append({'month': bill.pop('month'), **_rounded(bill)})
+    return bills
+
+
+def bill_totals(months):
+    """Sum of monthly bills, per field and per period."""
+    totals = {field: sum(bill[field] for bill in months) for field in TOTAL_FIELDS}
+    periods = {}
+    for bill in months:
+        for period, values in bill['periods'].items():
+            period_totals = periods.setdefault(period, {'importedKWh': 0.0, 'energyCharge': 0.0})
+            period_totals['importedKWh'] += values['importedKWh']
+            period_totals['energyCharge'] += values['energyCharge']
+    totals['periods'] = periods
+    return _rounded(totals)
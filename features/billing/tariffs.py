@@ -0,0 +1,163 @@
+import calendar
+import json
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+import numpy as np
+from config import get_billing_config
+
+# Time-of-use tariff definitions.
+#
+# Without TARIFFS_FILE there is one tariff, "flat", priced by TARIFF_FLAT_RATE
+# with exports credited at TARIFF_EXPORT_RATE. TARIFFS_FILE is a JSON list:
+#
+#     [{"tariff_id": "tou", "name": "Residential TOU", "currency": "EUR",
+#       "standing_charge": 0.45,
+#       "export": {"mode": "net", "rate": 0.08},
+#       "seasons": [
+#         {"name": "summer", "months": [6, 7, 8, 9], "rate": 0.21,
+#          "periods": [{"name": "peak", "rate": 0.42, "hours": [16, 21], "days": "weekdays"},
+#                      {"name": "off-peak", "rate": 0.12, "hours": [23, 7]}]},
+#         {"name": "winter", "months": [1, 2, 3, 4, 5, 10, 11, 12], "rate": 0.19}]}]
+#
+# Rates are per kWh and the standing charge per day. Every month belongs to
+# exactly one season. A period covers the hours [start, end) (wrapping past
+# midnight when end <= start) on "all" days (the default), "weekdays",
+# "weekends" or a list of weekday numbers (0 = Monday); the first matching
+# period prices an hour and hours matching none are "standard" at the
+# season's rate. Export "net" mode nets consumption against production
+# within each hour and credits only the surplus; "gross" bills all
+# consumption and credits all production. An export rate of "retail" credits
+# each kWh at that hour's import rate (full net metering).
+#
+# Each tariff is compiled to a 7x24 rate table per month, and month_profile()
+# expands that into numpy vectors of per-hour rates and price periods for one
+# calendar month, cached, so billing a month is a handful of array operations.
+
+STANDARD = 'standard'
+EXPORT_MODES = ('net', 'gross')
+DAY_SETS = {'all': range(7), 'weekdays': range(5), 'weekends': range(5, 7)}
+
+
+def _days(value, where):
+    if isinstance(value, str):
+        if value not in DAY_SETS:
+            raise ValueError(f"{where}: days must be one of {', '.join(DAY_SETS)} or a list of weekdays, not {value!r}")
+        return set(DAY_SETS[value])
+    days = set(value)
+    if not days <= set(range(7)):
+        raise ValueError(f"{where}: weekdays must be 0 (Monday) to 6")
+    return days
+
+
+def _hours(value, where):
+    start, end = value
+    if not (0 <= start <= 23 and 0 <= end <= 24):
+        raise ValueError(f"{where}: hours must be [start, end) with 0 <= start <= 23 and 0 <= end <= 24")
+    if end > start:
+        return set(range(start, end))
+    return set(range(start, 24)) | set(range(end))
+
+
+def _compile(entry, source):
+    """Validate one tariff entry and build its per-month (period, rate) tables."""
+    config = get_billing_config()
+    tariff_id = entry.get('tariff_id')
+    if not tariff_id:
+        raise ValueError(f"{source}: every tariff needs a tariff_id")
+    where = f"{source}: tariff {tariff_id!r}"
+    export = {'mode': 'net', 'rate': config['export_rate'], **entry.get('export', {})}
+    if export['mode'] not in EXPORT_MODES:
+        raise ValueError(f"{where}: export mode must be one of {', '.join(EXPORT_MODES)}, not {export['mode']!r}")
+    if export['rate'] != 'retail' and not isinstance(export['rate'], (int, float)):
+        raise ValueError(f"{where}: export rate must be a number or \"retail\"")
+    periods = [STANDARD]
+    months = {}
+    for season in entry.get('seasons', ()):
+        season_where = f"{where} season {season.get('name')!r}"
+        week = [[(STANDARD, float(season['rate']))] * 24 for _ in range(7)]
+        # Fill in reverse so the first listed period wins where periods overlap
+        for period in reversed(season.get('periods', ())):
+            name = period['name']
+            if name not in periods:
+                periods.append(name)
+            for day in _days(period.get('days', 'all'), season_where):
+                for hour in _hours(period['hours'], season_where):
+                    week[day][hour] = (name, float(period['rate']))
+        for month in season['months']:
+            if month in months:
+                raise ValueError(f"{where}: month {month} is in more than one season")
+            months[month] = tuple(tuple(day) for day in week)
+    missing = sorted(set(range(1, 13)) - set(months))
+    if missing:
+        raise ValueError(f"{where}: months {missing} are in no season")
+    return {
+        'tariff_id': tariff_id,
+        'name': entry.get('name', tariff_id),
+        'currency': entry.get('currency', config['currency']),
+        'standing_charge': float(entry.get('standing_charge', config['standing_charge'])),
+        'export_mode': export['mode'],
+        'export_rate': None if export['rate'] == 'retail' else float(export['rate']),
+        'periods': tuple(periods),
+        'months': months,
+    }
+
+
+@lru_cache(maxsize=1)
+def _registry():
+    config = get_billing_config()
+    if not config['tariffs_file']:
+        entries = [{
+            'tariff_id': 'flat', 'name': 'Flat rate',
+            'seasons': [{'name': 'all year', 'months': list(range(1, 13)), 'rate': config['flat_rate']}],
+        }]
+        source = 'TARIFF_FLAT_RATE'
+    else:
+        with open(config['tariffs_file']) as f:
+            entries = json.load(f)
+        source = config['tariffs_file']
+    tariffs = {}
+    for entry in entries:
+        tariff = _compile(entry, source)
+        if tariff['tariff_id'] in tariffs:
+            raise ValueError(f"{source}: duplicate tariff_id {tariff['tariff_id']!r}")
+        tariffs[tariff['tariff_id']] = tariff
+    return tariffs
+
+
+def get_tariffs():
+    return list(_registry().values())
+
+
+def get_tariff(tariff_id):
+    """Compiled tariff, or None if there is no such tariff."""
+    return _registry().get(tariff_id)
+
+
+@lru_cache(maxsize=512)
+def month_hours(year, month):
+    """Start of every hour of a calendar month, in order (local wall-clock time, as stored)."""
+    start = datetime(year, month, 1)
+    return tuple(start + timedelta(hours=hour) for hour in range(calendar.monthrange(year, month)[1] * 24))
+
+
+@lru_cache(maxsize=1024)
+def month_profile(tariff_id, year, month):
+    """
+    (import rates, export rates, periods) for every hour of one month, as
+    read-only numpy vectors aligned with month_hours(): rates per kWh, and
+    each hour's index into the tariff's period names.
+    """
+    tariff = get_tariff(tariff_id)
+    week = tariff['months'][month]
+    index = {name: i for i, name in enumerate(tariff['periods'])}
+    days = calendar.monthrange(year, month)[1]
+    schedule = [week[date(year, month, day).weekday()] for day in range(1, days + 1)]
+    rates = np.array([rate for day in schedule for _, rate in day])
+    periods = np.array([index[name] for day in schedule for name, _ in day], dtype=np.intp)
+    if tariff['export_rate'] is None:
+        export_rates = rates
+    else:
+        export_rates = np.full(len(rates), tariff['export_rate'])
+    for vector in (rates, export_rates, periods):
+        vector.flags.writeable = False
+    return rates, export_rates, periods
@@ -0,0 +1,78 @@
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
+from common.metrics import gauge, render_metrics
+from common.logging import sampled_filter
+from common.profiler import collapsed_stacks
+from common.tracing import set_tracing, tracing_status
+from common.supervisor import device_health, CONNECTED, DEGRADED, DISCONNECTED, STARTING
+from common import pipeline
+
+router = APIRouter(tags=["Diagnostics"])
+
+MAX_PROFILE_SECONDS = 120
+
+# Overall status is the worst device state, in this order
+_SEVERITY = (CONNECTED, STARTING, DEGRADED, DISCONNECTED)
+
+gauge('powermon_log_suppressed', 'Sampled log records dropped by rate limiting').set_function(
+    lambda: sampled_filter.suppressed_total
+)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Pipeline counters, gauges and histograms in Prometheus text format.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@router.post("/admin/profile", response_class=PlainTextResponse)
+def profile(
+    seconds: float = Query(10, gt=0, le=MAX_PROFILE_SECONDS),
+    interval_ms: float = Query(5, ge=1, le=1000)
+):
+    """
+    Sample every thread's stack for `seconds` and return flamegraph-compatible
+    collapsed stacks (feed to flamegraph.pl, speedscope or inferno).
+    """
+    try:
+        return PlainTextResponse(collapsed_stacks(seconds, interval_ms / 1000))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.get("/admin/tracing")
+def get_tracing():
+    """
+    Current hot-path tracing state and slow-sample budget.
+    """
+    return tracing_status()
+
+@router.post("/admin/tracing")
+def update_tracing(enabled: bool, budget_ms: Optional[float] = Query(None, gt=0)):
+    """
+    Enable or disable per-stage tracing at runtime, optionally changing the
+    latency budget above which a sample's stage breakdown is logged.
+    """
+    set_tracing(enabled, budget_ms)
+    return tracing_status()
+
+@router.get("/health")
+def health():
+    """
+    Connection state of every polled meter and the worst of them as the
+    overall status. Always 200: the API itself is up even when a meter is not.
+    """
+    devices = device_health()
+    status = max((device['state'] for device in devices), key=_SEVERITY.index, default=CONNECTED)
+    return {"status": status, "devices": devices}
+
+@router.get("/ready")
+def ready():
+    """
+    Readiness for load balancers and rolling restarts: 200 once the pipeline
+    has started, the database answers and every meter of this process has
+    answered a poll; 503 before that and while shutting down.
+    """
+    components = pipeline.status()
+    ready = pipeline.is_ready(components)
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "components": components})
@@ -0,0 +1,26 @@
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
+from .models import Overview
+from common import overview as counters, pipeline
+from common.devices import get_devices
+from config import get_fleet_config
+
+router = APIRouter(tags=["Overview"])
+
+# Seeded before capture starts, so no sample is counted before the baselines are loaded
+pipeline.register('overview', pipeline.PROCESSING, counters.seed, ingest_only=False)
+
+@router.get("/overview", response_model=Overview)
+def get_overview(
+    site_id: Optional[int] = Query(None, description="Site to report. Defaults to SITE_ID.")
+):
+    """
+    Home-screen summary of a site: current consumption and production power,
+    energy consumed and produced today, net import (positive) or export
+    (negative), and today's coincident consumption peak. Served from
+    in-memory counters updated by every live sample; no database access.
+    """
+    site_id = site_id if site_id is not None else get_fleet_config()['site_id']
+    if not get_devices(site_id=site_id):
+        raise HTTPException(status_code=404, detail=f"Unknown site {site_id}")
+    return counters.overview(site_id)
@@ -0,0 +1,25 @@
+from pydantic import BaseModel
+from typing import List, Optional
+
+class DeviceOverview(BaseModel):
+    deviceId: int
+    kind: str
+    power: Optional[float] = None
+    todayKWh: float
+    peakPower: Optional[float] = None
+    peakAt: Optional[str] = None
+    lastSample: Optional[str] = None
+
+class Overview(BaseModel):
+    siteId: int
+    date: str
+    lastSample: Optional[str] = None
+    consumptionPower: float
+    productionPower: float
+    netPower: float
+    consumedTodayKWh: float
+    producedTodayKWh: float
+    netTodayKWh: float
+    peakPowerToday: Optional[float] = None
+    peakAt: Optional[str] = None
+    devices: List[DeviceOverview]
@@ -1,52 +1,120 @@
-from fastapi import APIRouter, BackgroundTasks, Request
+from fastapi import APIRouter, BackgroundTasks, Request, Query, HTTPException
 from fastapi.responses import StreamingResponse
 from queue import Queue
+import logging
 import threading
 import asyncio
 import json
+from functools import partial
+from typing import Optional
 from .models import SolarMeasurement, SolarMeasurementBatch
-from .service import capture_solar_data, transfer_solar_to_database
+from .service import capture_solar_data, capture_solar_async, transfer_solar_to_database
+from config import get_capture_config
+from common.devices import get_devices, get_device, default_device
+from common.metrics import CAPTURE_QUEUE_DEPTH, SSE_CLIENTS, SSE_DROPPED
+from common.livebus import register_stream, publish as live_publish
+from common.supervisor import devices_answered
+from common import pipeline
+from common import alerts, overview
 
 router = APIRouter(prefix="/solar", tags=["Solar Monitor"])
 
-source_solar_data_queue = Queue(maxsize=1000)  # Renamed from data_queue
-solar_client_sse_queues = []  # New global list for client SSE queues
-stop_event = threading.Event()
-threads_started = False
+# Per production device (common/devices.py): capture queue, SSE client queues and last sample
+solar_data_queues = {device['device_id']: Queue(maxsize=1000) for device in get_devices('production')}
+solar_live_queues = {device_id: Queue(maxsize=100) for device_id in solar_data_queues}  # thread capture -> forwarder
+solar_client_sse_queues = {device_id: [] for device_id in solar_data_queues}
+latest_solar_samples = {}  # Served by /latest
+CAPTURE_QUEUE_DEPTH.set_function(lambda: sum(q.qsize() for q in solar_data_queues.values()), stream='solar')
+# Capture stops before the writers, which then store what is still queued (common/pipeline.py)
+capture_stop_event = threading.Event()
+writer_stop_event = threading.Event()
+capture_threads = []
+capture_tasks = []
+writer_threads = []
 
-@router.on_event("startup")
-def start_solar_background_threads():
-    global threads_started
-    if not threads_started:
-        capture_thread = threading.Thread(target=capture_solar_data, args=(source_solar_data_queue, stop_event), daemon=True)
-        db_thread = threading.Thread(target=transfer_solar_to_database, args=(source_solar_data_queue, stop_event), daemon=True)
-        capture_thread.start()
-        db_thread.start()
-        # Start the new solar_data_forwarder task
-        asyncio.create_task(solar_data_forwarder())
-        threads_started = True
+def start_solar_writers():
+    for device in get_devices('production'):
+        data_queue = solar_data_queues[device['device_id']]
+        writer_threads.append(threading.Thread(target=transfer_solar_to_database, args=(data_queue, writer_stop_event, device), daemon=True))
+    for thread in writer_threads:
+        thread.start()
 
-async def solar_data_forwarder():
+def stop_solar_writers(timeout):
+    writer_stop_event.set()
+    return pipeline.join_threads(writer_threads, timeout)
+
+def start_solar_capture():
+    for device in get_devices('production'):
+        device_id = device['device_id']
+        data_queue = solar_data_queues[device_id]
+        publish = partial(publish_solar_sample, device_id)
+        if get_capture_config()['mode'] == 'async':
+            # Polled from the event loop; samples reach SSE clients directly via publish_solar_sample
+            capture_tasks.append(asyncio.create_task(capture_solar_async(data_queue, publish, capture_stop_event, device)))
+        else:
+            capture_thread = threading.Thread(target=capture_solar_data, args=(data_queue, capture_stop_event, device, solar_live_queues[device_id]), daemon=True)
+            capture_thread.start()
+            capture_threads.append(capture_thread)
+            capture_tasks.append(asyncio.create_task(solar_data_forwarder(solar_live_queues[device_id], publish)))
+
+async def stop_solar_capture(timeout):
+    capture_stop_event.set()
+    for task in capture_tasks:
+        task.cancel()
+    await asyncio.gather(*capture_tasks, return_exceptions=True)
+    # Capture threads finish their current poll and close their ports
+    return await asyncio.to_thread(pipeline.join_threads, capture_threads, timeout)
+
+pipeline.register('solar-writers', pipeline.WRITERS, start_solar_writers, stop_solar_writers)
+pipeline.register('solar-capture', pipeline.CAPTURE, start_solar_capture, stop_solar_capture,
+                  ready=lambda: devices_answered(device['name'] for device in get_devices('production')))
+
+def _device_id(device_id):
+    """Resolve an optional device_id query parameter to a production device id, or 404."""
+    device = get_device(device_id, 'production') if device_id is not None else default_device('production')
+    if device is None:
+        raise HTTPException(status_code=404, detail=f"No production device {device_id}")
+    return device['device_id']
+
+def publish_solar_sample(device_id, data_item):
+    """
+    Put one sample of a device into each of its client SSE queues and, in an
+    ingest process, send it to the API workers. Must run on the event loop.
+    """
+    latest_solar_samples[device_id] = data_item
+    overview.observe(device_id, data_item[0], data_item[3], data_item[4])
+    alerts.evaluate('production', device_id, data_item)
+    live_publish('solar', [device_id, data_item], key=device_id)
+    # Iterate over a copy of the list to avoid issues if it's modified during iteration
+    for client_q in list(solar_client_sse_queues.get(device_id, ())):
+        try:
+            client_q.put_nowait(data_item)
+        except asyncio.QueueFull:
+            SSE_DROPPED.inc(stream='solar')
+            logging.warning("Solar live client queue full, sample dropped for that client", extra={'sampled': True})
+        except Exception as e:
+            logging.error("Error putting data to a solar live client queue: %s", e, extra={'sampled': True})
+
+register_stream('solar', lambda item: publish_solar_sample(item[0], tuple(item[1])))
+
+async def solar_data_forwarder(live_queue, publish):
     """
-    Continuously gets data from source_solar_data_queue and puts it into all client_sse_queues.
+    Continuously gets data from a device's live queue and publishes it to its SSE clients.
+    Only used with thread capture; async capture publishes directly.
     """
     while True:
         try:
-            data_item = source_solar_data_queue.get_nowait()  # Non-blocking get
-            # Iterate over a copy of the list to avoid issues if it's modified during iteration
-            for client_q in list(solar_client_sse_queues):
-                try:
-                    await client_q.put(data_item)
-                except asyncio.QueueFull:
-                    print(f"Solar client queue {client_q} is full. Data item for this client lost.")
-                except Exception as e:
-                    print(f"Error putting data to solar client queue {client_q}: {e}")
+            data_item = live_queue.get_nowait()  # Non-blocking get
         except Exception as e: # Should be queue.Empty, but catching broader for safety
             await asyncio.sleep(0.05) # Queue is empty, wait a bit
+            continue
+        publish(data_item)
 
-async def event_generator(request: Request): # Renamed, now specific to solar & takes request
+async def event_generator(request: Request, device_id): # Renamed, now specific to solar & takes request
     client_queue = asyncio.Queue(maxsize=100)
-    solar_client_sse_queues.append(client_queue)
+    client_queues = solar_client_sse_queues.setdefault(device_id, [])
+    client_queues.append(client_queue)
+    SSE_CLIENTS.inc(stream='solar')
     last_sent = None
     try:
         while True:
@@ -68,17 +136,21 @@ async def event_generator(request: Request): # Renamed, now specific to solar &
             except asyncio.CancelledError:
                 break
             except Exception as e:
-                print(f"Error in solar event generator for a client: {e}")
+                logging.error(f"Error in solar event generator for a client: {e}")
                 await asyncio.sleep(1)
     finally:
-        if client_queue in solar_client_sse_queues:
-            solar_client_sse_queues.remove(client_queue)
-        print(f"Solar client {request.client} disconnected, queue removed. Remaining queues: {len(solar_client_sse_queues)}")
+        if client_queue in client_queues:
+            client_queues.remove(client_queue)
+        SSE_CLIENTS.dec(stream='solar')
+        logging.info(f"Solar client {request.client} disconnected, queue removed. Remaining queues: {len(client_queues)}")
 
 @router.get("/latest/live")
-async def live_solar_measurements(request: Request):
+async def live_solar_measurements(
+    request: Request,
+    device_id: Optional[int] = Query(None, description="Production device. Defaults to the solar meter.")
+):
     return StreamingResponse(
-        event_generator(request), # Pass request to the generator
+        event_generator(request, _device_id(device_id)), # Pass request to the generator
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -87,10 +159,13 @@ async def live_solar_measurements(request: Request):
     )
 
 @router.get("/latest", response_model=SolarMeasurement)
-def get_latest_solar_measurement():
+def get_latest_solar_measurement(
+    device_id: Optional[int] = Query(None, description="Production device. Defaults to the solar meter.")
+):
+    device_id = _device_id(device_id)
     try:
-        data = source_solar_data_queue.get_nowait() # Use the new queue name
-        timestamp, voltage, current, power, energy = data
+        # Read the last published sample; taking it from the capture queue would steal it from the DB writer
+        timestamp, voltage, current, power, energy = latest_solar_samples[device_id]
         return SolarMeasurement(
             voltage=voltage,
             current=current,
@@ -1,57 +1,146 @@
 import logging
 import serial
 from datetime import datetime
-from queue import Queue, Empty
+from queue import Queue, Empty, Full
 import threading
 import time
 from .modbus import read_holding_registers, parse_pzem_data
-from common.database import db_connection, log_to_db_production
-from config import get_solar_config
-
-# Background thread to capture solar data and put it in a queue
-def capture_solar_data(data_queue, stop_event=None):
-    config = get_solar_config()
-    ser = None
-    try:
-        ser = serial.Serial(config['serial_port'], config['baud_rate'], timeout=config['serial_timeout'])
-        logging.info(f"Connected to serial port: {config['serial_port']}")
+from common.database import db_connection, log_to_db_production, log_to_db_production_compact
+from common.compact import compact_storage_enabled, PRODUCTION_COLUMNS
+from common.compression import create_compressor
+from common.utils import drain, offer_live, pause
+from common.snapshots import MidnightTracker
+from common.metrics import SAMPLES_CAPTURED, SAMPLES_DROPPED, LAST_SAMPLE_TIMESTAMP
+from common.tracing import trace_sample, stage
+from common.modbus import READ_HOLDING_REGISTERS
+from common.modbus_async import get_bus, poll
+from common.supervisor import register_device, run_supervised
+from config import get_capture_config
+from common.devices import default_device
+
+# Background thread to capture solar data and put it in a queue. The port is
+# supervised: on a serial error it is closed and reopened with backoff forever.
+# config is one production device from common/devices.py (default: the solar meter).
+# Samples also go to live_queue, if given, for the forwarder that publishes them;
+# the storage queue has a single consumer, the DB writer.
+def capture_solar_data(data_queue, stop_event=None, config=None, live_queue=None):
+    config = config or default_device('production')
+    midnight = MidnightTracker('production', config['device_id'])
+    health = register_device(config['name'], config['serial_port'], config['slave_address'])
+
+    def session(ser):
         while not (stop_event and stop_event.is_set()):
             try:
-                registers = read_holding_registers(ser, 0x00, 8, config)
-                if registers:
-                    data = parse_pzem_data(registers, config)
-                    if data:
-                        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                        data_with_timestamp = (timestamp, data['voltage'], data['current'], data['power'], data['energy'])
-                        data_queue.put(data_with_timestamp)
-                        logging.info(f"Captured data (Solar): {timestamp}, Voltage: {data['voltage']}, Current: {data['current']}, Power: {data['power']}, Energy: {data['energy']}")
-                else:
-                    logging.warning("No data received from PZEM device")
+                with trace_sample('solar'):
+                    registers = read_holding_registers(ser, 0x00, 8, config, raise_serial_errors=True)
+                    if registers:
+                        health.mark_ok()
+                        with stage('parse'):
+                            data = parse_pzem_data(registers, config)
+                        if data:
+                            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                            data_with_timestamp = (timestamp, data['voltage'], data['current'], data['power'], data['energy'])
+                            with stage('enqueue'):
+                                data_queue.put(data_with_timestamp)
+                                offer_live(live_queue, data_with_timestamp)
+                            midnight.observe(timestamp, data['energy'])
+                            SAMPLES_CAPTURED.inc(stream='solar')
+                            LAST_SAMPLE_TIMESTAMP.set(time.time(), stream='solar')
+                            logging.info("Captured data (Solar): %s, Voltage: %s, Current: %s, Power: %s, Energy: %s",
+                                         timestamp, data['voltage'], data['current'], data['power'], data['energy'],
+                                         extra={'sampled': True})
+                    else:
+                        health.mark_failure("no valid reply")
+                        logging.warning("No data received from PZEM device", extra={'sampled': True})
+            except (serial.SerialException, OSError):
+                raise
             except Exception as e:
-                logging.error(f"Error in data capture: {e}")
+                logging.error("Error in data capture: %s", e, extra={'sampled': True})
             time.sleep(1)
-    finally:
-        if ser and ser.is_open:
-            ser.close()
-            logging.info("Serial port closed.")
 
-# Background thread to transfer solar data from queue to database
-def transfer_solar_to_database(data_queue, stop_event=None):
+    run_supervised(health, lambda: serial.Serial(config['serial_port'], config['baud_rate'], timeout=config['serial_timeout']),
+                   session, stop_event)
+
+# Event-loop capture: polls through the shared async bus and hands each sample
+# to the storage queue and to live subscribers (publish) without a thread hop
+async def capture_solar_async(data_queue, publish, stop_event=None, config=None):
+    config = config or default_device('production')
+    midnight = MidnightTracker('production', config['device_id'])
+    bus = get_bus(config['serial_port'], config['baud_rate'], config['serial_timeout'])
+    health = register_device(config['name'], config['serial_port'], config['slave_address'])
+
+    def handle(registers):
+        data = parse_pzem_data(registers, config)
+        if not data:
+            return
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        data_with_timestamp = (timestamp, data['voltage'], data['current'], data['power'], data['energy'])
+        try:
+            data_queue.put_nowait(data_with_timestamp)
+        except Full:
+            SAMPLES_DROPPED.inc(stream='solar')
+            logging.warning("Solar storage queue full, sample dropped", extra={'sampled': True})
+        publish(data_with_timestamp)
+        midnight.observe(timestamp, data['energy'])
+        SAMPLES_CAPTURED.inc(stream='solar')
+        LAST_SAMPLE_TIMESTAMP.set(time.time(), stream='solar')
+        logging.info("Captured data (Solar): %s, Voltage: %s, Current: %s, Power: %s, Energy: %s",
+                     timestamp, data['voltage'], data['current'], data['power'], data['energy'],
+                     extra={'sampled': True})
+
+    await poll(bus, config['slave_address'], READ_HOLDING_REGISTERS, 0x00, 8,
+               get_capture_config()['poll_interval'], handle, stop_event, health)
+
+def _log_solar_batch(connection, batch, config, compact):
+    if compact:
+        stored = log_to_db_production_compact(connection, config['device_id'], batch)
+    else:
+        stored = log_to_db_production(connection, config['device_id'], batch)
+    if stored:
+        logging.info("Transferred %d records to the database.", len(batch), extra={'sampled': True})
+    return stored
+
+# Background thread to transfer one device's solar data from its queue to the database
+def transfer_solar_to_database(data_queue, stop_event=None, config=None):
+    config = config or default_device('production')
+    compact = compact_storage_enabled()
+    compressor = create_compressor('solar', PRODUCTION_COLUMNS, config['name'])
+    pending = []  # rows whose write failed, written first; compressed rows are never re-fed to the compressor
     while not (stop_event and stop_event.is_set()):
         batch = []
         try:
-            for _ in range(50):
+            # While a write is failing take fewer new samples, so an outage backs up in the bounded queue
+            for _ in range(max(50 - len(pending), 0)):
                 batch.append(data_queue.get_nowait())
         except Empty:
             pass
+        if compressor:
+            batch = compressor.process(batch)
+        batch = pending + batch
+        pending = []
         if batch:
+            stored = False
             try:
-                with db_connection() as connection:
+                with trace_sample('solar_flush'), db_connection() as connection:
                     if connection:
-                        log_to_db_production(connection, batch)
-                        logging.info(f"Transferred {len(batch)} records to the database.")
+                        with stage('db_write'):
+                            stored = _log_solar_batch(connection, batch, config, compact)
+                        if compressor and stored:
+                            logging.info("Compression ratio (%s): %.2f (%d samples, %d stored)",
+                                         config['name'], compressor.ratio, compressor.received, compressor.emitted, extra={'sampled': True})
             except Exception as e:
                 logging.error(f"Database transfer error: {e}")
-                for record in batch:
-                    data_queue.put(record)
-        time.sleep(30)
+            if not stored:
+                pending = batch
+        pause(stop_event, 30)
+    # Capture has stopped: store every sample still queued and the point the
+    # compressor is holding, so shutdown loses nothing
+    remaining = drain(data_queue)
+    if compressor:
+        remaining = compressor.process(remaining) + compressor.flush()
+    remaining = pending + remaining
+    if remaining:
+        with db_connection() as connection:
+            stored = connection is not None and _log_solar_batch(connection, remaining, config, compact)
+        if not stored:
+            logging.error(f"{len(remaining)} queued samples of {config['name']} were lost at shutdown")
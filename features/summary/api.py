@@ -1,60 +1,253 @@
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Query, Request
 from .service import (
     get_hourly_consumption_summary,
     get_hourly_solar_summary,
     get_daily_summary,
+    get_site_hourly_summary,
+    get_summary_changes,
+    get_summary_watermark,
+    get_midnight_snapshots,
+    backfill_midnight_snapshots,
+    get_demand_peaks,
+    get_monthly_demand_peaks,
+    get_load_heatmap,
+    get_solar_yield,
 )
-from .models import HourSummary, HourSummarySolar, DailySummary
-from .scheduler import start_scheduler
+from .models import (
+    HourSummary, HourSummarySolar, DailySummary, SiteHourSummary, SummaryChanges,
+    DemandPeak, MonthlyDemandPeak, LoadHeatmapCell, SolarYieldPercentiles
+)
+from .scheduler import start_scheduler, stop_scheduler
+from common import pipeline
+from common.devices import get_device, get_devices, default_device
+from common.responses import json_response, not_modified
 from typing import Optional
-from datetime import datetime
+from datetime import date as Date, datetime, timedelta
+from fastapi import HTTPException
 from fastapi.responses import JSONResponse
 
 router = APIRouter(prefix="/summary", tags=["Summary"])
 
-@router.on_event("startup")
-def on_startup():
-    start_scheduler()
+# Only one process may run the summary jobs: the ingest one
+pipeline.register('scheduler', pipeline.SCHEDULING, start_scheduler, stop_scheduler)
+
+def _check_device(device_id, kind=None):
+    if device_id is not None and get_device(device_id, kind) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown device {device_id}")
+    return device_id
+
+def _summary_response(request, fetch, key=None, limit=None):
+    """
+    Serve the rows from fetch() with ETag/Last-Modified from the summary
+    change watermark, answering a matching conditional request with 304
+    before fetch() reads anything. The watermark is read first, so a write
+    racing the fetch can only make the body newer than its ETag, which costs
+    the client one extra download, never a stale cache hit.
+
+    Listings are newest first and keyset-paginated: when a page is full, the
+    cursor for the next (older) page is its last row's key, sent as
+    X-Next-Cursor and as a Link rel="next" URL.
+    """
+    watermark = get_summary_watermark()
+    etag = f'W/"{watermark["version"]}"' if watermark else None
+    last_modified = watermark['updatedAt'] if watermark else None
+    cached = not_modified(request, etag, last_modified)
+    if cached is not None:
+        return cached
+    rows = fetch()
+    if rows is None:
+        return JSONResponse(status_code=500, content={"detail": "Database connection error"})
+    headers = {}
+    if key and len(rows) == limit:
+        cursor = rows[-1][key].isoformat()
+        headers['X-Next-Cursor'] = cursor
+        headers['Link'] = f'<{request.url.include_query_params(before=cursor)}>; rel="next"'
+    return json_response(request, rows, etag, last_modified, headers)
+
+BEFORE_HOUR = Query(None, description="Cursor: only hours older than this (X-Next-Cursor of the previous page).")
+BEFORE_DATE = Query(None, description="Cursor: only days older than this (X-Next-Cursor of the previous page).")
 
 @router.get("/hourly/consumption", response_model=list[HourSummary])
-def hourly_consumption_summary():
-    return get_hourly_consumption_summary()
+def hourly_consumption_summary(
+    request: Request,
+    device_id: Optional[int] = Query(None, description="Consumption meter. Defaults to the configured AC meter."),
+    before: Optional[datetime] = BEFORE_HOUR,
+    limit: int = Query(24, ge=1, le=1000)
+):
+    device_id = _check_device(device_id, 'consumption')
+    return _summary_response(request, lambda: get_hourly_consumption_summary(device_id, before, limit), 'timestamp', limit)
 
 @router.get("/hourly/solar", response_model=list[HourSummarySolar])
-def hourly_solar_summary():
-    return get_hourly_solar_summary()
+def hourly_solar_summary(
+    request: Request,
+    device_id: Optional[int] = Query(None, description="Production meter. Defaults to the configured solar meter."),
+    before: Optional[datetime] = BEFORE_HOUR,
+    limit: int = Query(24, ge=1, le=1000)
+):
+    device_id = _check_device(device_id, 'production')
+    return _summary_response(request, lambda: get_hourly_solar_summary(device_id, before, limit), 'timestamp', limit)
 
 @router.get("/daily", response_model=list[DailySummary])
-def daily_summary():
-    return get_daily_summary()
+def daily_summary(
+    request: Request,
+    device_id: Optional[int] = Query(None, description="One meter. Defaults to the totals of a site."),
+    site_id: Optional[int] = Query(None, description="Site to total. Defaults to SITE_ID."),
+    before: Optional[Date] = BEFORE_DATE,
+    limit: int = Query(30, ge=1, le=1000)
+):
+    device_id = _check_device(device_id)
+    return _summary_response(request, lambda: get_daily_summary(device_id, site_id, before, limit), 'date', limit)
+
+@router.get("/sites/{site_id}/hourly", response_model=list[SiteHourSummary])
+def site_hourly_summary(
+    request: Request,
+    site_id: int,
+    hours: int = Query(24, ge=1, le=24 * 31),
+    before: Optional[datetime] = BEFORE_HOUR
+):
+    """
+    Consumption and production totals of every meter of a site, per hour.
+    """
+    if not get_devices(site_id=site_id):
+        raise HTTPException(status_code=404, detail=f"Unknown site {site_id}")
+    return _summary_response(request, lambda: get_site_hourly_summary(site_id, hours, before), 'timestamp', hours)
+
+@router.get("/changes", response_model=SummaryChanges)
+def summary_changes(
+    request: Request,
+    since: int = Query(0, ge=0, description="cursor of the previous response; 0 for a full sync."),
+    limit: int = Query(1000, ge=1, le=10000)
+):
+    """
+    Hourly and daily summary rows (per device) inserted or updated since the
+    cursor, oldest change first. Keep calling with the returned cursor while
+    more is true; afterwards, poll with it to receive only new changes.
+    """
+    return _summary_response(request, lambda: get_summary_changes(since, limit))
+
+def _analytics_response(request, rows):
+    if rows is None:
+        return JSONResponse(status_code=500, content={"detail": "Database connection error"})
+    return json_response(request, rows)
+
+@router.get("/demand/daily", response_model=list[DemandPeak])
+def daily_demand_peaks(
+    request: Request,
+    device_id: Optional[int] = Query(None, description="Consumption meter. Defaults to the configured AC meter."),
+    days: int = Query(31, ge=1, le=3660)
+):
+    """
+    Peak DEMAND_INTERVAL-minute (default 15) average demand of each of the
+    last `days` days, newest first, with the start of the peak interval.
+    """
+    device_id = _check_device(device_id, 'consumption')
+    today = Date.today()
+    return _analytics_response(request, get_demand_peaks(device_id, today - timedelta(days=days - 1), today))
+
+@router.get("/demand/monthly", response_model=list[MonthlyDemandPeak])
+def monthly_demand_peaks(
+    request: Request,
+    device_id: Optional[int] = Query(None, description="Consumption meter. Defaults to the configured AC meter."),
+    months: int = Query(12, ge=1, le=120)
+):
+    """
+    Peak interval demand of each of the last `months` calendar months, newest first.
+    """
+    device_id = _check_device(device_id, 'consumption')
+    today = Date.today()
+    start = today.replace(day=1)
+    for _ in range(months - 1):
+        start = (start - timedelta(days=1)).replace(day=1)
+    return _analytics_response(request, get_monthly_demand_peaks(device_id, start, today))
+
+@router.get("/load-profile", response_model=list[LoadHeatmapCell])
+def load_profile(
+    request: Request,
+    device_id: Optional[int] = Query(None, description="Consumption meter. Defaults to the configured AC meter.")
+):
+    """
+    Hour-of-week load heatmap: average power for each weekday (0 = Monday)
+    and hour of day, over every summarised hour.
+    """
+    device_id = _check_device(device_id, 'consumption')
+    return _analytics_response(request, get_load_heatmap(device_id))
+
+@router.get("/solar-yield", response_model=SolarYieldPercentiles)
+def solar_yield(
+    request: Request,
+    device_id: Optional[int] = Query(None, description="Production meter. Defaults to the configured solar meter."),
+    month: Optional[int] = Query(None, ge=1, le=12, description="Only days of this calendar month."),
+    percentile: list[float] = Query([10, 50, 90], description="Percentiles to report (repeatable).")
+):
+    """
+    Daily solar yield percentiles (Wh), e.g. p90 is the yield exceeded on
+    only one day in ten. Interpolated from the SOLAR_YIELD_BIN_WH histogram.
+    """
+    device_id = _check_device(device_id, 'production')
+    if any(not 0 <= value <= 100 for value in percentile):
+        raise HTTPException(status_code=400, detail="Percentiles must be between 0 and 100")
+    return _analytics_response(request, get_solar_yield(device_id, month, percentile))
 
 @router.get("/energy-at-midnight")
-def get_energy_at_midnight(date: Optional[str] = Query(None, description="Date in YYYY-MM-DD format. Defaults to today.")):
-    """
-    Get the energy values from energyConsumption_raw and energyProduction_raw just before 00:00 for a given date (default: today).
-    """
-    from common.database import db_connection
-    if date is None:
-        date = datetime.now().strftime('%Y-%m-%d')
-    with db_connection() as connection:
-        if not connection:
-            return JSONResponse(status_code=500, content={"detail": "Database connection error"})
-        with connection.cursor() as cursor:
-            # Get the last record before 00:00 for the date
-            cursor.execute("""
-                SELECT energy FROM energyConsumption_raw
-                WHERE timestamp < %s
-                ORDER BY timestamp DESC LIMIT 1
-            """, (f"{date} 00:00:00",))
-            row_c = cursor.fetchone()
-            cursor.execute("""
-                SELECT energy FROM energyProduction_raw
-                WHERE timestamp < %s
-                ORDER BY timestamp DESC LIMIT 1
-            """, (f"{date} 00:00:00",))
-            row_p = cursor.fetchone()
-    return {
-        "date": date,
-        "energyConsumptionAtMidnight": row_c["energy"] if row_c else None,
-        "energyProductionAtMidnight": row_p["energy"] if row_p else None
-    }
+def get_energy_at_midnight(
+    request: Request,
+    date: Optional[str] = Query(None, description="Date in YYYY-MM-DD format. Defaults to today."),
+    start: Optional[str] = Query(None, description="Range start (YYYY-MM-DD). Returns a list when given."),
+    end: Optional[str] = Query(None, description="Range end (YYYY-MM-DD), inclusive. Defaults to today."),
+    device_id: Optional[int] = Query(None, description="One meter. Defaults to the configured AC and solar meters.")
+):
+    """
+    Get the meter energy registers at 00:00 for a date (default: today), or for
+    every date in start..end. Answered from the energyMidnightSnapshot table.
+    """
+    if device_id is not None:
+        device_ids = [_check_device(device_id)]
+    else:
+        device_ids = [device['device_id'] for device in (default_device('consumption'), default_device('production')) if device]
+    try:
+        if start is not None:
+            start_date = datetime.strptime(start, '%Y-%m-%d').date()
+            end_date = datetime.strptime(end, '%Y-%m-%d').date() if end else datetime.now().date()
+        else:
+            start_date = end_date = datetime.strptime(date, '%Y-%m-%d').date() if date else datetime.now().date()
+    except ValueError:
+        return JSONResponse(status_code=400, content={"detail": "Dates must be in YYYY-MM-DD format"})
+    rows = get_midnight_snapshots(start_date, end_date, device_ids)
+    if rows is None:
+        return JSONResponse(status_code=500, content={"detail": "Database connection error"})
+    by_date = {row["date"]: row for row in rows}
+    results = []
+    day = start_date
+    while day <= end_date:
+        row = by_date.get(day)
+        results.append({
+            "date": day.strftime('%Y-%m-%d'),
+            "energyConsumptionAtMidnight": row["energyConsumption"] if row else None,
+            "energyProductionAtMidnight": row["energyProduction"] if row else None
+        })
+        day += timedelta(days=1)
+    return json_response(request, results if start is not None else results[0])
+
+@router.post("/energy-at-midnight/backfill")
+def backfill_energy_at_midnight(
+    start: str = Query(..., description="First date to backfill (YYYY-MM-DD)."),
+    end: Optional[str] = Query(None, description="Last date to backfill (YYYY-MM-DD). Defaults to today.")
+):
+    """
+    Populate midnight snapshots for historical dates from the raw tables.
+    Existing (live-captured) snapshots are not overwritten.
+    """
+    try:
+        start_date = datetime.strptime(start, '%Y-%m-%d').date()
+        end_date = datetime.strptime(end, '%Y-%m-%d').date() if end else None
+    except ValueError:
+        return JSONResponse(status_code=400, content={"detail": "Dates must be in YYYY-MM-DD format"})
+    return {"written": backfill_midnight_snapshots(start_date, end_date)}
+
+@router.get("/compression")
+def compression_report():
+    """
+    Ingestion compression statistics per stream (samples received, rows stored, ratio).
+    """
+    from common.compression import compression_stats
+    return compression_stats()
@@ -27,3 +27,53 @@ class DailySummary(BaseModel):
     date: date
     energyConsumption: Optional[float] = None
     solarProduction: Optional[float] = None
+
+class SiteHourSummary(BaseModel):
+    timestamp: datetime
+    energyConsumption: Optional[float] = None
+    avgConsumptionPower: Optional[float] = None
+    consumptionDevices: int = 0
+    energyProduced: Optional[float] = None
+    maxProductionPower: Optional[float] = None
+    productionDevices: int = 0
+
+class HourSummaryChange(HourSummary):
+    device: int
+    version: int
+
+class HourSummarySolarChange(HourSummarySolar):
+    device: int
+    version: int
+
+class DailySummaryChange(DailySummary):
+    device: int
+    version: int
+
+class SummaryChanges(BaseModel):
+    cursor: int
+    more: bool
+    hourlyConsumption: list[HourSummaryChange]
+    hourlySolar: list[HourSummarySolarChange]
+    daily: list[DailySummaryChange]
+
+class DemandPeak(BaseModel):
+    date: date
+    peakDemand: float
+    peakAt: datetime
+
+class MonthlyDemandPeak(BaseModel):
+    month: str
+    peakDemand: float
+    peakAt: datetime
+
+class LoadHeatmapCell(BaseModel):
+    weekday: int
+    hour: int
+    hours: int
+    avgPower: float
+
+class SolarYieldPercentiles(BaseModel):
+    month: Optional[int] = None
+    days: int
+    binWidth: float
+    percentiles: dict[str, Optional[float]]
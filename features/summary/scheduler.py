@@ -1,31 +1,74 @@
+import logging
 import threading
 import time
 from datetime import datetime
+from common.metrics import SCHEDULER_JOB_SECONDS, SCHEDULER_JOB_FAILURES
+from common.pipeline import join_threads
 from .service import (
     update_hourly_consumption_summary,
     update_hourly_solar_summary,
-    update_daily_summary
+    update_daily_summary,
+    update_demand_peaks,
+    update_load_heatmap,
+    update_solar_yield,
+    backfill_midnight_snapshots
 )
 
-def scheduler_thread():
+def run_job(job, *args):
+    """
+    Run a summary job, recording its duration. A failing job is counted and
+    logged instead of killing the scheduler thread.
+    """
+    start = time.perf_counter()
+    try:
+        job(*args)
+    except Exception as e:
+        SCHEDULER_JOB_FAILURES.inc(job=job.__name__)
+        logging.error(f"Scheduler job {job.__name__} failed: {e}")
+    finally:
+        SCHEDULER_JOB_SECONDS.observe(time.perf_counter() - start, job=job.__name__)
+
+# Seconds shutdown waits for a running job; the drain of queued samples matters more
+STOP_WAIT = 2
+
+_stop_event = threading.Event()
+_thread = None
+
+def scheduler_thread(stop_event):
     """
     Scheduler thread to run hourly and daily summary aggregation automatically.
     """
     last_hour = None
     last_day = None
-    while True:
+    while not stop_event.is_set():
         now = datetime.now()
         # Run hourly tasks exactly at the start of each hour
         if now.minute == 0 and now.second < 10 and last_hour != now.hour:
-            update_hourly_consumption_summary()
-            update_hourly_solar_summary()
+            run_job(update_hourly_consumption_summary)
+            run_job(update_hourly_solar_summary)
+            # Analytics read the summaries just written
+            run_job(update_load_heatmap)
+            run_job(update_demand_peaks)
             last_hour = now.hour
         # Run daily task at midnight
         if now.hour == 0 and now.minute == 0 and now.second < 10 and last_day != now.date():
-            update_daily_summary()
+            run_job(update_daily_summary)
+            run_job(update_solar_yield)
+            # Safety net for snapshots the capture threads did not record live
+            run_job(backfill_midnight_snapshots, now.date(), now.date())
             last_day = now.date()
-        time.sleep(5)  # Check every 5 seconds for better accuracy
+        stop_event.wait(5)  # Check every 5 seconds for better accuracy
 
 def start_scheduler():
-    t = threading.Thread(target=scheduler_thread, daemon=True)
-    t.start()
+    global _thread
+    _thread = threading.Thread(target=scheduler_thread, args=(_stop_event,), daemon=True)
+    _thread.start()
+
+def stop_scheduler(timeout):
+    """
+    Stop scheduling jobs. A job still running after STOP_WAIT is cut off at
+    exit; its transaction rolls back and the jobs resume from their stored
+    progress on the next start.
+    """
+    _stop_event.set()
+    return join_threads([_thread], min(timeout, STOP_WAIT))
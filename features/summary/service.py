@@ -1,216 +1,763 @@
 from common.database import (
     db_connection,
+    read_connection,
     save_hourly_consumption_summary,
     save_hourly_solar_summary,
-    save_daily_summary
+    save_daily_summary,
+    save_midnight_snapshots,
+    save_demand_peaks,
+    add_load_heatmap,
+    add_solar_yield,
+    hour_bucket,
+    interval_bucket
 )
+from common.compact import raw_source
+from common.compression import compression_enabled, time_weighted_hourly
+from common.devices import get_devices, get_device, default_device
+from config import get_compression_config, get_fleet_config, get_analytics_config
 from typing import List, Optional
-from .models import HourSummary, HourSummarySolar, DailySummary
-from datetime import datetime, timedelta
+from .models import SiteHourSummary
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
 
-def get_hourly_consumption_summary() -> List[HourSummary]:
-    query = """
+def _device_or_default(kind, device_id):
+    return device_id if device_id is not None else default_device(kind)['device_id']
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+def _older_than(column, before):
+    """
+    Keyset condition (and its params) for listings sorted newest first: the
+    page after cursor `before` is the rows strictly older than it, read
+    straight off the (device, column) unique index however deep the page.
+    """
+    if before is None:
+        return "", ()
+    return f"AND {column} < %s", (before,)
+
+def get_hourly_consumption_summary(device_id=None, before=None, limit=24) -> List[dict]:
+    """The `limit` hours before `before` (default: the latest), newest first, as HourSummary-shaped rows."""
+    older, older_params = _older_than('timestamp', before)
+    query = f"""
         SELECT timestamp, energyConsumption, avgVoltage, avgCurrent, avgPower, avgFrequency, avgPF
         FROM hourSummary
+        WHERE device = %s {older}
         ORDER BY timestamp DESC
-        LIMIT 24
+        LIMIT %s
     """
-    with db_connection() as connection:
+    with read_connection() as connection:
         if not connection:
             return []
         with connection.cursor() as cursor:
-            cursor.execute(query)
-            rows = cursor.fetchall()
-            return [HourSummary(**row) for row in rows]
+            cursor.execute(query, (_device_or_default('consumption', device_id), *older_params, limit))
+            return cursor.fetchall()
 
-def get_hourly_solar_summary() -> List[HourSummarySolar]:
-    query = """
+def get_hourly_solar_summary(device_id=None, before=None, limit=24) -> List[dict]:
+    """The `limit` hours before `before` (default: the latest), newest first, as HourSummarySolar-shaped rows."""
+    older, older_params = _older_than('timestamp', before)
+    query = f"""
         SELECT timestamp, energyProduced, minVoltage, maxVoltage, avgVoltage, minCurrent, maxCurrent, avgCurrent, minPower, maxPower
         FROM hourSummarySolar
+        WHERE device = %s {older}
         ORDER BY timestamp DESC
-        LIMIT 24
+        LIMIT %s
     """
-    with db_connection() as connection:
+    with read_connection() as connection:
         if not connection:
             return []
         with connection.cursor() as cursor:
-            cursor.execute(query)
-            rows = cursor.fetchall()
-            return [HourSummarySolar(**row) for row in rows]
+            cursor.execute(query, (_device_or_default('production', device_id), *older_params, limit))
+            return cursor.fetchall()
 
-def get_daily_summary() -> List[DailySummary]:
-    query = """
-        SELECT date, energyConsumption, solarProduction
+def get_daily_summary(device_id=None, site_id=None, before=None, limit=30) -> List[dict]:
+    """
+    The `limit` days before `before` (default: the latest) for one device, or
+    (by default) totals over every device of a site, summed from the
+    per-device dailySummary rollups. Rows are DailySummary-shaped.
+    """
+    if device_id is not None:
+        devices = [device_id]
+    else:
+        devices = [device['device_id'] for device in get_devices(site_id=site_id or get_fleet_config()['site_id'])]
+    if not devices:
+        return []
+    older, older_params = _older_than('date', before)
+    query = f"""
+        SELECT date, SUM(energyConsumption) AS energyConsumption, SUM(solarProduction) AS solarProduction
         FROM dailySummary
+        WHERE device IN ({_placeholders(devices)}) {older}
+        GROUP BY date
         ORDER BY date DESC
-        LIMIT 30
+        LIMIT %s
     """
-    with db_connection() as connection:
+    with read_connection() as connection:
         if not connection:
             return []
         with connection.cursor() as cursor:
-            cursor.execute(query)
-            rows = cursor.fetchall()
-            return [DailySummary(**row) for row in rows]
+            cursor.execute(query, (*devices, *older_params, limit))
+            return cursor.fetchall()
+
+SITE_HOUR_DEFAULTS = {field: info.default for field, info in SiteHourSummary.model_fields.items() if field != 'timestamp'}
 
-def save_hourly_consumption_summary_service(data_batch):
+def get_site_hourly_summary(site_id, hours=24, before=None) -> List[dict]:
     """
-    Save a batch of hourly consumption summary records to the hourSummary table.
+    Site totals for the `hours` hours before `before` (default: the latest),
+    summed from the per-device hourly rollups; the raw tables are not read.
+    Rows are SiteHourSummary-shaped.
+    """
+    older, older_params = _older_than('timestamp', before)
+    consumption = [device['device_id'] for device in get_devices('consumption', site_id)]
+    production = [device['device_id'] for device in get_devices('production', site_id)]
+    by_hour = {}
+    with read_connection() as connection:
+        if not connection:
+            return []
+        with connection.cursor() as cursor:
+            if consumption:
+                cursor.execute(f"""
+                    SELECT timestamp, SUM(energyConsumption) AS energyConsumption, SUM(avgPower) AS avgConsumptionPower,
+                           COUNT(*) AS consumptionDevices
+                    FROM hourSummary
+                    WHERE device IN ({_placeholders(consumption)}) {older}
+                    GROUP BY timestamp
+                    ORDER BY timestamp DESC
+                    LIMIT %s
+                """, (*consumption, *older_params, hours))
+                for row in cursor.fetchall():
+                    by_hour.setdefault(row['timestamp'], {'timestamp': row['timestamp'], **SITE_HOUR_DEFAULTS}).update(row)
+            if production:
+                cursor.execute(f"""
+                    SELECT timestamp, SUM(energyProduced) AS energyProduced, SUM(maxPower) AS maxProductionPower,
+                           COUNT(*) AS productionDevices
+                    FROM hourSummarySolar
+                    WHERE device IN ({_placeholders(production)}) {older}
+                    GROUP BY timestamp
+                    ORDER BY timestamp DESC
+                    LIMIT %s
+                """, (*production, *older_params, hours))
+                for row in cursor.fetchall():
+                    by_hour.setdefault(row['timestamp'], {'timestamp': row['timestamp'], **SITE_HOUR_DEFAULTS}).update(row)
+    latest = sorted(by_hour, reverse=True)[:hours]
+    return [by_hour[hour] for hour in latest]
+
+# Tables in the /summary/changes feed: response field -> (table, columns)
+CHANGE_FEEDS = {
+    'hourlyConsumption': ('hourSummary', 'device, timestamp, energyConsumption, avgVoltage, avgCurrent, avgPower, avgFrequency, avgPF, version'),
+    'hourlySolar': ('hourSummarySolar', 'device, timestamp, energyProduced, minVoltage, maxVoltage, avgVoltage, minCurrent, maxCurrent, avgCurrent, minPower, maxPower, version'),
+    'daily': ('dailySummary', 'device, date, energyConsumption, solarProduction, version'),
+}
+
+def get_summary_watermark():
+    """
+    The summaries' change counter and its UTC timestamp, or None without a
+    database. Every summary write bumps it, so it validates any summary
+    listing: an unchanged version means an unchanged response.
+    """
+    with read_connection() as connection:
+        if not connection:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT version, updatedAt FROM changeVersion WHERE id = 1")
+            return cursor.fetchone()
+
+def get_summary_changes(since=0, limit=1000):
+    """
+    Summary rows inserted or updated after change version `since`, oldest
+    first, about `limit` at a time, with the cursor to resume from. Only
+    versions up to the committed changeVersion counter are read: a writer
+    keeps the counter locked until it commits (common/database.py
+    next_version), so nothing at or below it can still appear and a client
+    resuming from the cursor misses no change. Pages end on a whole write, so
+    one larger than limit comes back in a single page.
+    """
+    with read_connection() as connection:
+        if not connection:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT version FROM changeVersion WHERE id = 1")
+            head = cursor.fetchone()['version']
+            versions = []
+            for table, _ in CHANGE_FEEDS.values():
+                cursor.execute(f"""
+                    SELECT version FROM {table}
+                    WHERE version > %s AND version <= %s
+                    ORDER BY version
+                    LIMIT %s
+                """, (since, head, limit))
+                versions.extend(row['version'] for row in cursor.fetchall())
+            versions.sort()
+            upto = versions[limit - 1] if len(versions) >= limit else head
+            changes = {'cursor': max(upto, since), 'more': upto < head}
+            for field, (table, columns) in CHANGE_FEEDS.items():
+                cursor.execute(f"""
+                    SELECT {columns} FROM {table}
+                    WHERE version > %s AND version <= %s
+                    ORDER BY version
+                """, (since, upto))
+                changes[field] = cursor.fetchall()
+    return changes
+
+def save_hourly_consumption_summary_service(device_id, data_batch):
+    """
+    Save a device's hourly consumption summary records to the hourSummary table.
     data_batch: List of tuples (timestamp, energyConsumption, avgVoltage, avgCurrent, avgPower, avgFrequency, avgPF)
     """
     with db_connection() as connection:
         if connection:
-            save_hourly_consumption_summary(connection, data_batch)
+            save_hourly_consumption_summary(connection, device_id, data_batch)
 
 
-def save_hourly_solar_summary_service(data_batch):
+def save_hourly_solar_summary_service(device_id, data_batch):
     """
-    Save a batch of hourly solar summary records to the hourSummarySolar table.
+    Save a device's hourly solar summary records to the hourSummarySolar table.
     data_batch: List of tuples (timestamp, energyProduced, minVoltage, maxVoltage, avgVoltage, minCurrent, maxCurrent, avgCurrent, minPower, maxPower)
     """
     with db_connection() as connection:
         if connection:
-            save_hourly_solar_summary(connection, data_batch)
+            save_hourly_solar_summary(connection, device_id, data_batch)
 
 
-def save_daily_summary_service(data_batch):
+def save_daily_summary_service(device_id, data_batch):
     """
-    Save a batch of daily summary records to the dailySummary table.
+    Save a device's daily summary records to the dailySummary table.
     data_batch: List of tuples (date, energyConsumption, solarProduction)
     """
     with db_connection() as connection:
         if connection:
-            save_daily_summary(connection, data_batch)
+            save_daily_summary(connection, device_id, data_batch)
+
+# Raw rows read per query when aggregating a compressed series, so a first
+# run over the whole history holds one window in memory at a time
+RAW_WINDOW = timedelta(days=1)
+
+def _fetch_raw_rows(connection, kind, device_id, since):
+    """
+    Yield a device's decoded raw samples of the given kind from since onwards,
+    ordered by timestamp, read RAW_WINDOW at a time. The last sample before
+    since comes first, so the segment leading into since can be interpolated.
+    """
+    table, col, device_condition, device_params = raw_source(kind, device_id)
+    columns = ', '.join(f"{expr} AS {name}" for name, expr in col.items())
+    with connection.cursor() as cursor:
+        cursor.execute(f'''
+            SELECT timestamp, {columns}
+            FROM {table}
+            WHERE {device_condition} AND timestamp < %s
+            ORDER BY timestamp DESC
+            LIMIT 1
+        ''', (*device_params, since))
+        yield from cursor.fetchall()
+        cursor.execute(f"SELECT MIN(timestamp) AS first, MAX(timestamp) AS last FROM {table} WHERE {device_condition} AND timestamp >= %s",
+                       (*device_params, since))
+        bounds = cursor.fetchone()
+        if not bounds or bounds['first'] is None:
+            return
+        start, last = _as_datetime(bounds['first']), _as_datetime(bounds['last'])
+        while start <= last:
+            cursor.execute(f'''
+                SELECT timestamp, {columns}
+                FROM {table}
+                WHERE {device_condition} AND timestamp >= %s AND timestamp < %s
+                ORDER BY timestamp
+            ''', (*device_params, start, start + RAW_WINDOW))
+            yield from cursor.fetchall()
+            start += RAW_WINDOW
+
+def _interpolated_hourly(connection, kind, device_id, since, columns):
+    """
+    Hourly aggregates over a compressed raw series from the hour since
+    onwards. Stored points are only the vertices of the reconstruction, so
+    averages are time-weighted by linear interpolation instead of AVG() over
+    rows.
+    """
+    rows = _fetch_raw_rows(connection, kind, device_id, since)
+    buckets = time_weighted_hourly(rows, columns, get_compression_config()['max_gap'], since=_as_datetime(since))
+    return sorted(buckets.items())
+
+def run_per_device(job, kind=None):
+    """
+    Run job(device_id) for every device (of a kind), SUMMARY_WORKERS at a
+    time, each on its own connection. A failing device is logged and does not
+    stop the others; the first failure is re-raised once all have run so the
+    scheduler counts it.
+    """
+    device_ids = [device['device_id'] for device in get_devices(kind)]
+    if not device_ids:
+        return
+    workers = max(1, min(len(device_ids), get_fleet_config()['summary_workers']))
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'summary-{kind or "all"}') as pool:
+        futures = {pool.submit(job, device_id): device_id for device_id in device_ids}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"{job.__name__} failed for device {futures[future]}: {e}")
+                errors.append(e)
+    if errors:
+        raise errors[0]
 
-def update_hourly_consumption_summary():
+def update_hourly_consumption_summary(device_id=None):
     """
-    Aggregate and save hourly consumption summary from energyConsumption_raw to hourSummary.
+    Aggregate and save hourly consumption summary from the raw table to
+    hourSummary, for one device or (by default) every consumption device.
     """
+    if device_id is None:
+        return run_per_device(update_hourly_consumption_summary, 'consumption')
     with db_connection() as connection:
         if not connection:
             return
         # Get last processed timestamp
         with connection.cursor() as cursor:
-            cursor.execute("SELECT MAX(timestamp) FROM hourSummary")
+            cursor.execute("SELECT MAX(timestamp) AS last FROM hourSummary WHERE device = %s", (device_id,))
             result = cursor.fetchone()
-            last_timestamp = result['MAX(timestamp)'] if result and result['MAX(timestamp)'] else None
+            last_timestamp = result['last'] if result and result['last'] else None
         if last_timestamp is None:
             last_timestamp = '2024-11-01 00:00:00'
+        if compression_enabled():
+            data_batch = [(
+                hour.strftime('%Y-%m-%d %H:00:00'),
+                round(agg['energy']['max'] - agg['energy']['min'], 2),
+                round(agg['voltage']['avg'], 2), round(agg['current']['avg'], 2),
+                round(agg['power']['avg'], 2), round(agg['frequency']['avg'], 2),
+                round(agg['power_factor']['avg'], 2)
+            ) for hour, agg in _interpolated_hourly(
+                connection, 'consumption', device_id, last_timestamp,
+                ('voltage', 'current', 'power', 'energy', 'frequency', 'power_factor')
+            )]
+            if data_batch:
+                save_hourly_consumption_summary(connection, device_id, data_batch)
+            return
         # Aggregate new hourly data
+        table, col, device_condition, device_params = raw_source('consumption', device_id)
         query = f'''
             SELECT 
-                DATE_FORMAT(timestamp, "%%Y-%%m-%%d %%H:00:00") AS hour,
-                ROUND(MAX(energy) - MIN(energy), 2) AS energyConsumption,
-                ROUND(AVG(voltage), 2) AS avgVoltage,
-                ROUND(AVG(current), 2) AS avgCurrent,
-                ROUND(AVG(power), 2) AS avgPower,
-                ROUND(AVG(frequency), 2) AS avgFrequency,
-                ROUND(AVG(power_factor), 2) AS avgPF
-            FROM energyConsumption_raw
-            WHERE timestamp > %s
+                {hour_bucket('timestamp')} AS hour,
+                ROUND(MAX({col['energy']}) - MIN({col['energy']}), 2) AS energyConsumption,
+                ROUND(AVG({col['voltage']}), 2) AS avgVoltage,
+                ROUND(AVG({col['current']}), 2) AS avgCurrent,
+                ROUND(AVG({col['power']}), 2) AS avgPower,
+                ROUND(AVG({col['frequency']}), 2) AS avgFrequency,
+                ROUND(AVG({col['power_factor']}), 2) AS avgPF
+            FROM {table}
+            WHERE {device_condition} AND timestamp > %s
             GROUP BY hour
             ORDER BY hour
         '''
         with connection.cursor() as cursor:
-            cursor.execute(query, (last_timestamp,))
+            cursor.execute(query, (*device_params, last_timestamp))
             rows = cursor.fetchall()
             data_batch = [(
                 row['hour'], row['energyConsumption'], row['avgVoltage'], row['avgCurrent'],
                 row['avgPower'], row['avgFrequency'], row['avgPF']
             ) for row in rows]
         if data_batch:
-            save_hourly_consumption_summary(connection, data_batch)
+            save_hourly_consumption_summary(connection, device_id, data_batch)
 
 
-def update_hourly_solar_summary():
+def update_hourly_solar_summary(device_id=None):
     """
-    Aggregate and save hourly solar summary from energyProduction_raw to hourSummarySolar.
+    Aggregate and save hourly solar summary from the raw table to
+    hourSummarySolar, for one device or (by default) every production device.
     """
+    if device_id is None:
+        return run_per_device(update_hourly_solar_summary, 'production')
     with db_connection() as connection:
         if not connection:
             return
         # Get last processed timestamp
         with connection.cursor() as cursor:
-            cursor.execute("SELECT MAX(timestamp) FROM hourSummarySolar")
+            cursor.execute("SELECT MAX(timestamp) AS last FROM hourSummarySolar WHERE device = %s", (device_id,))
             result = cursor.fetchone()
-            last_timestamp = result['MAX(timestamp)'] if result and result['MAX(timestamp)'] else None
+            last_timestamp = result['last'] if result and result['last'] else None
         if last_timestamp is None:
             last_timestamp = '2024-12-03 00:00:00'
+        if compression_enabled():
+            data_batch = [(
+                hour.strftime('%Y-%m-%d %H:00:00'),
+                round(agg['energy']['max'] - agg['energy']['min'], 2),
+                round(agg['voltage']['min'], 2), round(agg['voltage']['max'], 2), round(agg['voltage']['avg'], 2),
+                round(agg['current']['min'], 2), round(agg['current']['max'], 2), round(agg['current']['avg'], 2),
+                round(agg['power']['min'], 2), round(agg['power']['max'], 2)
+            ) for hour, agg in _interpolated_hourly(
+                connection, 'production', device_id, last_timestamp, ('voltage', 'current', 'power', 'energy')
+            )]
+            if data_batch:
+                save_hourly_solar_summary(connection, device_id, data_batch)
+            return
         # Aggregate new hourly solar data
-        query = '''
+        table, col, device_condition, device_params = raw_source('production', device_id)
+        query = f'''
             SELECT 
-                DATE_FORMAT(timestamp, "%%Y-%%m-%%d %%H:00:00") AS hour,
-                ROUND(MAX(energy) - MIN(energy), 2) AS energyProduced,
-                ROUND(MIN(voltage), 2) AS minVoltage,
-                ROUND(MAX(voltage), 2) AS maxVoltage,
-                ROUND(AVG(voltage), 2) AS avgVoltage,
-                ROUND(MIN(current), 2) AS minCurrent,
-                ROUND(MAX(current), 2) AS maxCurrent,
-                ROUND(AVG(current), 2) AS avgCurrent,
-                ROUND(MIN(power), 2) AS minPower,
-                ROUND(MAX(power), 2) AS maxPower
-            FROM energyProduction_raw
-            WHERE timestamp > %s
+                {hour_bucket('timestamp')} AS hour,
+                ROUND(MAX({col['energy']}) - MIN({col['energy']}), 2) AS energyProduced,
+                ROUND(MIN({col['voltage']}), 2) AS minVoltage,
+                ROUND(MAX({col['voltage']}), 2) AS maxVoltage,
+                ROUND(AVG({col['voltage']}), 2) AS avgVoltage,
+                ROUND(MIN({col['current']}), 2) AS minCurrent,
+                ROUND(MAX({col['current']}), 2) AS maxCurrent,
+                ROUND(AVG({col['current']}), 2) AS avgCurrent,
+                ROUND(MIN({col['power']}), 2) AS minPower,
+                ROUND(MAX({col['power']}), 2) AS maxPower
+            FROM {table}
+            WHERE {device_condition} AND timestamp > %s
             GROUP BY hour
             ORDER BY hour
         '''
         with connection.cursor() as cursor:
-            cursor.execute(query, (last_timestamp,))
+            cursor.execute(query, (*device_params, last_timestamp))
             rows = cursor.fetchall()
             data_batch = [(
                 row['hour'], row['energyProduced'], row['minVoltage'], row['maxVoltage'], row['avgVoltage'],
                 row['minCurrent'], row['maxCurrent'], row['avgCurrent'], row['minPower'], row['maxPower']
             ) for row in rows]
         if data_batch:
-            save_hourly_solar_summary(connection, data_batch)
+            save_hourly_solar_summary(connection, device_id, data_batch)
+
 
+DAILY_COLUMNS = {
+    'consumption': 'energyConsumption',
+    'production': 'solarProduction',
+}
 
-def update_daily_summary():
+def update_daily_summary(device_id=None):
     """
-    Aggregate and save daily summary from energyConsumption_raw and energyProduction_raw to dailySummary.
+    Aggregate and save a device's daily energy from its raw table to
+    dailySummary, or (by default) every device's. Consumption meters fill
+    energyConsumption and production meters solarProduction; site totals are
+    summed from these rows.
     """
+    if device_id is None:
+        return run_per_device(update_daily_summary)
+    kind = get_device(device_id)['kind']
+    column = DAILY_COLUMNS[kind]
     with db_connection() as connection:
         if not connection:
             return
         # Get last processed date
         with connection.cursor() as cursor:
-            cursor.execute("SELECT MAX(date) FROM dailySummary")
+            cursor.execute(f"SELECT date AS last FROM dailySummary WHERE device = %s AND {column} IS NOT NULL ORDER BY date DESC LIMIT 1", (device_id,))
             result = cursor.fetchone()
-            last_date = result['MAX(date)'] if result and result['MAX(date)'] else None
+            last_date = result['last'] if result and result['last'] else None
         if last_date is None:
             last_date = (datetime.now() - timedelta(days=2)).strftime('%Y-%m-%d')
         else:
-            last_date = (last_date - timedelta(days=2)).strftime('%Y-%m-%d') if isinstance(last_date, datetime) else last_date
-        # Aggregate new daily consumption
-        query_consumption = '''
+            last_date = (last_date - timedelta(days=2)).strftime('%Y-%m-%d') if isinstance(last_date, date) else last_date
+        # Aggregate new daily energy
+        table, col, device_condition, device_params = raw_source(kind, device_id)
+        query = f'''
             SELECT 
                 DATE(timestamp) AS date,
-                ROUND(MAX(energy) - MIN(energy), 2) AS energyConsumption
-            FROM energyConsumption_raw
-            WHERE DATE(timestamp) > %s
+                ROUND(MAX({col['energy']}) - MIN({col['energy']}), 2) AS energy
+            FROM {table}
+            WHERE {device_condition} AND DATE(timestamp) > %s
             GROUP BY DATE(timestamp)
         '''
         with connection.cursor() as cursor:
-            cursor.execute(query_consumption, (last_date,))
+            cursor.execute(query, (*device_params, last_date))
             rows = cursor.fetchall()
-            data_batch = [(row['date'], row['energyConsumption'], None) for row in rows]
+            if kind == 'consumption':
+                data_batch = [(row['date'], row['energy'], None) for row in rows]
+            else:
+                data_batch = [(row['date'], None, row['energy']) for row in rows]
         if data_batch:
-            save_daily_summary(connection, data_batch)
-        # Update solar production in daily summary
-        query_solar = '''
-            SELECT 
-                DATE(timestamp) AS date,
-                ROUND(MAX(energy) - MIN(energy), 2) AS totalSolarProduction
-            FROM energyProduction_raw
-            WHERE DATE(timestamp) > %s
+            save_daily_summary(connection, device_id, data_batch)
+
+def get_midnight_snapshots(start_date, end_date, device_ids):
+    """
+    Energy register values at 00:00 for each date in [start_date, end_date],
+    read from energyMidnightSnapshot with one primary-key range scan per
+    device. Rows of a consumption and a production meter merge into one row
+    per date, since each fills only its own column.
+    """
+    query = f"""
+        SELECT date, MAX(energyConsumption) AS energyConsumption, MAX(energyProduction) AS energyProduction
+        FROM energyMidnightSnapshot
+        WHERE device IN ({_placeholders(device_ids)}) AND date BETWEEN %s AND %s
+        GROUP BY date
+        ORDER BY date
+    """
+    with read_connection() as connection:
+        if not connection:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(query, (*device_ids, start_date, end_date))
+            return cursor.fetchall()
+
+def _energy_before_midnights(connection, kind, device_id, start_date, end_date):
+    """
+    Map each date in [start_date, end_date] to the device's last raw energy
+    reading before that date's midnight, carrying values forward over days without data.
+    """
+    table, col, device_condition, device_params = raw_source(kind, device_id)
+    first_day = datetime.combine(start_date - timedelta(days=1), datetime.min.time())
+    last_midnight = datetime.combine(end_date, datetime.min.time())
+    with connection.cursor() as cursor:
+        cursor.execute(f'''
+            SELECT {col['energy']} AS energy FROM {table}
+            WHERE {device_condition} AND timestamp < %s
+            ORDER BY timestamp DESC LIMIT 1
+        ''', (*device_params, first_day))
+        row = cursor.fetchone()
+        carried = row['energy'] if row else None
+        cursor.execute(f'''
+            SELECT MAX(timestamp) AS ts FROM {table}
+            WHERE {device_condition} AND timestamp >= %s AND timestamp < %s
             GROUP BY DATE(timestamp)
-        '''
+        ''', (*device_params, first_day, last_midnight))
+        last_per_day = [row['ts'] for row in cursor.fetchall()]
+        energy_by_day = {}
+        if last_per_day:
+            placeholders = ', '.join(['%s'] * len(last_per_day))
+            cursor.execute(f'''
+                SELECT timestamp, {col['energy']} AS energy FROM {table}
+                WHERE {device_condition} AND timestamp IN ({placeholders})
+            ''', (*device_params, *last_per_day))
+            energy_by_day = {row['timestamp'].date(): row['energy'] for row in cursor.fetchall()}
+    snapshots = []
+    day = start_date
+    while day <= end_date:
+        previous = day - timedelta(days=1)
+        if previous in energy_by_day:
+            carried = energy_by_day[previous]
+        if carried is not None:
+            snapshots.append((day, carried))
+        day += timedelta(days=1)
+    return snapshots
+
+def backfill_midnight_snapshots(start_date, end_date=None):
+    """
+    Populate energyMidnightSnapshot for [start_date, end_date] from the raw
+    tables, for every device. Snapshots already captured live are left untouched.
+    Returns the number of dates written per device.
+    """
+    end_date = end_date or date.today()
+    written = {}
+    with db_connection() as connection:
+        if not connection:
+            return written
+        for device in get_devices():
+            snapshots = _energy_before_midnights(connection, device['kind'], device['device_id'], start_date, end_date)
+            if snapshots:
+                save_midnight_snapshots(connection, device['kind'], device['device_id'], snapshots, overwrite=False)
+            written[device['device_id']] = len(snapshots)
+    return written
+
+# Load analytics. The hourly and daily jobs keep these compact tables up to
+# date as summaries are written, so the analytics endpoints read a few rows
+# per device instead of scanning raw samples:
+#
+# - demandPeak: per device and day, the highest average power over any
+#   DEMAND_INTERVAL-minute interval (the demand a utility meter registers).
+#   Each run re-derives the days from the last stored one onwards.
+# - loadHeatmap: per device, weekday and hour, the number of hours and their
+#   summed energy from hourSummary; average load is energy / hours.
+# - solarYieldHistogram: per production device and calendar month, daily
+#   yields from dailySummary counted in SOLAR_YIELD_BIN_WH-wide bins, from
+#   which yield percentiles are interpolated.
+#
+# The accumulators only ever add, so each records in analyticsProgress how
+# far it has read its source, in the same transaction as the addition. A
+# period is added only once the next one has ended too (the hour before the
+# previous one, the day before yesterday): the DB writers flush every 5-30 s,
+# so the summary of a period that has just ended may still be re-aggregated
+# with its last samples, and an added total is never revisited.
+
+def _as_datetime(value):
+    # Computed DATETIME expressions come back as strings
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+def _progress(connection, device_id, name):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT upto FROM analyticsProgress WHERE device = %s AND name = %s", (device_id, name))
+        row = cursor.fetchone()
+    return row['upto'] if row else None
+
+def _interval_demand(connection, device_id, since, minutes):
+    """[(interval_start, average power W)] of a consumption device from since onwards."""
+    if compression_enabled():
+        rows = _fetch_raw_rows(connection, 'consumption', device_id, since)
+        buckets = time_weighted_hourly(rows, ('power',), get_compression_config()['max_gap'], minutes, since=since)
+        return [(start, agg['power']['avg']) for start, agg in buckets.items()]
+    table, col, device_condition, device_params = raw_source('consumption', device_id)
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT {interval_bucket('timestamp', minutes)} AS interval_start, AVG({col['power']}) AS demand
+            FROM {table}
+            WHERE {device_condition} AND timestamp >= %s
+            GROUP BY interval_start
+        """, (*device_params, since))
+        return [(_as_datetime(row['interval_start']), float(row['demand'])) for row in cursor.fetchall()]
+
+def update_demand_peaks(device_id=None):
+    """
+    Derive the daily peak interval demand of one consumption device, or (by
+    default) of every one, from the last stored day onwards; the first run
+    starts at the device's first hourly summary.
+    """
+    if device_id is None:
+        return run_per_device(update_demand_peaks, 'consumption')
+    with db_connection() as connection:
+        if not connection:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT date AS last FROM demandPeak WHERE device = %s ORDER BY date DESC LIMIT 1", (device_id,))
+            row = cursor.fetchone()
+            if row:
+                since = datetime.combine(row['last'], datetime.min.time())
+            else:
+                cursor.execute("SELECT timestamp FROM hourSummary WHERE device = %s ORDER BY timestamp LIMIT 1", (device_id,))
+                row = cursor.fetchone()
+                if not row:
+                    return
+                since = row['timestamp']
+        peaks = {}
+        for start, demand in _interval_demand(connection, device_id, since, get_analytics_config()['demand_interval']):
+            day = start.date()
+            if day not in peaks or demand > peaks[day][0]:
+                peaks[day] = (round(demand, 2), start)
+        if peaks:
+            save_demand_peaks(connection, device_id, [(day, *peak) for day, peak in sorted(peaks.items())])
+
+def update_load_heatmap(device_id=None):
+    """
+    Add the settled hours (before the previous hour) of one consumption
+    device, or every one, summarised since the last run to its hour-of-week
+    load accumulators.
+    """
+    if device_id is None:
+        return run_per_device(update_load_heatmap, 'consumption')
+    with db_connection() as connection:
+        if not connection:
+            return
+        upto = _progress(connection, device_id, 'loadHeatmap') or datetime(1970, 1, 1)
+        settled = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT timestamp, energyConsumption FROM hourSummary
+                WHERE device = %s AND timestamp >= %s AND timestamp < %s
+            """, (device_id, upto, settled))
+            rows = cursor.fetchall()
+        if not rows:
+            return
+        cells = {}
+        for row in rows:
+            cell = cells.setdefault((row['timestamp'].weekday(), row['timestamp'].hour), [0, 0.0])
+            cell[0] += 1
+            cell[1] += row['energyConsumption']
+        latest = max(row['timestamp'] for row in rows)
+        add_load_heatmap(connection, device_id, [(*key, *cell) for key, cell in sorted(cells.items())], latest + timedelta(hours=1))
+
+def update_solar_yield(device_id=None):
+    """
+    Add the settled days (before yesterday) of one production device, or
+    every one, summarised since the last run to its daily yield histograms.
+    """
+    if device_id is None:
+        return run_per_device(update_solar_yield, 'production')
+    width = get_analytics_config()['yield_bin']
+    with db_connection() as connection:
+        if not connection:
+            return
+        upto = _progress(connection, device_id, 'solarYield') or datetime(1970, 1, 1)
         with connection.cursor() as cursor:
-            cursor.execute(query_solar, (last_date,))
+            cursor.execute("""
+                SELECT date, solarProduction FROM dailySummary
+                WHERE device = %s AND solarProduction IS NOT NULL AND date >= %s AND date < %s
+            """, (device_id, upto.date(), date.today() - timedelta(days=1)))
             rows = cursor.fetchall()
-            for row in rows:
-                cursor.execute(
-                    "UPDATE dailySummary SET solarProduction=%s WHERE date=%s",
-                    (row['totalSolarProduction'], row['date'])
-                )
-            connection.commit()
+        if not rows:
+            return
+        bins = {}
+        for row in rows:
+            key = (row['date'].month, int(max(row['solarProduction'], 0) // width))
+            bins[key] = bins.get(key, 0) + 1
+        latest = max(row['date'] for row in rows)
+        add_solar_yield(connection, device_id, [(*key, days) for key, days in sorted(bins.items())], datetime.combine(latest + timedelta(days=1), datetime.min.time()))
+
+def get_demand_peaks(device_id, start, end):
+    """Daily peak interval demand of a consumption device for start..end (dates), newest first."""
+    with read_connection() as connection:
+        if not connection:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT date, peakDemand, peakAt FROM demandPeak
+                WHERE device = %s AND date BETWEEN %s AND %s
+                ORDER BY date DESC
+            """, (_device_or_default('consumption', device_id), start, end))
+            return cursor.fetchall()
+
+def get_monthly_demand_peaks(device_id, start, end):
+    """Monthly peak interval demand (the highest daily peak of each month) for start..end, newest first."""
+    rows = get_demand_peaks(device_id, start, end)
+    if rows is None:
+        return None
+    months = {}
+    for row in rows:
+        month = row['date'].strftime('%Y-%m')
+        if month not in months or row['peakDemand'] > months[month]['peakDemand']:
+            months[month] = {'month': month, 'peakDemand': row['peakDemand'], 'peakAt': row['peakAt']}
+    return list(months.values())
+
+def get_load_heatmap(device_id=None):
+    """Average load (W) of a consumption device for each weekday (0 = Monday) and hour it has data for."""
+    with read_connection() as connection:
+        if not connection:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT weekday, hour, hours, energy FROM loadHeatmap
+                WHERE device = %s
+                ORDER BY weekday, hour
+            """, (_device_or_default('consumption', device_id),))
+            rows = cursor.fetchall()
+    # Wh over one hour is the average power in W
+    return [
+        {'weekday': row['weekday'], 'hour': row['hour'], 'hours': row['hours'], 'avgPower': round(row['energy'] / row['hours'], 2)}
+        for row in rows
+    ]
+
+def histogram_percentile(bins, percentile, width):
+    """
+    Value at `percentile` (0-100) of a histogram given as sorted (bin, count)
+    pairs over width-wide bins, interpolated linearly within its bin.
+    """
+    total = sum(count for _, count in bins)
+    target = percentile / 100 * total
+    cumulative = 0
+    for bin_index, count in bins:
+        if cumulative + count >= target:
+            return (bin_index + (target - cumulative) / count) * width
+        cumulative += count
+    return (bins[-1][0] + 1) * width
+
+def get_solar_yield(device_id=None, month=None, percentiles=(10, 50, 90)):
+    """
+    Daily yield percentiles (Wh) of a production device, over every day
+    counted or only those of one calendar month, or None without a database.
+    """
+    width = get_analytics_config()['yield_bin']
+    month_condition, month_params = ("AND month = %s", (month,)) if month else ("", ())
+    with read_connection() as connection:
+        if not connection:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT bin, SUM(days) AS days FROM solarYieldHistogram
+                WHERE device = %s {month_condition}
+                GROUP BY bin
+                ORDER BY bin
+            """, (_device_or_default('production', device_id), *month_params))
+            bins = [(row['bin'], int(row['days'])) for row in cursor.fetchall()]
+    return {
+        'month': month,
+        'days': sum(days for _, days in bins),
+        'binWidth': width,
+        'percentiles': {
+            f"p{percentile:g}": round(histogram_percentile(bins, percentile, width), 1) if bins else None
+            for percentile in percentiles
+        },
+    }
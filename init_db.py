@@ -1,5 +1,6 @@
 import pymysql
-from config import get_database_config
+from config import get_database_config, get_ac_config, get_solar_config
+from common import sqlite_store
 
 CONFIG = get_database_config()
 
@@ -18,6 +19,65 @@ def create_database_if_not_exists():
     finally:
         connection.close()
 
+def _has_column(cursor, table, column):
+    cursor.execute("""
+        SELECT COUNT(*) AS n FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (CONFIG['db_name'], table, column))
+    return cursor.fetchone()['n'] > 0
+
+def _add_device_column(cursor, table, device, position, keys):
+    # The default assigns existing rows to the single meter they came from; new rows must name theirs
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN device SMALLINT UNSIGNED NOT NULL DEFAULT {int(device)} {position}, {keys}")
+    cursor.execute(f"ALTER TABLE {table} ALTER COLUMN device DROP DEFAULT")
+
+def migrate_device_dimension(cursor):
+    """
+    Add the device column to tables created before several meters were
+    supported. Existing rows belong to the AC_DEVICE_ID and SOLAR_DEVICE_ID
+    meters; the combined daily and midnight rows are split between the two.
+    """
+    ac_device, solar_device = get_ac_config()['device_id'], get_solar_config()['device_id']
+    for table, device in (('energyConsumption_raw', ac_device), ('energyProduction_raw', solar_device)):
+        if not _has_column(cursor, table, 'device'):
+            _add_device_column(cursor, table, device, "AFTER id", "ADD INDEX idx_device_time (device, timestamp)")
+    for table, device in (('hourSummary', ac_device), ('hourSummarySolar', solar_device)):
+        if not _has_column(cursor, table, 'device'):
+            _add_device_column(cursor, table, device, "AFTER id",
+                               "DROP INDEX `timestamp`, ADD UNIQUE KEY uq_device_hour (device, timestamp)")
+    if not _has_column(cursor, 'dailySummary', 'device'):
+        _add_device_column(cursor, 'dailySummary', ac_device, "AFTER id",
+                           "DROP INDEX `date`, ADD UNIQUE KEY uq_device_date (device, date)")
+        cursor.execute("""
+            INSERT INTO dailySummary (device, date, solarProduction)
+            SELECT %s, date, solarProduction FROM dailySummary
+            WHERE device = %s AND solarProduction IS NOT NULL
+        """, (solar_device, ac_device))
+        cursor.execute("UPDATE dailySummary SET solarProduction = NULL WHERE device = %s", (ac_device,))
+    if not _has_column(cursor, 'energyMidnightSnapshot', 'device'):
+        _add_device_column(cursor, 'energyMidnightSnapshot', ac_device, "FIRST",
+                           "DROP PRIMARY KEY, ADD PRIMARY KEY (device, date)")
+        cursor.execute("""
+            INSERT INTO energyMidnightSnapshot (device, date, energyProduction)
+            SELECT %s, date, energyProduction FROM energyMidnightSnapshot
+            WHERE device = %s AND energyProduction IS NOT NULL
+        """, (solar_device, ac_device))
+        cursor.execute("UPDATE energyMidnightSnapshot SET energyProduction = NULL WHERE device = %s", (ac_device,))
+
+def migrate_change_versions(cursor):
+    """
+    Add the version column to summary tables created before the changes feed,
+    and the counter's timestamp. Existing rows get version 1, so a client
+    syncing from 0 receives them.
+    """
+    for table in ('hourSummary', 'hourSummarySolar', 'dailySummary'):
+        if not _has_column(cursor, table, 'version'):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN version BIGINT UNSIGNED NOT NULL DEFAULT 1, ADD INDEX idx_version (version)")
+            cursor.execute(f"ALTER TABLE {table} ALTER COLUMN version DROP DEFAULT")
+    if not _has_column(cursor, 'changeVersion', 'updatedAt'):
+        cursor.execute("ALTER TABLE changeVersion ADD COLUMN updatedAt DATETIME(6)")
+        cursor.execute("UPDATE changeVersion SET updatedAt = UTC_TIMESTAMP(6)")
+
 def create_tables():
     connection = pymysql.connect(
         host=CONFIG['db_host'],
@@ -31,28 +91,119 @@ def create_tables():
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS energyProduction_raw (
                     id INT AUTO_INCREMENT PRIMARY KEY,
+                    device SMALLINT UNSIGNED NOT NULL,
                     timestamp DATETIME NOT NULL,
                     voltage FLOAT NOT NULL,
                     current FLOAT NOT NULL,
                     power FLOAT NOT NULL,
-                    energy FLOAT NOT NULL
+                    energy FLOAT NOT NULL,
+                    INDEX idx_device_time (device, timestamp)
                 )
             """)
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS energyConsumption_raw (
                     id INT AUTO_INCREMENT PRIMARY KEY,
+                    device SMALLINT UNSIGNED NOT NULL,
                     timestamp DATETIME NOT NULL,
                     voltage FLOAT NOT NULL,
                     current FLOAT NOT NULL,
                     power FLOAT NOT NULL,
                     energy FLOAT NOT NULL,
                     frequency FLOAT NOT NULL,
-                    power_factor FLOAT NOT NULL
+                    power_factor FLOAT NOT NULL,
+                    INDEX idx_device_time (device, timestamp)
+                )
+            """)
+            # Compact storage (STORAGE_SCHEMA=compact): unscaled register values
+            # in the smallest fitting integer types, see common/compact.py
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS energyProduction_compact (
+                    device SMALLINT UNSIGNED NOT NULL,
+                    timestamp DATETIME NOT NULL,
+                    voltage SMALLINT UNSIGNED NOT NULL,
+                    current SMALLINT UNSIGNED NOT NULL,
+                    power INT UNSIGNED NOT NULL,
+                    energy INT UNSIGNED NOT NULL,
+                    PRIMARY KEY (device, timestamp)
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS energyConsumption_compact (
+                    device SMALLINT UNSIGNED NOT NULL,
+                    timestamp DATETIME NOT NULL,
+                    voltage SMALLINT UNSIGNED NOT NULL,
+                    current INT UNSIGNED NOT NULL,
+                    power INT UNSIGNED NOT NULL,
+                    energy INT UNSIGNED NOT NULL,
+                    frequency SMALLINT UNSIGNED NOT NULL,
+                    power_factor TINYINT UNSIGNED NOT NULL,
+                    PRIMARY KEY (device, timestamp)
+                )
+            """)
+            # Burst mode (AC_BURST_MODE=1): one row per second reduced from
+            # high-rate polling, plus the transients detected in those windows
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS energyConsumption_burst (
+                    device SMALLINT UNSIGNED NOT NULL,
+                    timestamp DATETIME NOT NULL,
+                    samples SMALLINT UNSIGNED NOT NULL,
+                    voltage_min FLOAT NOT NULL,
+                    voltage_max FLOAT NOT NULL,
+                    voltage_mean FLOAT NOT NULL,
+                    voltage_last FLOAT NOT NULL,
+                    current_min FLOAT NOT NULL,
+                    current_max FLOAT NOT NULL,
+                    current_mean FLOAT NOT NULL,
+                    current_last FLOAT NOT NULL,
+                    power_min FLOAT NOT NULL,
+                    power_max FLOAT NOT NULL,
+                    power_mean FLOAT NOT NULL,
+                    power_last FLOAT NOT NULL,
+                    energy_last FLOAT NOT NULL,
+                    frequency_min FLOAT NOT NULL,
+                    frequency_max FLOAT NOT NULL,
+                    frequency_mean FLOAT NOT NULL,
+                    frequency_last FLOAT NOT NULL,
+                    power_factor_min FLOAT NOT NULL,
+                    power_factor_max FLOAT NOT NULL,
+                    power_factor_mean FLOAT NOT NULL,
+                    power_factor_last FLOAT NOT NULL,
+                    peak_offset_ms SMALLINT UNSIGNED NOT NULL,
+                    PRIMARY KEY (device, timestamp)
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS powerPeakEvents (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    device SMALLINT UNSIGNED NOT NULL,
+                    timestamp DATETIME(3) NOT NULL,
+                    peakPower FLOAT NOT NULL,
+                    meanPower FLOAT NOT NULL,
+                    minVoltage FLOAT NOT NULL,
+                    samples SMALLINT UNSIGNED NOT NULL,
+                    INDEX idx_peak_device_time (device, timestamp)
+                )
+            """)
+            # Alerts raised and resolved by common/alerts.py
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS alertEvents (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    device SMALLINT UNSIGNED NOT NULL,
+                    rule VARCHAR(64) NOT NULL,
+                    severity VARCHAR(16) NOT NULL,
+                    state ENUM('firing', 'resolved') NOT NULL,
+                    timestamp DATETIME NOT NULL,
+                    value FLOAT NULL,
+                    threshold FLOAT NOT NULL,
+                    message VARCHAR(255) NOT NULL,
+                    INDEX idx_alert_device_time (device, timestamp),
+                    INDEX idx_alert_device_rule (device, rule)
                 )
             """)
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS hourSummary (
                     id INT AUTO_INCREMENT PRIMARY KEY,
+                    device SMALLINT UNSIGNED NOT NULL,
                     timestamp DATETIME NOT NULL,
                     energyConsumption FLOAT NOT NULL,
                     avgVoltage FLOAT NOT NULL,
@@ -60,12 +211,15 @@ def create_tables():
                     avgPower FLOAT NOT NULL,
                     avgFrequency FLOAT NOT NULL,
                     avgPF FLOAT NOT NULL,
-                    UNIQUE(timestamp)
+                    version BIGINT UNSIGNED NOT NULL,
+                    UNIQUE KEY uq_device_hour (device, timestamp),
+                    INDEX idx_version (version)
                 )
             """)
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS hourSummarySolar (
                     id INT AUTO_INCREMENT PRIMARY KEY,
+                    device SMALLINT UNSIGNED NOT NULL,
                     timestamp DATETIME NOT NULL,
                     energyProduced FLOAT NOT NULL,
                     minVoltage FLOAT NOT NULL,
@@ -76,23 +230,96 @@ def create_tables():
                     avgCurrent FLOAT NOT NULL,
                     minPower FLOAT NOT NULL,
                     maxPower FLOAT NOT NULL,
-                    UNIQUE(timestamp)
+                    version BIGINT UNSIGNED NOT NULL,
+                    UNIQUE KEY uq_device_hour (device, timestamp),
+                    INDEX idx_version (version)
                 )
             """)
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS dailySummary (
                     id INT AUTO_INCREMENT PRIMARY KEY,
+                    device SMALLINT UNSIGNED NOT NULL,
                     date DATE NOT NULL,
                     energyConsumption FLOAT,
                     solarProduction FLOAT,
-                    UNIQUE(date)
+                    version BIGINT UNSIGNED NOT NULL,
+                    UNIQUE KEY uq_device_date (device, date),
+                    INDEX idx_version (version)
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS energyMidnightSnapshot (
+                    device SMALLINT UNSIGNED NOT NULL,
+                    date DATE NOT NULL,
+                    energyConsumption FLOAT,
+                    energyProduction FLOAT,
+                    PRIMARY KEY (device, date)
                 )
             """)
+            # Load analytics maintained by the summary jobs (features/summary/service.py):
+            # daily peak 15-minute demand, hour-of-week load accumulators, daily
+            # solar yield histograms, and how far each has consumed its source
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS demandPeak (
+                    device SMALLINT UNSIGNED NOT NULL,
+                    date DATE NOT NULL,
+                    peakDemand FLOAT NOT NULL,
+                    peakAt DATETIME NOT NULL,
+                    PRIMARY KEY (device, date)
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS loadHeatmap (
+                    device SMALLINT UNSIGNED NOT NULL,
+                    weekday TINYINT UNSIGNED NOT NULL,
+                    hour TINYINT UNSIGNED NOT NULL,
+                    hours INT UNSIGNED NOT NULL,
+                    energy DOUBLE NOT NULL,
+                    PRIMARY KEY (device, weekday, hour)
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS solarYieldHistogram (
+                    device SMALLINT UNSIGNED NOT NULL,
+                    month TINYINT UNSIGNED NOT NULL,
+                    bin SMALLINT UNSIGNED NOT NULL,
+                    days INT UNSIGNED NOT NULL,
+                    PRIMARY KEY (device, month, bin)
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS analyticsProgress (
+                    device SMALLINT UNSIGNED NOT NULL,
+                    name VARCHAR(32) NOT NULL,
+                    upto DATETIME NOT NULL,
+                    PRIMARY KEY (device, name)
+                )
+            """)
+            # Change versions for /summary/changes: one row, bumped by every
+            # summary write (common/database.py next_version)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS changeVersion (
+                    id TINYINT UNSIGNED PRIMARY KEY,
+                    version BIGINT UNSIGNED NOT NULL,
+                    updatedAt DATETIME(6)
+                )
+            """)
+            migrate_device_dimension(cursor)
+            migrate_change_versions(cursor)
+            cursor.execute("INSERT IGNORE INTO changeVersion (id, version, updatedAt) VALUES (1, 1, UTC_TIMESTAMP(6))")
         connection.commit()
         print("Tables created successfully.")
     finally:
         connection.close()
 
+def create_sqlite_database():
+    # The embedded engine's schema lives in common/sqlite_store.py and is also created on first connect
+    sqlite_store.ensure_schema(CONFIG['sqlite_path'])
+    print(f"SQLite database '{CONFIG['sqlite_path']}' checked/created (WAL mode).")
+
 if __name__ == "__main__":
-    create_database_if_not_exists()
-    create_tables()
\ No newline at end of file
+    if CONFIG['backend'] == 'sqlite':
+        create_sqlite_database()
+    else:
+        create_database_if_not_exists()
+        create_tables()
\ No newline at end of file
@@ -1,15 +1,34 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from features.ac_monitor.api import router as ac_router
 from features.solar_monitor.api import router as solar_router
 from features.summary.api import router as summary_router
-from common.logging import setup_logging
+from features.diagnostics.api import router as diagnostics_router
+from features.billing.api import router as billing_router
+from features.overview.api import router as overview_router
+from features.alerts.api import router as alerts_router
+from common.logging import setup_logging, shutdown_logging
+from common import pipeline
 from fastapi.middleware.cors import CORSMiddleware
 
 
 # Entry point for FastAPI app
 
 setup_logging()
-app = FastAPI()
+
+# Capture, storage, live socket and scheduler start and stop with the app (common/pipeline.py)
+@asynccontextmanager
+async def lifespan(app):
+    await pipeline.start()
+    try:
+        yield
+    finally:
+        await pipeline.stop()
+        # uvicorn re-raises the terminating signal once shutdown completes, so
+        # the atexit flush never runs; write out the queued log records now
+        shutdown_logging()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,3 +40,8 @@ app.add_middleware(
 app.include_router(ac_router)
 app.include_router(solar_router)
 app.include_router(summary_router)
+app.include_router(diagnostics_router)
+app.include_router(billing_router)
+app.include_router(overview_router)
+app.include_router(alerts_router)
+
@@ -0,0 +1,302 @@
+"""
+Bulk-generate realistic 1 Hz raw history into the init_db.py schema.
+
+Consumption follows a household load profile (base load, fridge cycling,
+morning/evening peaks, random appliance bursts); production follows a solar
+day whose length and clear-sky peak vary with the season, with cloudy days
+and passing clouds. Night-time production rows are omitted, as the capture
+thread discards zero-power readings. Energy counters integrate power in Wh
+and can be reset periodically or at random, like a meter being cleared.
+
+    python -m tools.generate_history --days 30
+    python -m tools.generate_history --rows 10000000 --schema compact --devices 4 --load-data
+
+Generation appends after the newest existing row of each device, continuing
+its energy counter, so repeated runs grow the same history.
+"""
+import argparse
+import logging
+import math
+import os
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+import pymysql
+from common.compact import RAW_TABLES, encode_consumption_batch, encode_production_batch
+from common import sqlite_store
+from common.database import log_to_db_consumption, log_to_db_production, log_to_db_consumption_compact, log_to_db_production_compact
+from config import get_database_config, get_ac_config, get_solar_config
+
+SECONDS_PER_DAY = 86400
+HMS = [f"{h:02d}:{m:02d}:{s:02d}" for h in range(24) for m in range(60) for s in range(60)]
+
+
+class ConsumptionModel:
+    """Household load for one meter, one second at a time."""
+
+    def __init__(self, rng, scale=1.0):
+        self.rng = rng
+        self.scale = scale
+        self.appliance_power = 0.0
+        self.appliance_left = 0
+
+    def day(self, day):
+        rng = self.rng
+        self.base = rng.uniform(90, 180) * self.scale
+        self.fridge_phase = rng.randrange(1800)
+        self.morning = rng.uniform(6.5, 8.0) * 3600
+        self.evening = rng.uniform(18.0, 19.5) * 3600
+        self.evening_load = rng.uniform(600, 1600) * self.scale
+        self.voltage_offset = rng.gauss(0, 2)
+
+    def sample(self, second):
+        rng = self.rng
+        power = self.base
+        if (second + self.fridge_phase) % 1800 < 700:
+            power += 110 * self.scale
+        if self.morning <= second < self.morning + 5400:
+            power += 450 * self.scale
+        if self.evening <= second < self.evening + 4 * 3600:
+            power += self.evening_load
+        if self.appliance_left:
+            self.appliance_left -= 1
+            power += self.appliance_power
+        elif rng.random() < 1 / 2400:
+            self.appliance_power = rng.choice((1200, 1800, 2200, 2800)) * self.scale
+            self.appliance_left = rng.randrange(60, 900)
+        power = max(power + rng.gauss(0, 6), 0.0)
+        voltage = 230 + self.voltage_offset + 3 * math.sin(2 * math.pi * second / SECONDS_PER_DAY) - power * 0.0015 + rng.gauss(0, 0.4)
+        power_factor = min(0.99, 0.82 + power / 25000 + rng.gauss(0, 0.01))
+        frequency = 50 + rng.gauss(0, 0.03)
+        current = power / (voltage * power_factor)
+        return voltage, current, power, frequency, power_factor
+
+
+class SolarModel:
+    """PV array output for one meter with seasonal day length and clouds."""
+
+    def __init__(self, rng, peak=1500.0):
+        self.rng = rng
+        self.peak = peak
+
+    def day(self, day):
+        rng = self.rng
+        season = math.sin(2 * math.pi * (day.timetuple().tm_yday - 80) / 365)
+        self.length = (12 + 2.5 * season) * 3600
+        self.sunrise = 12.5 * 3600 - self.length / 2
+        self.clear_sky = self.peak * (0.8 + 0.2 * season)
+        self.cloudiness = rng.choice((0.0, 0.0, 0.1, 0.3, 0.6))
+        self.cloud_left = 0
+        self.cloud_factor = 1.0
+
+    def sample(self, second):
+        x = (second - self.sunrise) / self.length
+        if not 0 < x < 1:
+            return None
+        rng = self.rng
+        if self.cloud_left:
+            self.cloud_left -= 1
+        else:
+            self.cloud_factor = 1.0
+            if rng.random() < self.cloudiness / 300:
+                self.cloud_factor = rng.uniform(0.2, 0.7)
+                self.cloud_left = rng.randrange(30, 900)
+        power = self.clear_sky * math.sin(math.pi * x) ** 1.3 * self.cloud_factor + rng.gauss(0, 3)
+        if power < 1:
+            return None
+        voltage = 48 + 5 * power / self.peak + rng.gauss(0, 0.05)
+        return voltage, power / voltage, power
+
+
+class MeterHistory:
+    """Energy counter and row formatting for one device of one kind."""
+
+    def __init__(self, kind, device, model, energy=0.0, reset_days=0, reset_probability=0.0):
+        self.kind = kind
+        self.device = device
+        self.model = model
+        self.energy = energy
+        self.reset_days = reset_days
+        self.reset_probability = reset_probability
+        self.days = 0
+
+    def rows_for_day(self, day, first_second=0):
+        """Yield raw sample tuples for one calendar day, matching the capture queues."""
+        self.model.day(day)
+        self.days += 1
+        if (self.reset_days and self.days % self.reset_days == 0) or self.model.rng.random() < self.reset_probability:
+            self.energy = 0.0
+        prefix = day.strftime('%Y-%m-%d ')
+        consumption = self.kind == 'consumption'
+        for second in range(first_second, SECONDS_PER_DAY):
+            values = self.model.sample(second)
+            if values is None:
+                continue
+            power = values[2]
+            self.energy += power / 3600
+            timestamp = prefix + HMS[second]
+            if consumption:
+                voltage, current, power, frequency, power_factor = values
+                yield (timestamp, round(voltage, 1), round(current, 3), round(power, 1), int(self.energy),
+                       round(frequency, 1), round(power_factor, 2))
+            else:
+                voltage, current, power = values
+                yield (timestamp, round(voltage, 2), round(current, 2), round(power, 1), int(self.energy))
+
+
+def connect(local_infile=False):
+    config = get_database_config()
+    if config['backend'] == 'sqlite':
+        if local_infile:
+            raise ValueError("LOAD DATA is MySQL-only; generate SQLite history with plain inserts")
+        return sqlite_store.connect(config)
+    return pymysql.connect(
+        host=config['db_host'],
+        user=config['db_user'],
+        password=config['db_password'],
+        database=config['db_name'],
+        cursorclass=pymysql.cursors.DictCursor,
+        local_infile=local_infile
+    )
+
+
+def _tail(connection, kind, device, compact):
+    """(timestamp, energy) of the newest stored row for a device, or None."""
+    float_table, compact_table, _, _ = RAW_TABLES[kind]
+    with connection.cursor() as cursor:
+        if compact:
+            cursor.execute(f"SELECT timestamp, energy FROM {compact_table} WHERE device = %s ORDER BY timestamp DESC LIMIT 1", (device,))
+        else:
+            cursor.execute(f"SELECT timestamp, energy FROM {float_table} WHERE device = %s ORDER BY timestamp DESC LIMIT 1", (device,))
+        row = cursor.fetchone()
+    return (row['timestamp'], float(row['energy'])) if row else None
+
+
+def _write_insert(connection, kind, device, batch, compact):
+    if kind == 'consumption':
+        writer = log_to_db_consumption_compact if compact else log_to_db_consumption
+    else:
+        writer = log_to_db_production_compact if compact else log_to_db_production
+    # The writers log and swallow DB errors; stop rather than report rows that were never stored
+    if not writer(connection, device, batch):
+        raise RuntimeError(f"Inserting {len(batch)} {kind} rows for device {device} failed; see the error logged above")
+
+
+def _write_load_data(connection, kind, device, batch, compact):
+    """LOAD DATA LOCAL INFILE from a temporary TSV; several times faster than INSERT for bulk loads."""
+    float_table, compact_table, columns, _ = RAW_TABLES[kind]
+    if compact:
+        encode = encode_consumption_batch if kind == 'consumption' else encode_production_batch
+        rows, table, names = encode(device, batch), compact_table, ('device', 'timestamp') + columns
+    else:
+        rows, table, names = [(device, *row) for row in batch], float_table, ('device', 'timestamp') + columns
+    with tempfile.NamedTemporaryFile('w', suffix='.tsv', delete=False) as f:
+        f.writelines('\t'.join(map(str, row)) + '\n' for row in rows)
+        path = f.name
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} ({', '.join(names)})", (path,))
+        connection.commit()
+    finally:
+        os.unlink(path)
+
+
+def generate(start, days, consumption_devices, production_devices, compact=False, batch_size=20000,
+             load_data=False, reset_days=0, reset_probability=0.0, seed=None, connection=None):
+    """
+    Generate `days` days of history from `start` (a date) for every device,
+    continuing after any rows already stored. Returns rows written per kind.
+    """
+    own_connection = connection is None
+    connection = connection or connect(local_infile=load_data)
+    write = _write_load_data if load_data else _write_insert
+    rng = random.Random(seed)
+    written = {'consumption': 0, 'production': 0}
+    meters = [('consumption', device, ConsumptionModel(random.Random(rng.random()), scale=1 + 0.3 * i))
+              for i, device in enumerate(consumption_devices)]
+    meters += [('production', device, SolarModel(random.Random(rng.random()), peak=1500 + 300 * i))
+               for i, device in enumerate(production_devices)]
+    try:
+        if get_database_config()['backend'] == 'mysql':
+            with connection.cursor() as cursor:
+                cursor.execute("SET SESSION unique_checks = 0")
+        for kind, device, model in meters:
+            tail = _tail(connection, kind, device, compact)
+            first_day, first_second, energy = start, 0, 0.0
+            if tail:
+                resume = tail[0] + timedelta(seconds=1)
+                first_day = max(start, resume.date())
+                if first_day == resume.date():
+                    first_second = resume.hour * 3600 + resume.minute * 60 + resume.second
+                energy = tail[1]
+            history = MeterHistory(kind, device, model, energy, reset_days, reset_probability)
+            began = time.perf_counter()
+            batch = []
+            for offset in range(days - (first_day - start).days):
+                day = first_day + timedelta(days=offset)
+                for row in history.rows_for_day(day, first_second if offset == 0 else 0):
+                    batch.append(row)
+                    if len(batch) >= batch_size:
+                        write(connection, kind, device, batch, compact)
+                        written[kind] += len(batch)
+                        batch = []
+            if batch:
+                write(connection, kind, device, batch, compact)
+                written[kind] += len(batch)
+            logging.info(f"Generated {kind} history for device {device} in {time.perf_counter() - began:.1f}s")
+    finally:
+        if own_connection:
+            connection.close()
+    return written
+
+
+def days_for_rows(rows, devices=1):
+    """Calendar days of 1 Hz consumption history needed for `rows` rows across devices."""
+    return math.ceil(rows / SECONDS_PER_DAY / max(devices, 1))
+
+
+def parse_count(value):
+    """Parse row counts like 1M, 250k or 1000000."""
+    value = value.strip().lower()
+    multiplier = {'k': 10 ** 3, 'm': 10 ** 6, 'g': 10 ** 9}.get(value[-1:], 1)
+    return int(float(value.rstrip('kmg')) * multiplier)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument('--days', type=int, help="Days of history to generate")
+    size.add_argument('--rows', type=parse_count, help="Consumption rows to generate (e.g. 10M); sets --days")
+    parser.add_argument('--start', type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                        help="First day (YYYY-MM-DD). Defaults to ending yesterday.")
+    parser.add_argument('--schema', choices=['float', 'compact'], default=os.getenv('STORAGE_SCHEMA', 'float').lower())
+    parser.add_argument('--devices', type=int, default=1, help="Meters per kind")
+    parser.add_argument('--kind', choices=['consumption', 'production', 'both'], default='both')
+    parser.add_argument('--batch-size', type=int, default=20000)
+    parser.add_argument('--load-data', action='store_true', help="Use LOAD DATA LOCAL INFILE (server needs local_infile=ON)")
+    parser.add_argument('--reset-days', type=int, default=0, help="Reset energy counters every N days (0 = never)")
+    parser.add_argument('--reset-probability', type=float, default=0.002, help="Chance per meter-day of a counter reset")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    days = days_for_rows(args.rows, args.devices) if args.rows else (args.days or 7)
+    start = args.start or date.today() - timedelta(days=days)
+    ac_device, solar_device = get_ac_config()['device_id'], get_solar_config()['device_id']
+    consumption_devices = [ac_device] + [100 + i for i in range(1, args.devices)] if args.kind != 'production' else []
+    production_devices = [solar_device] + [200 + i for i in range(1, args.devices)] if args.kind != 'consumption' else []
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    began = time.perf_counter()
+    written = generate(
+        start, days, consumption_devices, production_devices, compact=args.schema == 'compact',
+        batch_size=args.batch_size, load_data=args.load_data, reset_days=args.reset_days,
+        reset_probability=args.reset_probability, seed=args.seed
+    )
+    elapsed = time.perf_counter() - began
+    total = sum(written.values())
+    print(f"Wrote {written} rows from {start} over {days} days in {elapsed:.1f}s ({total / elapsed:.0f} rows/s)")
+
+
+if __name__ == '__main__':
+    main()
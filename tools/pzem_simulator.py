@@ -0,0 +1,389 @@
+"""
+Virtual PZEM-004T (AC) and PZEM-017 (DC/solar) meters on pseudo-terminals.
+
+Each simulated bus opens a pty pair, symlinks the slave side to a stable path
+and answers Modbus RTU "read input registers" (0x04) requests for one or more
+slave addresses, so the capture threads can run unmodified:
+
+    python -m tools.pzem_simulator --ac-link /tmp/pzem-ac --solar-link /tmp/pzem-solar
+    AC_SERIAL_PORT=/tmp/pzem-ac SOLAR_SERIAL_PORT=/tmp/pzem-solar uvicorn main:app
+
+Register layouts match parse_pzem_data in features/ac_monitor/modbus.py and
+features/solar_monitor/modbus.py. Energy counters integrate the simulated power
+over wall-clock time. Latency, CRC corruption, short frames, dropped replies
+and periodic disconnects can be injected per bus.
+"""
+import argparse
+import logging
+import math
+import os
+import random
+import select
+import struct
+import threading
+import time
+import tty
+from common.modbus import calculate_crc, frame_ok, READ_HOLDING_REGISTERS
+
+REQUEST_LENGTH = 8
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_DATA_ADDRESS = 0x02
+
+
+def make_waveform(kind, base, amplitude=0.0, period=60.0, noise=0.0, phase=0.0):
+    """
+    Return f(t) -> value for a waveform kind:
+    constant, sine, square, sawtooth, random_walk or solar (a daylight bell
+    curve over `period` seconds that is zero for the "night" half).
+    """
+    if kind == 'random_walk':
+        state = {'value': base}
+        step = amplitude or 1.0
+
+        def walk(t):
+            # Bounded so long runs stay in a plausible range
+            state['value'] = min(max(state['value'] + random.gauss(0, step), 0.0), base + 10 * step)
+            return state['value']
+        return walk
+
+    def shape(t):
+        x = (t / period + phase) % 1.0
+        if kind == 'constant':
+            return 0.0
+        if kind == 'sine':
+            return math.sin(2 * math.pi * x)
+        if kind == 'square':
+            return 1.0 if x < 0.5 else -1.0
+        if kind == 'sawtooth':
+            return 2 * x - 1
+        if kind == 'solar':
+            return math.sin(2 * math.pi * x) if x < 0.5 else None
+        raise ValueError(f"Unknown waveform: {kind}")
+
+    def wave(t):
+        s = shape(t)
+        if s is None:
+            return 0.0
+        value = base * s if kind == 'solar' else base + amplitude * s
+        if noise:
+            value += random.gauss(0, noise)
+        return max(value, 0.0)
+    return wave
+
+
+def _split32(value):
+    """(low word, high word) for a 32-bit register pair, PZEM order."""
+    value = max(int(value), 0) & 0xFFFFFFFF
+    return value & 0xFFFF, value >> 16
+
+
+class AcMeter:
+    """PZEM-004T v3: 10 input registers."""
+    register_count = 10
+
+    def __init__(self, address, voltage, power, power_factor=0.95, frequency=50.0, energy_wh=0.0):
+        self.address = address
+        self.voltage = voltage
+        self.power = power
+        self.power_factor = power_factor
+        self.frequency = frequency
+        self.energy_wh = energy_wh
+        self._last = None
+
+    def registers(self, t):
+        voltage = self.voltage(t)
+        power = self.power(t)
+        if self._last is not None:
+            self.energy_wh += power * (t - self._last) / 3600
+        self._last = t
+        current = power / (voltage * self.power_factor) if voltage and power else 0.0
+        current_lo, current_hi = _split32(round(current * 1000))
+        power_lo, power_hi = _split32(round(power * 10))
+        energy_lo, energy_hi = _split32(self.energy_wh)
+        return (
+            min(round(voltage * 10), 0xFFFF),
+            current_lo, current_hi,
+            power_lo, power_hi,
+            energy_lo, energy_hi,
+            round(self.frequency * 10),
+            round(self.power_factor * 100),
+            0,  # alarm status
+        )
+
+
+class SolarMeter:
+    """PZEM-017: 8 input registers."""
+    register_count = 8
+
+    def __init__(self, address, voltage, power, energy_wh=0.0):
+        self.address = address
+        self.voltage = voltage
+        self.power = power
+        self.energy_wh = energy_wh
+        self._last = None
+
+    def registers(self, t):
+        voltage = self.voltage(t)
+        power = self.power(t)
+        if self._last is not None:
+            self.energy_wh += power * (t - self._last) / 3600
+        self._last = t
+        current = power / voltage if voltage else 0.0
+        power_lo, power_hi = _split32(round(power * 10))
+        energy_lo, energy_hi = _split32(self.energy_wh)
+        return (
+            min(round(voltage * 100), 0xFFFF),
+            min(round(current * 100), 0xFFFF),
+            power_lo, power_hi,
+            energy_lo, energy_hi,
+            0, 0,  # high / low voltage alarms
+        )
+
+
+class Faults:
+    """Per-bus fault injection. Rates are probabilities per request."""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, crc_error_rate=0.0, short_frame_rate=0.0,
+                 drop_rate=0.0, disconnect_every=0.0, disconnect_seconds=2.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.crc_error_rate = crc_error_rate
+        self.short_frame_rate = short_frame_rate
+        self.drop_rate = drop_rate
+        self.disconnect_every = disconnect_every
+        self.disconnect_seconds = disconnect_seconds
+
+    def delay(self):
+        delay = self.latency_ms + (random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+
+def build_response(address, registers):
+    payload = struct.pack(f'>BBB{len(registers)}H', address, READ_HOLDING_REGISTERS, 2 * len(registers), *registers)
+    return payload + calculate_crc(payload)
+
+
+def build_exception(address, function_code, code):
+    payload = struct.pack('>BBB', address, function_code | 0x80, code)
+    return payload + calculate_crc(payload)
+
+
+class SimulatedBus:
+    """
+    One pty pair standing in for a USB-RS485 adapter with one or more meters.
+    start() opens the pty and serves requests on a daemon thread until stop().
+    """
+
+    def __init__(self, link, meters, faults=None, name='bus', on_reply=None):
+        self.link = link
+        self.meters = {meter.address: meter for meter in meters}
+        self.faults = faults or Faults()
+        self.name = name
+        # Optional callback(address, registers, sent_at) used by benchmarks to match
+        # readings seen downstream with the time the meter produced them
+        self.on_reply = on_reply
+        self.requests = 0
+        self.responses = 0
+        self.disconnects = 0
+        self._master = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _open(self):
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        slave_name = os.ttyname(slave)
+        # Keep the slave fd open so the pty survives between client sessions
+        self._slave = slave
+        if os.path.lexists(self.link):
+            os.unlink(self.link)
+        os.symlink(slave_name, self.link)
+        self._master = master
+        logging.info(f"Simulated {self.name} bus on {self.link} -> {slave_name} (slaves {sorted(self.meters)})")
+
+    def _close(self):
+        for fd in (self._master, getattr(self, '_slave', None)):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._master = None
+        self._slave = None
+
+    def start(self):
+        self._open()
+        self._thread = threading.Thread(target=self._serve, name=f"pzem-sim-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+        self._close()
+        if os.path.lexists(self.link):
+            os.unlink(self.link)
+
+    def handle(self, frame):
+        """Return the reply bytes for one request frame, or None for no reply."""
+        if not frame_ok(frame):
+            return None  # a real slave ignores corrupted requests
+        address, function_code, register_address, count = struct.unpack('>BBHH', frame[:-2])
+        meter = self.meters.get(address)
+        if meter is None:
+            return None
+        if function_code != READ_HOLDING_REGISTERS:
+            return build_exception(address, function_code, ILLEGAL_FUNCTION)
+        if count == 0 or register_address + count > meter.register_count:
+            return build_exception(address, function_code, ILLEGAL_DATA_ADDRESS)
+        registers = meter.registers(time.time())
+        if self.on_reply:
+            self.on_reply(address, registers, time.time())
+        return build_response(address, registers[register_address:register_address + count])
+
+    def _inject(self, reply):
+        faults = self.faults
+        if random.random() < faults.drop_rate:
+            return None
+        if random.random() < faults.crc_error_rate:
+            reply = reply[:-1] + bytes([reply[-1] ^ 0xFF])
+        if random.random() < faults.short_frame_rate:
+            reply = reply[:random.randint(1, len(reply) - 1)]
+        return reply
+
+    def _serve(self):
+        buffer = b''
+        next_disconnect = time.monotonic() + self.faults.disconnect_every if self.faults.disconnect_every else None
+        while not self._stop.is_set():
+            if next_disconnect and time.monotonic() >= next_disconnect:
+                self.disconnects += 1
+                logging.info(f"Simulated disconnect on {self.link} for {self.faults.disconnect_seconds}s")
+                self._close()
+                os.unlink(self.link)
+                self._stop.wait(self.faults.disconnect_seconds)
+                self._open()
+                buffer = b''
+                next_disconnect = time.monotonic() + self.faults.disconnect_every
+                continue
+            readable, _, _ = select.select([self._master], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                buffer += os.read(self._master, 256)
+            except OSError:
+                continue
+            while len(buffer) >= REQUEST_LENGTH:
+                frame, buffer = buffer[:REQUEST_LENGTH], buffer[REQUEST_LENGTH:]
+                self.requests += 1
+                reply = self.handle(frame)
+                if reply is None:
+                    # Resynchronise on garbage: drop a byte and try again
+                    if not frame_ok(frame):
+                        buffer = frame[1:] + buffer
+                    continue
+                self.faults.delay()
+                reply = self._inject(reply)
+                if reply:
+                    os.write(self._master, reply)
+                    self.responses += 1
+
+    def stats(self):
+        return {'link': self.link, 'requests': self.requests, 'responses': self.responses, 'disconnects': self.disconnects}
+
+
+def _addresses(value):
+    return [int(part, 0) for part in value.split(',') if part]
+
+
+def create_ac_bus(link, addresses=(1,), waveform='sine', base_power=800.0, amplitude=600.0, period=60.0,
+                  noise=5.0, voltage=230.0, energy_wh=0.0, faults=None, on_reply=None):
+    meters = [
+        AcMeter(
+            address,
+            voltage=make_waveform('sine', voltage, 3.0, period * 7, 0.3, phase=i / 7),
+            power=make_waveform(waveform, base_power, amplitude, period, noise, phase=i / max(len(addresses), 1)),
+            energy_wh=energy_wh,
+        )
+        for i, address in enumerate(addresses)
+    ]
+    return SimulatedBus(link, meters, faults, name='ac', on_reply=on_reply)
+
+
+def create_solar_bus(link, addresses=(2,), waveform='solar', peak_power=1200.0, period=600.0,
+                     noise=10.0, voltage=48.0, energy_wh=0.0, faults=None, on_reply=None):
+    meters = [
+        SolarMeter(
+            address,
+            voltage=make_waveform('sine', voltage, 1.5, period, 0.05, phase=i / 5),
+            # Keep a trickle of output so parse_pzem_data does not discard every night sample
+            power=(lambda wave: (lambda t: max(wave(t), 1.0)))(
+                make_waveform(waveform, peak_power, peak_power / 2, period, noise, phase=i / 5)
+            ),
+            energy_wh=energy_wh,
+        )
+        for i, address in enumerate(addresses)
+    ]
+    return SimulatedBus(link, meters, faults, name='solar', on_reply=on_reply)
+
+
+def _faults_from_args(args):
+    return Faults(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        crc_error_rate=args.crc_error_rate,
+        short_frame_rate=args.short_frame_rate,
+        drop_rate=args.drop_rate,
+        disconnect_every=args.disconnect_every,
+        disconnect_seconds=args.disconnect_seconds,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate PZEM-004T / PZEM-017 meters on pseudo-terminals")
+    parser.add_argument('--ac-link', default='/tmp/pzem-ac', help="Symlink for the AC bus ('' to disable)")
+    parser.add_argument('--solar-link', default='/tmp/pzem-solar', help="Symlink for the solar bus ('' to disable)")
+    parser.add_argument('--ac-slaves', type=_addresses, default=[1], help="Comma-separated AC slave addresses")
+    parser.add_argument('--solar-slaves', type=_addresses, default=[2], help="Comma-separated solar slave addresses")
+    parser.add_argument('--ac-waveform', default='sine', choices=['constant', 'sine', 'square', 'sawtooth', 'random_walk'])
+    parser.add_argument('--ac-power', type=float, default=800.0, help="Mean AC load in W")
+    parser.add_argument('--ac-amplitude', type=float, default=600.0, help="AC load swing in W")
+    parser.add_argument('--solar-waveform', default='solar', choices=['constant', 'sine', 'square', 'sawtooth', 'random_walk', 'solar'])
+    parser.add_argument('--solar-power', type=float, default=1200.0, help="Peak solar output in W")
+    parser.add_argument('--period', type=float, default=60.0, help="Waveform period in seconds")
+    parser.add_argument('--energy-wh', type=float, default=0.0, help="Initial energy counter in Wh")
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--crc-error-rate', type=float, default=0.0)
+    parser.add_argument('--short-frame-rate', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--disconnect-every', type=float, default=0.0, help="Seconds between simulated unplugs (0 = never)")
+    parser.add_argument('--disconnect-seconds', type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    buses = []
+    if args.ac_link:
+        buses.append(create_ac_bus(
+            args.ac_link, args.ac_slaves, args.ac_waveform, args.ac_power, args.ac_amplitude,
+            args.period, energy_wh=args.energy_wh, faults=_faults_from_args(args)
+        ).start())
+    if args.solar_link:
+        buses.append(create_solar_bus(
+            args.solar_link, args.solar_slaves, args.solar_waveform, args.solar_power,
+            args.period * 10, energy_wh=args.energy_wh, faults=_faults_from_args(args)
+        ).start())
+    try:
+        while True:
+            time.sleep(10)
+            logging.info("Simulator stats: %s", [bus.stats() for bus in buses])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for bus in buses:
+            bus.stop()
+
+
+if __name__ == '__main__':
+    main()